@@ -0,0 +1,259 @@
+"""
+Structured access log.
+One JSON line per request with request id, endpoint, bytes in and out,
+stage timings and status. Successful requests are sampled, errors and slow
+requests are always logged. Records are written in batches by background thread,
+so request path only appends dict to queue
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from uuid import uuid4
+
+import orjson
+
+from config import config
+from logger import status_logger
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+_current_record: ContextVar[Optional[dict]] = ContextVar("access_record", default=None)
+
+
+def add_stage(
+        name: str,
+        seconds: float
+):
+    """
+    Function for adding time of stage to record of current request
+    :param name: name of stage
+    :param seconds: duration
+    :return:
+    """
+    record = _current_record.get()
+    if record is not None:
+        stages = record["stages_ms"]
+        stages[name] = stages.get(name, 0.0) + round(seconds * 1000, 3)
+
+
+@contextmanager
+def stage(
+        name: str
+):
+    """
+    Context manager for measuring stage of current request
+    :param name: name of stage
+    :return:
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - start)
+
+
+class AccessLogWriter:
+    """
+    Batched writer of access records.
+    Records are serialized and written by daemon thread every flush_interval,
+    when queue is full new records are dropped and counted
+    """
+    def __init__(
+            self,
+            path: str,
+            flush_interval: float,
+            max_queue: int,
+            rotation_size: int
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.rotation_size = rotation_size
+        self._queue: deque = deque()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        self.written_total = 0
+        self.dropped_total = 0
+
+    def submit(
+            self,
+            record: dict
+    ):
+        """
+        Function for queueing record, writer thread is started on first record
+        :param record: finished record
+        :return:
+        """
+        if len(self._queue) >= self.max_queue:
+            self.dropped_total += 1
+            return
+        self._queue.append(record)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        """
+        Function for starting writer thread once
+        :return:
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """
+        Function of writer thread, queue is flushed every flush_interval until close
+        :return:
+        """
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Function for writing queued records in one write
+        :return:
+        """
+        lines = []
+        while self._queue:
+            lines.append(orjson.dumps(self._queue.popleft()))
+        if not lines:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.rotation_size:
+                os.replace(self.path, f"{self.path}.{time.strftime('%Y%m%d%H%M%S')}")
+            with open(self.path, "ab") as file:
+                file.write(b"\n".join(lines) + b"\n")
+            self.written_total += len(lines)
+        except OSError as error:
+            status_logger.error(f"Error while writing access log: {error=}")
+
+    def close(self):
+        """
+        Function for flushing records on shutdown
+        :return:
+        """
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def metrics(self) -> dict:
+        """
+        Function for getting access log metrics
+        :return:
+        """
+        return {
+            "access_log_queue_depth": len(self._queue),
+            "access_log_written_total": self.written_total,
+            "access_log_dropped_total": self.dropped_total
+        }
+
+
+access_log_writer = AccessLogWriter(
+    path=config.access_log_info.path,
+    flush_interval=config.access_log_info.flush_interval,
+    max_queue=config.access_log_info.max_queue,
+    rotation_size=config.access_log_info.rotation_size
+)
+
+
+def should_log(
+        record: dict
+) -> bool:
+    """
+    Function for sampling: errors and slow requests are always logged
+    :param record: finished record
+    :return:
+    """
+    return (
+        record["error"] is not None
+        or record["status"] >= 500
+        or record["duration_ms"] >= config.access_log_info.slow_threshold * 1000
+        or random.random() < config.access_log_info.sample_rate
+    )
+
+
+class AccessLogMiddleware:
+    """
+    ASGI middleware which builds access record of request.
+    Request id is taken from X-Request-ID header or generated
+    and is returned in response header
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        """
+        Function for handling request with access record
+        :param scope: ASGI scope
+        :param receive: ASGI receive
+        :param send: ASGI send
+        :return:
+        """
+        if scope["type"] != "http" or not config.access_log_info.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        request_id = dict(scope["headers"]).get(REQUEST_ID_HEADER, b"")[:128].decode("latin-1") \
+            or uuid4().hex
+        record = {
+            "ts": time.time(),
+            "request_id": request_id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "endpoint": None,
+            "status": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "ttfb_ms": None,
+            "duration_ms": 0.0,
+            "stages_ms": {},
+            "error": None
+        }
+        token = _current_record.set(record)
+
+        async def receive_with_count():
+            message = await receive()
+            if message["type"] == "http.request":
+                record["bytes_in"] += len(message.get("body", b""))
+            return message
+
+        async def send_with_count(message):
+            if message["type"] == "http.response.start":
+                record["status"] = message["status"]
+                record["ttfb_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (REQUEST_ID_HEADER, request_id.encode("latin-1"))
+                ]
+            elif message["type"] == "http.response.body":
+                record["bytes_out"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_with_count, send_with_count)
+        except Exception as error:
+            record["error"] = type(error).__name__
+            if not record["status"]:
+                record["status"] = 500
+            raise
+        finally:
+            _current_record.reset(token)
+            endpoint = scope.get("endpoint")
+            record["endpoint"] = getattr(endpoint, "__name__", None)
+            record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+            if should_log(record):
+                access_log_writer.submit(record)
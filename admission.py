@@ -0,0 +1,210 @@
+"""
+Admission control for uploads.
+Limits count of concurrent uploads and sum of their declared sizes,
+extra uploads wait in FIFO queue or are rejected
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from config import config
+
+
+class AdmissionController:
+    """
+    Fair admission controller: requests are admitted strictly
+    in order of arrival, so big uploads are not starved by small ones
+    """
+    def __init__(
+            self,
+            max_concurrent: int,
+            max_bytes: int,
+            max_queue_depth: int,
+            queue_timeout: float,
+            retry_after: int
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_bytes = max_bytes
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self.active = 0
+        self.inflight_bytes = 0
+        self._waiters: deque = deque()
+
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.queued_total = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Count of waiting uploads
+        """
+        return len(self._waiters)
+
+    def _fits(
+            self,
+            size: int
+    ) -> bool:
+        """
+        Function for checking if upload fits limits of count and bytes
+        :param size: declared size of upload
+        :return:
+        """
+        return self.active < self.max_concurrent and self.inflight_bytes + size <= self.max_bytes
+
+    def _admit(
+            self,
+            size: int
+    ):
+        """
+        Function for taking slot and bytes by upload
+        :param size: declared size of upload
+        :return:
+        """
+        self.active += 1
+        self.inflight_bytes += size
+        self.admitted_total += 1
+
+    def _release(
+            self,
+            size: int
+    ):
+        """
+        Function for returning slot and bytes of finished upload, waiters are woken
+        :param size: declared size of upload
+        :return:
+        """
+        self.active -= 1
+        self.inflight_bytes -= size
+        self._wake()
+
+    def _wake(self):
+        """
+        Function for admitting waiters in order while head of queue fits,
+        cancelled waiters are skipped
+        :return:
+        """
+        while self._waiters:
+            size, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(size):
+                break
+            self._waiters.popleft()
+            self._admit(size)
+            future.set_result(None)
+
+    def _reject(self):
+        """
+        Function for rejecting upload with 503 and Retry-After
+        :return:
+        :raises HTTPException: always
+        """
+        self.rejected_total += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Too many uploads, try again later",
+            headers={"Retry-After": str(self.retry_after)}
+        )
+
+    async def _wait(
+            self,
+            size: int
+    ):
+        """
+        Function for waiting in queue until upload is admitted by _wake
+        :param size: declared size of upload
+        :return:
+        :raises HTTPException: queue timeout is exceeded
+        """
+        future = asyncio.get_running_loop().create_future()
+        waiter = (size, future)
+        self._waiters.append(waiter)
+        self.queued_total += 1
+        start_time = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._remove_waiter(waiter)
+            self._reject()
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(size)
+            else:
+                self._remove_waiter(waiter)
+            raise
+        finally:
+            wait_time = time.monotonic() - start_time
+            self.wait_seconds_total += wait_time
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_time)
+
+    def _remove_waiter(
+            self,
+            waiter: tuple
+    ):
+        """
+        Function for removing waiter which left queue, next waiters are woken
+        :param waiter: size and future of waiter
+        :return:
+        """
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        self._wake()
+
+    @asynccontextmanager
+    async def admit(
+            self,
+            size: int
+    ):
+        """
+        Context manager for upload slot
+        :param size: declared size of upload in bytes
+        :return:
+        """
+        size = min(max(size, 0), self.max_bytes)
+        if not self._waiters and self._fits(size):
+            self._admit(size)
+        elif self.queue_timeout <= 0 or len(self._waiters) >= self.max_queue_depth:
+            self._reject()
+        else:
+            await self._wait(size)
+        try:
+            yield
+        finally:
+            self._release(size)
+
+    def metrics(self) -> dict:
+        """
+        Function for getting admission metrics
+        :return:
+        """
+        return {
+            "uploads_active": self.active,
+            "uploads_inflight_bytes": self.inflight_bytes,
+            "uploads_queue_depth": self.queue_depth,
+            "uploads_admitted_total": self.admitted_total,
+            "uploads_rejected_total": self.rejected_total,
+            "uploads_queued_total": self.queued_total,
+            "uploads_queue_wait_seconds_total": self.wait_seconds_total,
+            "uploads_queue_wait_seconds_max": self.wait_seconds_max
+        }
+
+
+admission_controller = AdmissionController(
+    max_concurrent=config.admission_info.max_concurrent_uploads,
+    max_bytes=config.admission_info.max_inflight_bytes,
+    max_queue_depth=config.admission_info.max_queue_depth,
+    queue_timeout=config.admission_info.queue_timeout,
+    retry_after=config.admission_info.retry_after
+)
@@ -0,0 +1,104 @@
+"""
+Benchmark of request logging overhead on event loop:
+bare ASGI app, structured access log middleware with sampling and
+without it, and free-text loguru line per request with enqueue=True.
+Run from repository root: python -m benchmarks.access_log
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from loguru import logger
+
+import access_log
+from access_log import AccessLogMiddleware, AccessLogWriter, stage
+from config import config
+
+REQUESTS = 20000
+REPEAT = 5
+
+SCOPE = {
+    "type": "http",
+    "method": "POST",
+    "path": "/file/upload_file_to_folder",
+    "headers": [(b"content-length", b"1024")]
+}
+
+
+async def receive():
+    return {"type": "http.request", "body": b"x" * 1024, "more_body": False}
+
+
+async def send(_message):
+    return None
+
+
+async def app(scope, receive_message, send_message):
+    await receive_message()
+    with stage("db"):
+        pass
+    await send_message({"type": "http.response.start", "status": 200, "headers": []})
+    await send_message({"type": "http.response.body", "body": b"{}"})
+
+
+def loguru_app(bench_logger):
+    async def logged_app(scope, receive_message, send_message):
+        start = time.perf_counter()
+        await app(scope, receive_message, send_message)
+        bench_logger.info(
+            f"{scope['method']} {scope['path']} status=200 bytes_in=1024 bytes_out=2 "
+            f"duration={(time.perf_counter() - start) * 1000:.3f}ms"
+        )
+    return logged_app
+
+
+async def run(asgi_app) -> float:
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            await asgi_app(dict(SCOPE), receive, send)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        writer = AccessLogWriter(
+            path=os.path.join(directory, "access.jsonl"),
+            flush_interval=config.access_log_info.flush_interval,
+            max_queue=REQUESTS * REPEAT,
+            rotation_size=config.access_log_info.rotation_size
+        )
+        access_log.access_log_writer = writer
+        config.access_log_info.enabled = True
+        config.access_log_info.slow_threshold = 60.0
+
+        sink_id = logger.add(
+            os.path.join(directory, "loguru.log"),
+            enqueue=True,
+            filter=lambda record: record["extra"].get("name") == "benchmark"
+        )
+        bench_logger = logger.bind(name="benchmark")
+
+        results = {"bare app": asyncio.run(run(app))}
+        for sample_rate in (0.01, 1.0):
+            config.access_log_info.sample_rate = sample_rate
+            results[f"access log, sample {sample_rate}"] = asyncio.run(run(AccessLogMiddleware(app)))
+        results["loguru text line"] = asyncio.run(run(loguru_app(bench_logger)))
+
+        writer.close()
+        logger.remove(sink_id)
+
+        bare = results["bare app"]
+        for name, best in results.items():
+            print(
+                f"{name:<26} {REQUESTS} requests: {best * 1000:.1f} ms "
+                f"({best / REQUESTS * 1e6:.2f} us/request, +{(best - bare) / REQUESTS * 1e6:.2f} us)"
+            )
+        print(f"access log written {writer.written_total}, dropped {writer.dropped_total}")
+
+
+if __name__ == "__main__":
+    main()
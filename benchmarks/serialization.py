@@ -0,0 +1,107 @@
+"""
+Benchmark of list endpoint path from query to response body:
+ORM entities with jsonable_encoder against column mappings with orjson.
+Rows are seeded in a transaction which is rolled back, every path is timed
+for query with hydration and for encoding.
+Run from repository root: python -m benchmarks.serialization [rows]
+"""
+import asyncio
+import json
+import sys
+import time
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from database import engine
+from models.files import Files
+
+REPEAT = 5
+INSERTED_BY = "benchmark"
+FILES_COLUMNS = Files.__table__.c
+
+SEED = text("""
+insert into app.files (filename, folder_id, keys, inserted, inserted_by, md5)
+select 'file_' || id || '.jpg', id / 100, gen_random_uuid(), localtimestamp, :inserted_by, md5(id::text)
+from generate_series(1, :rows) as id
+""")
+
+
+async def orm_path(
+        session: AsyncSession
+) -> tuple[float, float, bytes]:
+    """
+    Old path of list endpoints: ORM entities encoded by jsonable_encoder
+    """
+    # Empty identity map, so every run hydrates new entities
+    session.expunge_all()
+    start = time.perf_counter()
+    result = await session.execute(
+        select(Files)
+        .where(Files.inserted_by == INSERTED_BY)
+        .order_by(Files.id)
+    )
+    entities = result.scalars().all()
+    fetched = time.perf_counter()
+    body = json.dumps(jsonable_encoder(entities)).encode()
+    return fetched - start, time.perf_counter() - fetched, body
+
+
+async def mapping_path(
+        session: AsyncSession
+) -> tuple[float, float, bytes]:
+    """
+    Path of list endpoints: column mappings encoded by orjson
+    """
+    start = time.perf_counter()
+    result = await session.execute(
+        select(*FILES_COLUMNS)
+        .where(FILES_COLUMNS.inserted_by == INSERTED_BY)
+        .order_by(FILES_COLUMNS.id)
+    )
+    rows = [dict(row) for row in result.mappings()]
+    fetched = time.perf_counter()
+    body = orjson.dumps(rows)
+    return fetched - start, time.perf_counter() - fetched, body
+
+
+async def run(
+        rows: int
+):
+    async with engine.connect() as connection:
+        transaction = await connection.begin()
+        try:
+            session = AsyncSession(bind=connection, expire_on_commit=False)
+            await session.execute(SEED, {"rows": rows, "inserted_by": INSERTED_BY})
+            await session.execute(text("analyze app.files"))
+
+            results = {}
+            for name, path in (("orm + jsonable_encoder", orm_path), ("mappings + orjson", mapping_path)):
+                timings = [await path(session) for _ in range(REPEAT)]
+                results[name] = timings[-1][2]
+                fetch = min(timing[0] for timing in timings)
+                encode = min(timing[1] for timing in timings)
+                total = min(timing[0] + timing[1] for timing in timings)
+                print(
+                    f"{name:<24} {rows} rows: query+hydration {fetch * 1000:.1f} ms, "
+                    f"encoding {encode * 1000:.1f} ms, total {total * 1000:.1f} ms "
+                    f"({total / rows * 1e6:.2f} us/row)"
+                )
+            orm_body, mapping_body = results.values()
+            assert orjson.loads(orm_body) == orjson.loads(mapping_body)
+            await session.close()
+        finally:
+            await transaction.rollback()
+    await engine.dispose()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    asyncio.run(run(rows))
+
+
+if __name__ == "__main__":
+    main()
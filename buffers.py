@@ -0,0 +1,124 @@
+"""
+Pool of reusable buffers for streaming I/O loops
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+from config import config
+
+BUFFER_SIZE = max(config.s3_info.multipart_chunk_size, 5 * 1024 * 1024)  # S3 minimum part size
+
+
+class BufferPool:
+    """
+    Pool of bytearray buffers of same size with cap on total memory.
+    Buffers are allocated on first use and then reused,
+    when all buffers are taken callers wait for free one
+    """
+    def __init__(
+            self,
+            buffer_size: int,
+            max_bytes: int
+    ):
+        self.buffer_size = buffer_size
+        self.max_buffers = max(1, max_bytes // buffer_size)
+        self.allocated = 0
+        self.in_use = 0
+        self._free: list[bytearray] = []
+        self._semaphore = asyncio.Semaphore(self.max_buffers)
+
+    async def acquire(self) -> bytearray:
+        """
+        Function for taking buffer from pool, it must be returned by release
+        :return: bytearray of buffer_size
+        """
+        await self._semaphore.acquire()
+        if self._free:
+            buffer = self._free.pop()
+        else:
+            buffer = bytearray(self.buffer_size)
+            self.allocated += 1
+        self.in_use += 1
+        return buffer
+
+    def release(
+            self,
+            buffer: bytearray
+    ):
+        """
+        Function for returning buffer to pool
+        :param buffer: buffer from acquire
+        :return:
+        """
+        self.in_use -= 1
+        self._free.append(buffer)
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def buffer(self):
+        """
+        Context manager for taking buffer from pool
+        :return: bytearray of buffer_size
+        """
+        buffer = await self.acquire()
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    def metrics(self) -> dict:
+        """
+        Function for getting pool metrics
+        :return:
+        """
+        return {
+            "buffers_allocated": self.allocated,
+            "buffers_in_use": self.in_use,
+            "buffers_max": self.max_buffers
+        }
+
+
+buffer_pool = BufferPool(
+    buffer_size=BUFFER_SIZE,
+    max_bytes=config.s3_info.buffer_pool_size
+)
+
+
+class ReadIntoFile:
+    """
+    Adapter of binary file with readinto for files which have only read,
+    like SpooledTemporaryFile of UploadFile before python 3.11.
+    Other attributes are taken from wrapped file
+    """
+    def __init__(
+            self,
+            file
+    ):
+        self.file = file
+
+    def readinto(
+            self,
+            view
+    ) -> int:
+        """
+        Function for reading file into buffer
+        :param view: writable buffer or memoryview
+        :return: count of read bytes
+        """
+        readinto = getattr(self.file, "readinto", None)
+        if readinto is not None:
+            return readinto(view)
+        content = self.file.read(len(view))
+        view[:len(content)] = content
+        return len(content)
+
+    def seekable(self) -> bool:
+        """
+        Function for zipfile, SpooledTemporaryFile has seekable only since python 3.11
+        :return:
+        """
+        seekable = getattr(self.file, "seekable", None)
+        return seekable() if seekable is not None else hasattr(self.file, "seek")
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
@@ -0,0 +1,268 @@
+"""
+Group commit of upload metadata.
+FilesMD5 and Files rows of concurrent uploads are collected for short window
+and are inserted in one transaction, so many uploads share one commit
+"""
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+from uuid import UUID, uuid4
+
+from sqlalchemy.exc import DBAPIError
+
+from config import config
+from database import create_session, engine, mark_committed
+from logger import file_logger
+from models.files import Files, FilesMD5
+from services.bulk_services import insert_rows
+from services.event_services import CREATED, add_events, file_event
+from services.folder_stats_services import apply_file_deltas
+
+DEADLOCK_SQLSTATE = "40P01"
+DEADLOCK_RETRIES = 3
+
+
+@dataclass
+class PendingFile:
+    """
+    Upload waiting for next batch, future gets committed file row
+    """
+    filename: str
+    folder_id: int
+    md5: str
+    file_size: int
+    mime_type: str
+    future: asyncio.Future
+    keys: UUID = field(default_factory=uuid4)
+
+
+class WriteCoalescer:
+    """
+    Coalescer of upload metadata inserts.
+    Batch is flushed after window from its first row or when it is full,
+    future of every upload is resolved with its row only after commit
+    """
+    def __init__(
+            self,
+            window: float,
+            max_batch_size: int
+    ):
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending: List[PendingFile] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+
+        self.batches_total = 0
+        self.rows_total = 0
+        self.failed_batches_total = 0
+
+    async def submit(
+            self,
+            filename: str,
+            folder_id: int,
+            md5_hash: str,
+            file_size: int,
+            mime_type: str
+    ) -> Files:
+        """
+        Function for adding upload to next batch
+        :param filename: name of file
+        :param folder_id: id of folder for file
+        :param md5_hash: md5 hash of file
+        :param file_size: file size
+        :param mime_type: type of file
+        :return: committed file row
+        """
+        loop = asyncio.get_running_loop()
+        pending = PendingFile(
+            filename=filename,
+            folder_id=folder_id,
+            md5=md5_hash,
+            file_size=file_size,
+            mime_type=mime_type,
+            future=loop.create_future()
+        )
+        self._pending.append(pending)
+        if len(self._pending) >= self.max_batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        file = await pending.future
+        # Rows are committed by flush task, so request is marked here
+        mark_committed()
+        return file
+
+    def _start_flush(self):
+        """
+        Function for starting flush task of next batch,
+        timer is started again if uploads are left
+        :return:
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self._pending[:self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._start_flush)
+
+    async def _insert_with_retry(
+            self,
+            batch: List[PendingFile]
+    ) -> List[Files]:
+        """
+        Function for inserting batch again when transaction is chosen as deadlock victim.
+        Folder counters are locked in order of id, but transactions of requests
+        can lock same rows in other order
+        :param batch: pending uploads
+        :return: file rows in order of batch
+        """
+        for attempt in range(1, DEADLOCK_RETRIES + 1):
+            try:
+                return await self._insert(batch)
+            except DBAPIError as error:
+                deadlock = getattr(error.orig, "sqlstate", None) == DEADLOCK_SQLSTATE
+                if not deadlock or attempt == DEADLOCK_RETRIES:
+                    raise
+                file_logger.warning(
+                    f"Deadlock while inserting batch of {len(batch)} uploads, {attempt=}"
+                )
+                await asyncio.sleep(self.window * attempt)
+
+    async def _flush(
+            self,
+            batch: List[PendingFile]
+    ):
+        """
+        Function for inserting batch and resolving futures of its uploads.
+        Failed batch is inserted one by one, so only bad uploads get error
+        :param batch: pending uploads
+        :return:
+        """
+        try:
+            files = await self._insert_with_retry(batch)
+        except Exception as error:
+            self.failed_batches_total += 1
+            if len(batch) > 1:
+                # One bad row must not fail other uploads of batch
+                file_logger.error(
+                    f"Batch of {len(batch)} uploads failed, retrying one by one: {error=}"
+                )
+                await asyncio.gather(*(self._flush([pending]) for pending in batch))
+                return
+            if not batch[0].future.done():
+                batch[0].future.set_exception(error)
+            return
+
+        self.batches_total += 1
+        self.rows_total += len(batch)
+        for pending, file in zip(batch, files):
+            if not pending.future.done():
+                pending.future.set_result(file)
+
+    async def _insert(
+            self,
+            batch: List[PendingFile]
+    ) -> List[Files]:
+        """
+        Function for inserting rows of batch in one transaction
+        :param batch: pending uploads
+        :return: file rows in order of batch
+        """
+        inserted = datetime.today()
+        md5_rows = {}
+        for pending in batch:
+            md5_rows.setdefault(pending.md5, {
+                "id": pending.md5,
+                "mime_type": pending.mime_type,
+                "file_size": pending.file_size,
+                "inserted": inserted,
+                "inserted_by": "StarWorker"
+            })
+        file_rows = [
+            {
+                "filename": pending.filename,
+                "folder_id": pending.folder_id,
+                "keys": pending.keys,
+                "inserted": inserted,
+                "inserted_by": "StarWorker",
+                "md5": pending.md5
+            }
+            for pending in batch
+        ]
+        file_table = Files.__table__
+
+        async with create_session(engine) as session:
+            try:
+                await insert_rows(
+                    session=session,
+                    table=FilesMD5.__table__,
+                    rows=list(md5_rows.values()),
+                    ignore_conflicts=True
+                )
+                returned = await insert_rows(
+                    session=session,
+                    table=file_table,
+                    rows=file_rows,
+                    returning=[file_table.c.id, file_table.c.keys]
+                )
+
+                folder_totals = {}
+                for pending in batch:
+                    count, size = folder_totals.get(pending.folder_id, (0, 0))
+                    folder_totals[pending.folder_id] = (count + 1, size + pending.file_size)
+                # Folders and all their ancestors are upserted by one statement in order of id
+                await apply_file_deltas(
+                    session=session,
+                    deltas=folder_totals
+                )
+                await add_events(
+                    session=session,
+                    events=[
+                        file_event(
+                            CREATED, row["keys"], row["folder_id"], row["filename"], row["md5"]
+                        )
+                        for row in file_rows
+                    ]
+                )
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+        ids = {keys: file_id for file_id, keys in returned}
+        return [Files(id=ids[row["keys"]], **row) for row in file_rows]
+
+    async def close(self):
+        """
+        Function for flushing pending uploads on shutdown
+        :return:
+        """
+        while self._pending:
+            self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def metrics(self) -> dict:
+        """
+        Function for getting group commit metrics
+        :return:
+        """
+        return {
+            "group_commit_pending": len(self._pending),
+            "group_commit_batches_total": self.batches_total,
+            "group_commit_rows_total": self.rows_total,
+            "group_commit_failed_batches_total": self.failed_batches_total
+        }
+
+
+write_coalescer = WriteCoalescer(
+    window=config.coalescer_info.window,
+    max_batch_size=config.coalescer_info.max_batch_size
+)
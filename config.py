@@ -1,6 +1,8 @@
 """
 Файл с обработкой конфига
 """
+from typing import List
+
 from yaml import YAMLError, load, SafeLoader
 from pydantic import BaseModel
 from logger import status_logger
@@ -15,6 +17,12 @@ class DBInfo(BaseModel):
     db_port: int
     db_user: str
     db_password: str
+    warmup_connections: int = 5
+    echo: bool = False
+    replica_urls: List[str] = []
+    replica_retry_interval: float = 5.0
+    replica_connect_timeout: float = 1.0
+    read_your_writes_seconds: float = 0.0
 
 
 class S3Info(BaseModel):
@@ -25,6 +33,15 @@ class S3Info(BaseModel):
     access_key: str
     secret_key: str
     bucket: str
+    multipart_chunk_size: int = 8 * 1024 * 1024
+    max_pool_connections: int = 50
+    buffer_pool_size: int = 512 * 1024 * 1024
+    upload_concurrency: int = 8
+    warmup_connections: int = 5
+    ranged_download_threshold: int = 64 * 1024 * 1024
+    range_size: int = 8 * 1024 * 1024
+    range_window: int = 4
+    range_retries: int = 3
 
 
 class APIInfo(BaseModel):
@@ -33,6 +50,101 @@ class APIInfo(BaseModel):
     """
     host: str
     port: int
+    max_batch_size: int = 1000
+    readiness_timeout: float = 2.0
+    drain_timeout: float = 30.0
+
+
+class ProfilingInfo(BaseModel):
+    """
+    Класс с параметрами профилирования
+    """
+    enabled: bool = False
+    token: str = ""
+    sample_rate: float = 0.0
+    interval: float = 0.005
+    max_duration: int = 60
+
+
+class AdmissionInfo(BaseModel):
+    """
+    Класс с ограничениями на одновременные загрузки
+    """
+    max_concurrent_uploads: int = 32
+    max_inflight_bytes: int = 2 * 1024 * 1024 * 1024
+    max_queue_depth: int = 100
+    queue_timeout: float = 10.0
+    retry_after: int = 5
+
+
+class ChunkingInfo(BaseModel):
+    """
+    Класс с параметрами хранения файлов чанками
+    """
+    min_size: int = 256 * 1024
+    avg_size: int = 1024 * 1024
+    max_size: int = 4 * 1024 * 1024
+    download_window: int = 8
+
+
+class ChangeFeedInfo(BaseModel):
+    """
+    Класс с параметрами ленты изменений
+    """
+    page_size: int = 1000
+    poll_interval: float = 1.0
+    keepalive_interval: float = 15.0
+    stream_duration: float = 300.0
+
+
+class ScrubInfo(BaseModel):
+    """
+    Класс с параметрами проверки целостности файлов в S3
+    """
+    batch_size: int = 1000
+    concurrency: int = 16
+    bandwidth: int = 50 * 1024 * 1024
+    verify_md5: bool = False
+
+
+class CoalescerInfo(BaseModel):
+    """
+    Класс с параметрами группового коммита метаданных загрузок
+    """
+    enabled: bool = False
+    window: float = 0.005
+    max_batch_size: int = 200
+
+
+class IngestInfo(BaseModel):
+    """
+    Класс с параметрами импорта объектов из S3 без скачивания
+    """
+    concurrency: int = 8
+    trust_etag: bool = True
+    multipart_copy_threshold: int = 1024 * 1024 * 1024
+    copy_part_size: int = 256 * 1024 * 1024
+
+
+class ArchiveInfo(BaseModel):
+    """
+    Класс с ограничениями распаковки архивов
+    """
+    max_entries: int = 100000
+    max_total_size: int = 10 * 1024 * 1024 * 1024
+
+
+class AccessLogInfo(BaseModel):
+    """
+    Класс с параметрами структурированного access-лога
+    """
+    enabled: bool = True
+    path: str = "./logs/access_logs/access.jsonl"
+    sample_rate: float = 0.01
+    slow_threshold: float = 1.0
+    flush_interval: float = 1.0
+    max_queue: int = 100000
+    rotation_size: int = 100 * 1024 * 1024
 
 
 class Config(BaseModel):
@@ -42,6 +154,15 @@ class Config(BaseModel):
     api_info: APIInfo
     s3_info: S3Info
     db_info: DBInfo
+    profiling_info: ProfilingInfo = ProfilingInfo()
+    admission_info: AdmissionInfo = AdmissionInfo()
+    chunking_info: ChunkingInfo = ChunkingInfo()
+    change_feed_info: ChangeFeedInfo = ChangeFeedInfo()
+    scrub_info: ScrubInfo = ScrubInfo()
+    coalescer_info: CoalescerInfo = CoalescerInfo()
+    ingest_info: IngestInfo = IngestInfo()
+    archive_info: ArchiveInfo = ArchiveInfo()
+    access_log_info: AccessLogInfo = AccessLogInfo()
 
 
 with open("./config.yaml", "r", encoding="utf-8") as stream:
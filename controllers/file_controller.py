@@ -2,18 +2,29 @@
 Модуль с контроллерами для разных сервисов
 """
 from datetime import datetime
+from typing import AsyncIterator
 
 from fastapi import UploadFile
 from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from access_log import stage
+from buffers import ReadIntoFile
 from logger import file_logger
-from schemas.files import FileUpload
+from schemas.files import FileUpload, IngestRequest
+from services.archive_services import expand_archive
+from services.chunk_services import store_file_chunked
+from services.ingest_services import ingest_from_s3
 from services.file_services import (
     get_md5_and_file_size,
     upload_file_to_s3,
+    stream_file_to_s3,
+    move_streamed_file,
+    delete_temp_file,
+    check_md5_in_db,
     create_new_files_md5,
-    create_new_file
+    create_new_file,
+    create_file_rows
 )
 
 
@@ -32,34 +43,228 @@ async def upload_file_controller(
     """
     try:
         start_time = datetime.now()
-        md5_hash, file_size, error = await get_md5_and_file_size(
-            file=file
-        )
+        with stage("hash"):
+            md5_hash, file_size, error = await get_md5_and_file_size(
+                file=file
+            )
         if error:
             return error
 
-        error = await upload_file_to_s3(
-            file=file,
-            md5_hash=md5_hash
+        with stage("s3_upload"):
+            error = await upload_file_to_s3(
+                file=file,
+                md5_hash=md5_hash
+            )
+        if error:
+            return error
+
+        with stage("db"):
+            new_file, error = await create_file_rows(
+                filename=file.filename,
+                folder_id=folder_id,
+                md5_hash=md5_hash,
+                file_size=file_size,
+                mime_type=file.content_type,
+                session=session
+            )
+        if error:
+            return error
+
+        uploaded_file = FileUpload(
+            keys=str(new_file.keys),
+            md5=new_file.md5,
+            id=new_file.id,
+            detail=f"File '{new_file.filename}' successfully uploaded"
+        )
+        all_time = datetime.now() - start_time
+        return JSONResponse(
+            status_code=200,
+            content={
+                "all_time": f"{all_time.seconds}.{all_time.microseconds}",
+                "info": uploaded_file.dict()
+            }
+        )
+    except Exception as error:
+        return JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while file upload",
+                "error": f"{error=}"
+            }
         )
+
+
+@file_logger.catch()
+async def upload_stream_controller(
+        session: AsyncSession,
+        stream: AsyncIterator[bytes],
+        filename: str,
+        mime_type: str,
+        folder_id: int
+) -> JSONResponse:
+    """
+    - Controller for streaming file upload
+    - **session**: Database session (auto)
+    - **stream**: Request body stream with file content
+    - **filename**: Name of file
+    - **mime_type**: Type of file
+    - **folder_id**: ID of folder for file
+    - **return**: Error of file info in JSONResponse
+    """
+    temp_key = None
+    moved = False
+    try:
+        start_time = datetime.now()
+        with stage("s3_upload"):
+            temp_key, md5_hash, file_size, error = await stream_file_to_s3(
+                stream=stream
+            )
+        if error:
+            return error
+
+        with stage("db"):
+            exist, error = await check_md5_in_db(
+                md5_hash=md5_hash,
+                session=session
+            )
+        if error:
+            return error
+
+        with stage("s3_move"):
+            error = await move_streamed_file(
+                temp_key=temp_key,
+                md5_hash=md5_hash,
+                file_size=file_size,
+                exists=exist
+            )
+        if error:
+            return error
+        moved = True
+
+        with stage("db"):
+            new_file, error = await create_file_rows(
+                filename=filename,
+                folder_id=folder_id,
+                md5_hash=md5_hash,
+                file_size=file_size,
+                mime_type=mime_type,
+                session=session
+            )
         if error:
             return error
 
-        error = await create_new_files_md5(
-            md5_hash=md5_hash,
-            file_size=file_size,
-            mime_type=file.content_type,
-            session=session
+        uploaded_file = FileUpload(
+            keys=str(new_file.keys),
+            md5=new_file.md5,
+            id=new_file.id,
+            detail=f"File '{new_file.filename}' successfully uploaded"
+        )
+        all_time = datetime.now() - start_time
+        return JSONResponse(
+            status_code=200,
+            content={
+                "all_time": f"{all_time.seconds}.{all_time.microseconds}",
+                "info": uploaded_file.dict()
+            }
         )
+    except Exception as error:
+        return JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while file upload",
+                "error": f"{error=}"
+            }
+        )
+    finally:
+        # Temporary object is left only when upload failed before move
+        if temp_key and not moved:
+            await delete_temp_file(temp_key)
+
+
+@file_logger.catch()
+async def upload_archive_controller(
+        session: AsyncSession,
+        file: UploadFile,
+        folder_id: int
+) -> JSONResponse:
+    """
+    - Controller for archive upload with expansion into folders
+    - **session**: Database session (auto)
+    - **file**: Zip or tar archive
+    - **folder_id**: ID of target folder
+    - **return**: Error or info of created files in JSONResponse
+    """
+    try:
+        start_time = datetime.now()
+        # Starlette already spooled archive, zip needs random access anyway
+        with stage("expand"):
+            expanded, error = await expand_archive(
+                fileobj=ReadIntoFile(file.file),
+                folder_id=folder_id,
+                session=session
+            )
         if error:
             return error
 
-        new_file, error = await create_new_file(
-            filename=file.filename,
-            folder_id=folder_id,
-            md5_hash=md5_hash,
-            session=session
+        all_time = datetime.now() - start_time
+        return JSONResponse(
+            status_code=200,
+            content={
+                "all_time": f"{all_time.seconds}.{all_time.microseconds}",
+                "info": expanded
+            }
+        )
+    except Exception as error:
+        return JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while archive upload",
+                "error": f"{error=}"
+            }
         )
+
+
+@file_logger.catch()
+async def upload_chunked_controller(
+        session: AsyncSession,
+        file: UploadFile,
+        folder_id: int
+) -> JSONResponse:
+    """
+    - Controller for file upload in chunked storage mode
+    - **session**: Database session (auto)
+    - **file**: File to upload
+    - **folder_id**: ID of folder for file
+    - **return**: Error of file info with chunk statistics in JSONResponse
+    """
+    try:
+        start_time = datetime.now()
+        with stage("chunking"):
+            md5_hash, file_size, chunk_stats, error = await store_file_chunked(
+                file=ReadIntoFile(file.file),
+                session=session
+            )
+        if error:
+            return error
+
+        with stage("db"):
+            error = await create_new_files_md5(
+                md5_hash=md5_hash,
+                file_size=file_size,
+                mime_type=file.content_type,
+                session=session
+            )
+        if error:
+            return error
+
+        with stage("db"):
+            new_file, error = await create_new_file(
+                filename=file.filename,
+                folder_id=folder_id,
+                md5_hash=md5_hash,
+                file_size=file_size,
+                session=session
+            )
         if error:
             return error
 
@@ -74,7 +279,8 @@ async def upload_file_controller(
             status_code=200,
             content={
                 "all_time": f"{all_time.seconds}.{all_time.microseconds}",
-                "info": uploaded_file.dict()
+                "info": uploaded_file.dict(),
+                "chunks": chunk_stats
             }
         )
     except Exception as error:
@@ -85,3 +291,43 @@ async def upload_file_controller(
                 "error": f"{error=}"
             }
         )
+
+
+@file_logger.catch()
+async def ingest_controller(
+        session: AsyncSession,
+        request: IngestRequest
+) -> JSONResponse:
+    """
+    - Controller for server-side ingest of existing S3 objects
+    - **session**: Database session (auto)
+    - **request**: Target folder and source objects
+    - **return**: Error or info of ingested objects in JSONResponse
+    """
+    try:
+        start_time = datetime.now()
+        with stage("ingest"):
+            ingested, error = await ingest_from_s3(
+                sources=request.sources,
+                folder_id=request.folder_id,
+                session=session
+            )
+        if error:
+            return error
+
+        all_time = datetime.now() - start_time
+        return JSONResponse(
+            status_code=200,
+            content={
+                "all_time": f"{all_time.seconds}.{all_time.microseconds}",
+                "info": ingested
+            }
+        )
+    except Exception as error:
+        return JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while ingesting objects",
+                "error": f"{error=}"
+            }
+        )
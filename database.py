@@ -2,13 +2,20 @@
 Файл с определением базы данных и генерацией
 сессий для подключения к ней
 """
-from typing import AsyncGenerator, Union
+import asyncio
+import itertools
+import time
+from contextvars import ContextVar
+from typing import AsyncGenerator, Optional, Union
 
+from fastapi import Request
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from config import config
+from logger import status_logger
 
 
 DATABASE_URL = f"postgresql+asyncpg://{config.db_info.db_user}" \
@@ -22,10 +29,41 @@ engine = create_async_engine(
     pool_size=70,
     max_overflow=10,
     future=True,
-    echo=True,
+    echo=config.db_info.echo,
     pool_pre_ping=True
 )
 
+# Marker of current request, it is set when request commits to primary
+_commit_marker: ContextVar[Optional[dict]] = ContextVar("commit_marker", default=None)
+
+
+def mark_committed():
+    """
+    Function for marking that current request committed to primary
+    :return:
+    """
+    marker = _commit_marker.get()
+    if marker is not None:
+        marker["committed"] = True
+
+
+def watch_commits(
+        session: AsyncSession
+):
+    """
+    Function for marking current request on commit of session.
+    Listener keeps marker itself, because commit is run in greenlet of sqlalchemy
+    :param session: session to primary
+    :return:
+    """
+    marker = _commit_marker.get()
+    if marker is not None:
+        event.listen(
+            session.sync_session,
+            "after_commit",
+            lambda _session: marker.update(committed=True)
+        )
+
 
 async def get_session() -> Union[AsyncSession, AsyncGenerator]:
     """
@@ -40,5 +78,203 @@ async def get_session() -> Union[AsyncSession, AsyncGenerator]:
     )
 
     async with async_session() as session:
+        watch_commits(session)
+        yield session
+
+
+replica_engines = [
+    create_async_engine(
+        replica_url,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=70,
+        max_overflow=10,
+        future=True,
+        echo=config.db_info.echo,
+        pool_pre_ping=True
+    )
+    for replica_url in config.db_info.replica_urls
+]
+
+PIN_COOKIE = "st_primary_until"
+
+
+class ReplicaRouter:
+    """
+    Round-robin choice of read replica.
+    Replica which failed to connect is skipped for retry interval
+    """
+    def __init__(
+            self,
+            engines: list,
+            retry_interval: float
+    ):
+        self.engines = engines
+        self.retry_interval = retry_interval
+        self._counter = itertools.count()
+        self._down_until = {}
+
+    def candidates(self) -> list:
+        """
+        Function for getting healthy replicas, starting from next in round robin
+        :return:
+        """
+        if not self.engines:
+            return []
+        start = next(self._counter) % len(self.engines)
+        now = time.monotonic()
+        return [
+            replica_engine
+            for replica_engine in self.engines[start:] + self.engines[:start]
+            if self._down_until.get(replica_engine, 0) <= now
+        ]
+
+    def mark_down(
+            self,
+            replica_engine
+    ):
+        """
+        Function for skipping replica for retry interval after failed connection
+        :param replica_engine: engine of replica
+        :return:
+        """
+        self._down_until[replica_engine] = time.monotonic() + self.retry_interval
+
+    def mark_up(
+            self,
+            replica_engine
+    ):
+        """
+        Function for returning replica to round robin after successful connection
+        :param replica_engine: engine of replica
+        :return:
+        """
+        self._down_until.pop(replica_engine, None)
+
+    def status(self) -> dict:
+        """
+        Function for getting state of replicas
+        :return: "up" or "down" by url of replica without password
+        """
+        now = time.monotonic()
+        return {
+            replica_engine.url.render_as_string(hide_password=True):
+                "down" if self._down_until.get(replica_engine, 0) > now else "up"
+            for replica_engine in self.engines
+        }
+
+
+replica_router = ReplicaRouter(
+    engines=replica_engines,
+    retry_interval=config.db_info.replica_retry_interval
+)
+
+
+def create_session(
+        bind
+) -> AsyncSession:
+    """
+    Создание сессии к движку.
+    :param bind: Движок основной базы или реплики
+    :return: Асинхронная сессия к базе данных
+    """
+    async_session = sessionmaker(
+        bind=bind,
+        class_=AsyncSession,
+        expire_on_commit=False,
+        autocommit=False
+    )
+    return async_session()
+
+
+def is_pinned_to_primary(
+        request: Request
+) -> bool:
+    """
+    Function for checking read-your-writes pin of client
+    :param request: request
+    :return:
+    """
+    try:
+        return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+async def get_read_session(
+        request: Request
+) -> Union[AsyncSession, AsyncGenerator]:
+    """
+    Получение сессии к реплике для read-only эндпоинтов.
+    Если реплики недоступны или клиент недавно писал, используется основная база
+    :return: Асинхронная сессия к базе данных
+    """
+    session = None
+    if not is_pinned_to_primary(request):
+        for replica_engine in replica_router.candidates():
+            session = create_session(replica_engine)
+            try:
+                await asyncio.wait_for(
+                    session.connection(),
+                    timeout=config.db_info.replica_connect_timeout
+                )
+            except Exception as replica_error:
+                await session.close()
+                session = None
+                replica_router.mark_down(replica_engine)
+                replica_url = replica_engine.url.render_as_string(hide_password=True)
+                status_logger.error(f"Реплика {replica_url} недоступна: {replica_error=}")
+                continue
+            replica_router.mark_up(replica_engine)
+            break
+
+    if session is None:
+        session = create_session(engine)
+        watch_commits(session)
+    try:
         yield session
+    finally:
+        await session.close()
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware which pins client to primary for some time
+    after successful request which committed to primary, so client reads its own writes.
+    Method is not checked, some GET endpoints write too
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+                scope["type"] != "http"
+                or not replica_engines
+                or config.db_info.read_your_writes_seconds <= 0
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        marker = {"committed": False}
+
+        async def send_with_pin(message):
+            if (
+                    message["type"] == "http.response.start"
+                    and message["status"] < 400
+                    and marker["committed"]
+            ):
+                pin_until = time.time() + config.db_info.read_your_writes_seconds
+                cookie = (
+                    f"{PIN_COOKIE}={pin_until:.3f}; "
+                    f"Max-Age={int(config.db_info.read_your_writes_seconds) + 1}; Path=/; HttpOnly"
+                )
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"set-cookie", cookie.encode("latin-1"))
+                ]
+            await send(message)
 
+        token = _commit_marker.set(marker)
+        try:
+            await self.app(scope, receive, send_with_pin)
+        finally:
+            _commit_marker.reset(token)
@@ -0,0 +1,313 @@
+"""
+Startup warm-up, readiness checks and graceful drain of transfers
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import text
+
+from access_log import access_log_writer, add_stage
+from admission import admission_controller
+from coalescer import write_coalescer
+from config import config
+from database import engine, replica_engines
+from logger import status_logger
+from services.event_services import change_feed
+from storage import get_s3_client, close_s3_client
+
+
+class TransferTracker:
+    """
+    Counter of in-flight transfers.
+    After stop_accepting new uploads are rejected with 503 and /ready returns 503
+    """
+    def __init__(self):
+        self.accepting = True
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @asynccontextmanager
+    async def track(
+            self,
+            reject_when_draining: bool = True
+    ):
+        """
+        Context manager for counting transfer as in-flight
+        :param reject_when_draining: raise 503 if service is draining
+        :return:
+        """
+        if reject_when_draining and not self.accepting:
+            raise HTTPException(
+                status_code=503,
+                detail="Service is shutting down",
+                headers={"Retry-After": "5"}
+            )
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self._idle.set()
+
+    def stop_accepting(self):
+        """
+        Function for switching to draining, it is not reverted
+        :return:
+        """
+        self.accepting = False
+
+    async def drain(
+            self,
+            timeout: float
+    ) -> bool:
+        """
+        Function for waiting in-flight transfers
+        :param timeout: max time to wait in seconds
+        :return: True if all transfers were finished
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+transfer_tracker = TransferTracker()
+
+
+def declared_size(
+        headers: list
+) -> int:
+    """
+    Function for getting declared size of upload from raw ASGI headers,
+    uploads without Content-Length are counted as one part
+    :param headers: headers from ASGI scope
+    :return: size in bytes
+    :raises ValueError: header is not a non-negative integer
+    """
+    content_length = dict(headers).get(b"content-length")
+    if content_length is None:
+        return config.s3_info.multipart_chunk_size
+    if not content_length.strip().isdigit():
+        raise ValueError(f"Malformed Content-Length {content_length[:32]!r}")
+    return int(content_length)
+
+
+async def upload_slot():
+    """
+    Marker dependency of upload endpoints. Admission is done
+    by AdmissionMiddleware, because multipart body is parsed before dependencies
+    """
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware with admission control of upload endpoints.
+    Slot is taken by declared Content-Length before body is read,
+    so rejected uploads get 503 without sending body and waiting
+    uploads push back on client
+    """
+    def __init__(self, app):
+        self.app = app
+        self._upload_paths = None
+
+    def upload_paths(
+            self,
+            app
+    ) -> set:
+        """
+        Function for getting paths of routes with upload_slot dependency
+        :param app: FastAPI app from scope
+        :return:
+        """
+        if self._upload_paths is None:
+            self._upload_paths = {
+                route.path
+                for route in app.routes
+                if isinstance(route, APIRoute)
+                and any(dependency.call is upload_slot for dependency in route.dependant.dependencies)
+            }
+        return self._upload_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.upload_paths(scope["app"]):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            size = declared_size(scope["headers"])
+        except ValueError as error:
+            response = JSONResponse(
+                status_code=400,
+                content={
+                    "message": "Bad Content-Length header",
+                    "error": f"{error=}"
+                }
+            )
+            await response(scope, receive, send)
+            return
+
+        admitted = False
+        try:
+            async with transfer_tracker.track():
+                start = time.perf_counter()
+                async with admission_controller.admit(size):
+                    admitted = True
+                    add_stage("admission", time.perf_counter() - start)
+                    await self.app(scope, receive, send)
+        except HTTPException as error:
+            if admitted:
+                raise
+            response = JSONResponse(
+                status_code=error.status_code,
+                content={"detail": error.detail},
+                headers=error.headers
+            )
+            await response(scope, receive, send)
+
+
+async def download_slot():
+    """
+    Dependency for download endpoints, downloads are not rejected while draining
+    """
+    async with transfer_tracker.track(reject_when_draining=False):
+        yield
+
+
+async def warm_up_db(
+        count: int
+):
+    """
+    Function for opening db connections in pool before first request
+    :param count: count of connections
+    :return:
+    """
+    if count <= 0:
+        return
+    connections = await asyncio.gather(*(engine.connect() for _ in range(count)))
+    try:
+        await asyncio.gather(*(
+            connection.execute(text("select 1")) for connection in connections
+        ))
+    finally:
+        await asyncio.gather(*(connection.close() for connection in connections))
+
+
+async def warm_up_s3(
+        count: int
+):
+    """
+    Function for opening S3 client and connections of its pool
+    :param count: count of connections
+    :return:
+    """
+    s3_client = await get_s3_client()
+    await asyncio.gather(*(
+        s3_client.head_bucket(Bucket=config.s3_info.bucket) for _ in range(count)
+    ))
+
+
+async def warm_up():
+    """
+    Function for warming up db and S3 connections on startup.
+    Errors are logged, app is started anyway
+    :return:
+    """
+    results = await asyncio.gather(
+        warm_up_db(config.db_info.warmup_connections),
+        warm_up_s3(config.s3_info.warmup_connections),
+        return_exceptions=True
+    )
+    for name, result in zip(("db", "s3"), results):
+        if isinstance(result, Exception):
+            status_logger.error(f"Error while warming up {name} connections: {result=}")
+
+
+async def check_db():
+    """
+    Function for probing db with simple query, errors are raised
+    :return:
+    """
+    async with engine.connect() as connection:
+        await connection.execute(text("select 1"))
+
+
+async def check_s3():
+    """
+    Function for probing S3 bucket, errors are raised
+    :return:
+    """
+    s3_client = await get_s3_client()
+    await s3_client.head_bucket(Bucket=config.s3_info.bucket)
+
+
+async def check_readiness() -> dict:
+    """
+    Function for probing db and S3 concurrently
+    :return: "ok" or error for every dependency
+    """
+    checks = {
+        "postgres": check_db(),
+        "s3": check_s3()
+    }
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(check, timeout=config.api_info.readiness_timeout)
+            for check in checks.values()
+        ),
+        return_exceptions=True
+    )
+    return {
+        name: "ok" if not isinstance(result, BaseException) else f"{result!r}"
+        for name, result in zip(checks, results)
+    }
+
+
+async def drain_transfers():
+    """
+    Function for draining on SIGTERM before server stops listening:
+    stop accepting uploads and wait in-flight transfers
+    :return:
+    """
+    status_logger.info(f"Получен SIGTERM, жду завершения {transfer_tracker.in_flight} передач")
+    transfer_tracker.stop_accepting()
+    if not await transfer_tracker.drain(timeout=config.api_info.drain_timeout):
+        status_logger.error(
+            f"{transfer_tracker.in_flight} transfers were not finished before shutdown"
+        )
+
+
+async def shutdown():
+    """
+    Function for graceful shutdown: flush pending writes and close pools.
+    Transfers are drained earlier by drain_transfers, because server
+    waits for requests before lifespan shutdown
+    :return:
+    """
+    transfer_tracker.stop_accepting()
+    await write_coalescer.close()
+    await change_feed.close()
+    await close_s3_client()
+    await engine.dispose()
+    for replica_engine in replica_engines:
+        await replica_engine.dispose()
+    await asyncio.to_thread(access_log_writer.close)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    """
+    App lifespan with warm-up and graceful drain
+    """
+    status_logger.info("Прогреваю соединения")
+    await warm_up()
+    yield
+    status_logger.info("Останавливаю API")
+    await shutdown()
@@ -3,10 +3,19 @@ File with app initialization
 """
 
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
 
+from access_log import AccessLogMiddleware, access_log_writer
+from admission import admission_controller
+from buffers import buffer_pool
+from coalescer import write_coalescer
+from database import ReadYourWritesMiddleware, replica_router
+from lifecycle import AdmissionMiddleware, check_readiness, lifespan, transfer_tracker
+from profiler import ProfilingMiddleware
 from routers import (
+    admin_router,
     article_router,
+    change_router,
     file_router
 )
 
@@ -14,11 +23,19 @@ app = FastAPI(
     debug=False,
     title="StarTransferAPI",
     description="API для работы с S3 хранилищем",
-    version="0.1"
+    version="0.1",
+    lifespan=lifespan
 )
 
 app.include_router(file_router)
 app.include_router(article_router)
+app.include_router(change_router)
+app.include_router(admin_router)
+
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(AccessLogMiddleware)
 
 
 @app.get("/ping", include_in_schema=False)
@@ -28,6 +45,41 @@ async def ping():
     }
 
 
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """
+    - Endpoint for readiness probe, 503 while draining or if db or S3 is unavailable
+    - **return**: Result of every check
+    """
+    checks = await check_readiness()
+    is_ready = transfer_tracker.accepting and all(
+        result == "ok" for result in checks.values()
+    )
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={
+            "ready": is_ready,
+            "accepting": transfer_tracker.accepting,
+            **checks,
+            "replicas": replica_router.status()
+        }
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    lines = [
+        f"startransfer_{name} {value}"
+        for name, value in {
+            **admission_controller.metrics(),
+            **buffer_pool.metrics(),
+            **write_coalescer.metrics(),
+            **access_log_writer.metrics()
+        }.items()
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n")
+
+
 @app.get("/", include_in_schema=False)
 async def redirect_to_docs():
     return RedirectResponse("/docs")
@@ -0,0 +1,332 @@
+"""
+Harness for checking query plans of hot router queries.
+Large tables are seeded and migrations are applied in a transaction which is rolled back.
+Statements are recorded from routers and services themselves, compiled with
+postgresql dialect, explained and sequential scans on large tables are reported.
+Run from repository root: python -m migrations.check_plans [rows]
+"""
+import asyncio
+import json
+import sys
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql.asyncpg import dialect as asyncpg_dialect
+
+from config import config
+from logger import status_logger
+from migrations.migrate import connect, migrate
+from routers.article_router import delete_all_files, get_folder_stats
+from routers.file_router import find_file_by_name, get_file_info, get_files_info
+from schemas.files import FilesInfoRequest
+from services.chunk_services import get_manifest
+from services.event_services import get_events
+from services.file_services import check_md5_in_db
+from services.folder_stats_services import (
+    apply_file_deltas, attach_folder_stats, detach_folder_stats
+)
+from services.tree_services import COPY_SUBTREE, IN_SUBTREE, get_file_with_size
+
+LARGE_TABLES = {"files", "files_md5", "files_tree", "file_chunks", "folder_stats", "change_events"}
+DIALECT = asyncpg_dialect()
+# Errors raised by routers and services on empty results of RecordingSession
+MISSING_ROW_ERRORS = (AttributeError, TypeError, HTTPException)
+
+SEED = """
+insert into app.files_tree (id, parent_id, name, keys, inserted, inserted_by)
+select id, 900000000 + greatest((id - 900000000) / 10, 1), 'folder_' || id, gen_random_uuid(),
+       localtimestamp, 'check_plans'
+from generate_series(900000001, 900000000 + $1) as id;
+
+insert into app.files_md5 (id, mime_type, file_size, inserted, inserted_by)
+select md5(id::text), 'application/octet-stream', id, localtimestamp, 'check_plans'
+from generate_series(1, $1) as id;
+
+insert into app.files (filename, folder_id, keys, inserted, inserted_by, md5)
+select 'file_' || id || '.bin', 900000000 + (id % ($1 / 10 + 1)) + 1, gen_random_uuid(),
+       localtimestamp, 'check_plans', md5(id::text)
+from generate_series(1, $1) as id;
+
+insert into app.folder_stats (folder_id)
+select id from app.files_tree where inserted_by = 'check_plans'
+on conflict do nothing;
+
+insert into app.chunks (id, chunk_size, inserted, inserted_by)
+select md5(id::text), id, localtimestamp, 'check_plans'
+from generate_series(1, $1) as id
+on conflict do nothing;
+
+insert into app.file_chunks (md5, seq, chunk_id)
+select md5((id / 4)::text), id % 4, md5(id::text)
+from generate_series(1, $1) as id
+on conflict do nothing;
+
+insert into app.change_events (entity, action, keys, folder_id, name, md5)
+select 'file', 'created', keys, folder_id, filename, md5
+from app.files
+where inserted_by = 'check_plans';
+"""
+
+# Sample parameters from seeded rows
+SAMPLES = {
+    "keys": "select keys from app.files where inserted_by = 'check_plans' limit 1",
+    "keys_batch": "select array_agg(keys) from (select keys from app.files "
+                  "where inserted_by = 'check_plans' limit 100) as sample",
+    "md5": "select md5('42')",
+    "folder_id": "select 900000002",
+    "target_folder_id": "select 900000003",
+    "cursor": "select max(id) - 500 from app.change_events",
+}
+
+# Calls of routers and services which build hot statements
+CHECKS = {
+    "get_file_info / delete_file / download_file": lambda session, sample: get_file_info(
+        keys=sample["keys"], session=session
+    ),
+    "get_files_info": lambda session, sample: get_files_info(
+        request=FilesInfoRequest(keys=sample["keys_batch"]), session=session
+    ),
+    "find_file_by_name": lambda session, sample: find_file_by_name(
+        filename="file_12345", session=session
+    ),
+    "delete_all_files": lambda session, sample: delete_all_files(
+        folder_id=sample["folder_id"], session=session
+    ),
+    "check_md5_in_db": lambda session, sample: check_md5_in_db(
+        md5_hash=sample["md5"], session=session
+    ),
+    "get_file_with_size": lambda session, sample: get_file_with_size(
+        keys=sample["keys"], session=session
+    ),
+    "get_folder_stats": lambda session, sample: get_folder_stats(
+        folder_id=sample["folder_id"], session=session
+    ),
+    "apply_file_deltas": lambda session, sample: apply_file_deltas(
+        session=session, deltas={sample["folder_id"]: (1, 1), sample["target_folder_id"]: (1, 1)}
+    ),
+    "detach_folder_stats": lambda session, sample: detach_folder_stats(
+        session=session, folder_id=sample["folder_id"]
+    ),
+    "attach_folder_stats": lambda session, sample: attach_folder_stats(
+        session=session, folder_id=sample["folder_id"], parent_id=sample["target_folder_id"]
+    ),
+    "copy_folder subtree": lambda session, sample: session.execute(
+        COPY_SUBTREE,
+        {"folder_id": sample["folder_id"], "target_folder_id": sample["target_folder_id"]}
+    ),
+    "move_folder subtree check": lambda session, sample: session.execute(
+        IN_SUBTREE,
+        {"folder_id": sample["folder_id"], "target_folder_id": sample["target_folder_id"]}
+    ),
+    "get_manifest": lambda session, sample: get_manifest(
+        md5_hash=sample["md5"], session=session
+    ),
+    "get_changes": lambda session, sample: get_events(
+        session=session, cursor=sample["cursor"], limit=config.change_feed_info.page_size
+    ),
+}
+
+
+class EmptyResult:
+    """
+    Result without rows
+    """
+    def __iter__(self):
+        """
+        Function for iterating over rows
+        :return: empty iterator
+        """
+        return iter(())
+
+    def scalars(self):
+        """
+        Function for getting scalars of rows
+        :return: same result
+        """
+        return self
+
+    def mappings(self):
+        """
+        Function for getting mappings of rows
+        :return: same result
+        """
+        return self
+
+    def all(self):
+        """
+        Function for getting all rows
+        :return: empty list
+        """
+        return []
+
+    def first(self):
+        """
+        Function for getting first row
+        :return: None
+        """
+        return None
+
+    def scalar(self):
+        """
+        Function for getting first column of first row
+        :return: None
+        """
+        return None
+
+
+class RecordingSession:
+    """
+    Session which records statements instead of executing them.
+    Every statement gets empty result, so function is stopped by missing rows
+    and only statements executed before that are recorded
+    """
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, statement, params=None):
+        """
+        Function for recording statement
+        :param statement: sqlalchemy statement
+        :param params: parameters of execution
+        :return: empty result
+        """
+        self.statements.append((statement, params or {}))
+        return EmptyResult()
+
+    async def delete(self, instance):
+        """
+        Function for skipping deletion of instance
+        :param instance: deleted instance
+        """
+
+    async def flush(self):
+        """
+        Function for skipping flush
+        """
+
+    async def commit(self):
+        """
+        Function for skipping commit
+        """
+
+    async def rollback(self):
+        """
+        Function for skipping rollback
+        """
+
+
+def compile_statement(
+        statement,
+        params: dict
+) -> tuple[str, list]:
+    """
+    Function for compiling statement to sql with positional parameters of asyncpg
+    :param statement: sqlalchemy statement
+    :param params: parameters of execution
+    :return: sql and values of parameters
+    """
+    compiled = statement.compile(dialect=DIALECT)
+    values = compiled.construct_params(params)
+    sql = compiled.string % tuple(f"${index}" for index in range(1, len(compiled.positiontup) + 1))
+    return sql, [values[name] for name in compiled.positiontup]
+
+
+async def record_statements(
+        check,
+        sample: dict
+) -> Optional[list[tuple[str, list]]]:
+    """
+    Function for recording statements of call
+    :param check: call of router or service
+    :param sample: sample parameters
+    :return: compiled statements or None if call failed not on missing rows
+    """
+    session = RecordingSession()
+    try:
+        await check(session, sample)
+    except MISSING_ROW_ERRORS:
+        # Functions fail on missing rows after their statements are recorded
+        pass
+    except Exception:
+        status_logger.exception("Проверка завершилась с ошибкой")
+        return None
+    return [compile_statement(statement, params) for statement, params in session.statements]
+
+
+def find_seq_scans(
+        plan: dict
+) -> list[str]:
+    """
+    Function for finding sequential scans on large tables in plan
+    :param plan: node of json plan
+    :return: names of scanned tables
+    """
+    tables = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in LARGE_TABLES:
+        tables.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        tables.extend(find_seq_scans(child))
+    return tables
+
+
+async def check_plans(
+        rows: int
+) -> list[str]:
+    """
+    Function for explaining queries on seeded database
+    :param rows: count of seeded rows in large tables
+    :return: failed checks
+    """
+    connection = await connect()
+    failures = []
+    try:
+        transaction = connection.transaction()
+        await transaction.start()
+        try:
+            await migrate(connection)
+            for statement in SEED.split(";"):
+                if statement.strip():
+                    await connection.execute(statement, *([rows] if "$1" in statement else []))
+            await connection.execute(
+                "analyze app.files, app.files_md5, app.files_tree, app.chunks, "
+                "app.file_chunks, app.folder_stats, app.change_events"
+            )
+            sample = {name: await connection.fetchval(query) for name, query in SAMPLES.items()}
+            for name, check in CHECKS.items():
+                statements = await record_statements(check, sample)
+                if statements is None:
+                    print(f"{name}: failed")
+                    failures.append(name)
+                    continue
+                if not statements:
+                    print(f"{name}: no statements recorded")
+                    failures.append(name)
+                for number, (sql, values) in enumerate(statements, start=1):
+                    plan = json.loads(
+                        await connection.fetchval(f"explain (format json) {sql}", *values)
+                    )
+                    seq_scans = find_seq_scans(plan[0]["Plan"])
+                    status = f"seq scan on {', '.join(seq_scans)}" if seq_scans else "ok"
+                    print(f"{name} #{number}: {status}")
+                    if seq_scans:
+                        failures.append(f"{name} #{number}")
+        finally:
+            await transaction.rollback()
+    finally:
+        await connection.close()
+    return failures
+
+
+def main():
+    """
+    Function for running check of plans from command line
+    """
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    failures = asyncio.run(check_plans(rows))
+    if failures:
+        print(f"Failed checks: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Runner of versioned schema migrations.
+Every file from migrations/versions is applied once in its own transaction,
+applied versions are stored in app.schema_migrations.
+Run from repository root: python -m migrations.migrate
+"""
+import asyncio
+import os
+
+import asyncpg
+
+from config import config
+from logger import status_logger
+
+VERSIONS_DIR = os.path.join(os.path.dirname(__file__), "versions")
+
+
+async def connect() -> asyncpg.Connection:
+    return await asyncpg.connect(
+        user=config.db_info.db_user,
+        password=config.db_info.db_password,
+        host=config.db_info.db_host,
+        port=config.db_info.db_port,
+        database=config.db_info.db_name
+    )
+
+
+def get_versions() -> list[tuple[str, str]]:
+    """
+    Function for getting migration files in order
+    :return: version and path of every migration
+    """
+    return [
+        (filename.split("_", 1)[0], os.path.join(VERSIONS_DIR, filename))
+        for filename in sorted(os.listdir(VERSIONS_DIR))
+        if filename.endswith(".sql")
+    ]
+
+
+async def migrate(
+        connection: asyncpg.Connection
+) -> list[str]:
+    """
+    Function for applying new migrations
+    :param connection: connection to db
+    :return: applied versions
+    """
+    await connection.execute("""
+        create schema if not exists app;
+        create table if not exists app.schema_migrations (
+            version varchar primary key,
+            name varchar not null,
+            applied timestamp not null default localtimestamp
+        );
+    """)
+    applied = {
+        row["version"]
+        for row in await connection.fetch("select version from app.schema_migrations")
+    }
+    new_versions = []
+    for version, path in get_versions():
+        if version in applied:
+            continue
+        with open(path, "r", encoding="utf-8") as file:
+            sql = file.read()
+        async with connection.transaction():
+            await connection.execute(sql)
+            await connection.execute(
+                "insert into app.schema_migrations (version, name) values ($1, $2)",
+                version,
+                os.path.basename(path)
+            )
+        status_logger.info(f"Применена миграция {os.path.basename(path)}")
+        new_versions.append(version)
+    return new_versions
+
+
+async def main():
+    connection = await connect()
+    try:
+        new_versions = await migrate(connection)
+        print(f"Applied migrations: {new_versions or 'none'}")
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
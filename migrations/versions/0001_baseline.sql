@@ -0,0 +1,41 @@
+-- Tables which existed before migrations were introduced
+create schema if not exists app;
+
+create table if not exists app.articles (
+    id bigserial primary key,
+    title varchar not null,
+    folder_id bigint not null,
+    inserted timestamp,
+    inserted_by varchar not null,
+    constraint articles_unique_folder_id unique (folder_id)
+);
+
+create table if not exists app.files (
+    id bigserial primary key,
+    filename varchar not null,
+    folder_id bigint not null,
+    keys uuid not null,
+    inserted timestamp,
+    inserted_by varchar not null,
+    md5 varchar not null,
+    constraint files_unique_keys unique (keys)
+);
+
+create table if not exists app.files_md5 (
+    id varchar primary key,
+    mime_type varchar not null,
+    file_size bigint not null,
+    inserted timestamp,
+    inserted_by varchar not null
+);
+
+create table if not exists app.files_tree (
+    id bigserial primary key,
+    parent_id bigint,
+    name varchar not null,
+    keys uuid not null,
+    inserted timestamp,
+    inserted_by varchar not null,
+    order_n integer,
+    constraint files_tree_unique_keys unique (keys)
+);
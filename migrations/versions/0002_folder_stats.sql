@@ -0,0 +1,50 @@
+-- Aggregates of files by folder, maintained by services/folder_stats_services.py.
+-- Applied by migrations/migrate.py after 0001_baseline, which creates the backfilled tables
+create table if not exists app.folder_stats (
+    folder_id bigint primary key,
+    direct_count bigint not null default 0,
+    direct_size bigint not null default 0,
+    recursive_count bigint not null default 0,
+    recursive_size bigint not null default 0
+);
+
+-- Backfill of existing folders, same statement as REBUILD of folder_stats_services
+with recursive direct as (
+    select files.folder_id,
+           count(*) as direct_count,
+           coalesce(sum(files_md5.file_size), 0) as direct_size
+    from app.files
+    left join app.files_md5 on files_md5.id = files.md5
+    group by files.folder_id
+), closure(ancestor_id, folder_id) as (
+    select id, id
+    from app.files_tree
+    union
+    select files_tree.parent_id, closure.folder_id
+    from closure
+    join app.files_tree on files_tree.id = closure.ancestor_id
+    where files_tree.parent_id <> files_tree.id
+), recursive_totals as (
+    select closure.ancestor_id as folder_id,
+           sum(direct.direct_count) as recursive_count,
+           sum(direct.direct_size) as recursive_size
+    from closure
+    join direct on direct.folder_id = closure.folder_id
+    group by closure.ancestor_id
+)
+insert into app.folder_stats (
+    folder_id, direct_count, direct_size, recursive_count, recursive_size
+)
+select files_tree.id,
+       coalesce(direct.direct_count, 0),
+       coalesce(direct.direct_size, 0),
+       coalesce(recursive_totals.recursive_count, 0),
+       coalesce(recursive_totals.recursive_size, 0)
+from app.files_tree
+left join direct on direct.folder_id = files_tree.id
+left join recursive_totals on recursive_totals.folder_id = files_tree.id
+on conflict (folder_id) do update set
+    direct_count = excluded.direct_count,
+    direct_size = excluded.direct_size,
+    recursive_count = excluded.recursive_count,
+    recursive_size = excluded.recursive_size;
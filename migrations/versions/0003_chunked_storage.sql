@@ -0,0 +1,13 @@
+create table if not exists app.chunks (
+    id varchar primary key,
+    chunk_size bigint not null,
+    inserted timestamp,
+    inserted_by varchar not null
+);
+
+create table if not exists app.file_chunks (
+    md5 varchar not null,
+    seq integer not null,
+    chunk_id varchar not null,
+    primary key (md5, seq)
+);
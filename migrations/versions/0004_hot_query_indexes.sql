@@ -0,0 +1,9 @@
+-- Folder listings, folder deletion and stats rebuild
+create index if not exists ix_app_files_folder_id on app.files (folder_id);
+-- Reference lookups of blobs
+create index if not exists ix_app_files_md5 on app.files (md5);
+-- Subtree walks (copy, move, stats)
+create index if not exists ix_app_files_tree_parent_id on app.files_tree (parent_id);
+-- Substring search in find_file_by_name (ilike '%...%')
+create extension if not exists pg_trgm;
+create index if not exists ix_app_files_filename_trgm on app.files using gin (filename gin_trgm_ops);
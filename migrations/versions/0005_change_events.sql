@@ -0,0 +1,12 @@
+-- Append-only feed of file and folder changes, written in transaction of change
+create table if not exists app.change_events (
+    id bigserial primary key,
+    entity varchar not null,
+    action varchar not null,
+    keys uuid not null,
+    folder_id bigint not null,
+    parent_id bigint,
+    name varchar not null,
+    md5 varchar,
+    inserted timestamptz not null default clock_timestamp()
+);
@@ -0,0 +1,21 @@
+-- Runs of integrity scrubber, last_md5 is checkpoint for resume
+create table if not exists app.scrub_runs (
+    id bigserial primary key,
+    verify_md5 boolean not null,
+    last_md5 varchar,
+    checked bigint not null default 0,
+    started timestamptz not null default clock_timestamp(),
+    finished timestamptz
+);
+
+-- Missing, size-mismatched and hash-mismatched blobs of run
+create table if not exists app.scrub_findings (
+    run_id bigint not null references app.scrub_runs (id) on delete cascade,
+    md5 varchar not null,
+    problem varchar not null,
+    expected_size bigint not null,
+    actual_size bigint,
+    actual_md5 varchar,
+    detail varchar,
+    primary key (run_id, md5)
+);
@@ -0,0 +1,3 @@
+-- Root folder is inserted without parent_id and gets parent_id = id after flush,
+-- so databases created by earlier 0001_baseline need the constraint dropped
+alter table app.files_tree alter column parent_id drop not null;
@@ -2,9 +2,10 @@
 Model for file tables
 """
 import datetime
+from typing import Optional
 from uuid import uuid4
 
-from sqlmodel import SQLModel, Field, UniqueConstraint, MetaData, Column, BigInteger
+from sqlmodel import SQLModel, Field, UniqueConstraint, MetaData, Column, BigInteger, DateTime, text
 from pydantic import UUID4
 
 
@@ -28,13 +29,14 @@ class Files(SQLModel, table=True):
         nullable=False,
         sa_column=Column(
             BigInteger(),
-            nullable=False
+            nullable=False,
+            index=True
         )
     )
     keys: UUID4 = Field(nullable=False, default_factory=uuid4)
     inserted = Field(default=datetime.datetime.today())
     inserted_by: str = Field(nullable=False)
-    md5: str = Field(nullable=False)
+    md5: str = Field(nullable=False, index=True)
 
     metadata = MetaData(schema="app")
 
@@ -85,11 +87,12 @@ class FilesTree(SQLModel, table=True):
             nullable=False
         )
     )
-    parent_id: int = Field(
+    parent_id: Optional[int] = Field(
         nullable=True,
         sa_column=Column(
             BigInteger(),
-            nullable=False
+            nullable=True,
+            index=True
         )
     )
     name: str = Field(nullable=False)
@@ -105,3 +108,146 @@ class FilesTree(SQLModel, table=True):
     __table_args__ = (
         UniqueConstraint("keys", name="files_tree_unique_keys"),
     )
+
+
+class FolderStats(SQLModel, table=True):
+    """
+    Class for app.folder_stats table.
+    Counters are maintained in the same transaction as file changes
+    """
+    folder_id: int = Field(
+        primary_key=True,
+        nullable=False,
+        sa_column=Column(
+            BigInteger(),
+            primary_key=True,
+            nullable=False
+        )
+    )
+    direct_count: int = Field(
+        default=0,
+        sa_column=Column(
+            BigInteger(),
+            nullable=False,
+            server_default="0"
+        )
+    )
+    direct_size: int = Field(
+        default=0,
+        sa_column=Column(
+            BigInteger(),
+            nullable=False,
+            server_default="0"
+        )
+    )
+    recursive_count: int = Field(
+        default=0,
+        sa_column=Column(
+            BigInteger(),
+            nullable=False,
+            server_default="0"
+        )
+    )
+    recursive_size: int = Field(
+        default=0,
+        sa_column=Column(
+            BigInteger(),
+            nullable=False,
+            server_default="0"
+        )
+    )
+
+    metadata = MetaData(schema="app")
+
+    __tablename__ = "folder_stats"
+
+
+class Chunks(SQLModel, table=True):
+    """
+    Class for app.chunks table
+    """
+    id: str = Field(
+        primary_key=True,
+        index=True,
+        nullable=False
+    )
+    chunk_size: int = Field(
+        nullable=False,
+        sa_column=Column(
+            BigInteger(),
+            nullable=False
+        )
+    )
+    inserted = Field(default=datetime.datetime.today())
+    inserted_by: str = Field(nullable=False)
+
+    metadata = MetaData(schema="app")
+
+    __tablename__ = "chunks"
+
+
+class FileChunks(SQLModel, table=True):
+    """
+    Class for app.file_chunks table, manifest of chunked file
+    """
+    md5: str = Field(
+        primary_key=True,
+        nullable=False
+    )
+    seq: int = Field(
+        primary_key=True,
+        nullable=False
+    )
+    chunk_id: str = Field(nullable=False)
+
+    metadata = MetaData(schema="app")
+
+    __tablename__ = "file_chunks"
+
+
+class ChangeEvents(SQLModel, table=True):
+    """
+    Class for app.change_events table, append-only feed of file and folder changes.
+    For file events folder_id is folder of file,
+    for folder events folder_id is folder itself and parent_id is its parent
+    """
+    id: int = Field(
+        primary_key=True,
+        nullable=False,
+        sa_column=Column(
+            BigInteger(),
+            primary_key=True,
+            nullable=False
+        )
+    )
+    entity: str = Field(nullable=False)
+    action: str = Field(nullable=False)
+    keys: UUID4 = Field(nullable=False)
+    folder_id: int = Field(
+        nullable=False,
+        sa_column=Column(
+            BigInteger(),
+            nullable=False
+        )
+    )
+    parent_id: Optional[int] = Field(
+        default=None,
+        sa_column=Column(
+            BigInteger(),
+            nullable=True
+        )
+    )
+    name: str = Field(nullable=False)
+    md5: Optional[str] = Field(default=None, nullable=True)
+    inserted: Optional[datetime.datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            server_default=text("clock_timestamp()")
+        )
+    )
+
+    metadata = MetaData(schema="app")
+
+    __tablename__ = "change_events"
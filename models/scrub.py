@@ -0,0 +1,91 @@
+"""
+Model for integrity scrub tables
+"""
+import datetime
+from typing import Optional
+
+from sqlmodel import SQLModel, Field, MetaData, Column, BigInteger, DateTime, text
+
+
+class ScrubRuns(SQLModel, table=True):
+    """
+    Class for app.scrub_runs table.
+    last_md5 is checkpoint of run, blobs are walked in order of md5
+    """
+    id: int = Field(
+        primary_key=True,
+        nullable=False,
+        sa_column=Column(
+            BigInteger(),
+            primary_key=True,
+            nullable=False
+        )
+    )
+    verify_md5: bool = Field(nullable=False)
+    last_md5: Optional[str] = Field(default=None, nullable=True)
+    checked: int = Field(
+        default=0,
+        sa_column=Column(
+            BigInteger(),
+            nullable=False,
+            server_default="0"
+        )
+    )
+    started: Optional[datetime.datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=False,
+            server_default=text("clock_timestamp()")
+        )
+    )
+    finished: Optional[datetime.datetime] = Field(
+        default=None,
+        sa_column=Column(
+            DateTime(timezone=True),
+            nullable=True
+        )
+    )
+
+    metadata = MetaData(schema="app")
+
+    __tablename__ = "scrub_runs"
+
+
+class ScrubFindings(SQLModel, table=True):
+    """
+    Class for app.scrub_findings table, problems found by scrub run
+    """
+    run_id: int = Field(
+        primary_key=True,
+        nullable=False,
+        sa_column=Column(
+            BigInteger(),
+            primary_key=True,
+            nullable=False
+        )
+    )
+    md5: str = Field(
+        primary_key=True,
+        nullable=False
+    )
+    problem: str = Field(nullable=False)
+    expected_size: int = Field(
+        sa_column=Column(
+            BigInteger(),
+            nullable=False
+        )
+    )
+    actual_size: Optional[int] = Field(
+        default=None,
+        sa_column=Column(
+            BigInteger(),
+            nullable=True
+        )
+    )
+    actual_md5: Optional[str] = Field(default=None, nullable=True)
+    detail: Optional[str] = Field(default=None, nullable=True)
+
+    metadata = MetaData(schema="app")
+
+    __tablename__ = "scrub_findings"
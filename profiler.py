@@ -0,0 +1,201 @@
+"""
+Sampling profiler with collapsed stack output for flamegraphs
+"""
+import asyncio
+import hmac
+import os
+import random
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from config import config
+from logger import status_logger
+
+PROFILES_DIR = "./logs/profiles"
+PROFILE_HEADER = "x-profile-token"
+
+_profile_lock = threading.Lock()
+
+
+def collapse_stack(frame) -> str:
+    """
+    Function for converting frame to collapsed stack line
+    :param frame: top frame of thread
+    :return: frames from root to top separated by ';'
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class SamplingProfiler:
+    """
+    Profiler which takes stacks of threads from separate thread.
+    Profiled code is not instrumented, so overhead depends only on interval
+    """
+    def __init__(
+            self,
+            interval: float,
+            thread_id: Optional[int] = None
+    ):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Function for starting sampling thread
+        :return:
+        """
+        self._thread = threading.Thread(
+            target=self._run,
+            name="sampling-profiler",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        """
+        Function for stopping sampling thread and waiting for it
+        :return: count of samples by collapsed stack
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        return self.samples
+
+    def _run(self):
+        own_thread_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if thread_id == own_thread_id:
+                    continue
+                if self.thread_id is not None and thread_id != self.thread_id:
+                    continue
+                self.samples[collapse_stack(frame)] += 1
+
+    def save(
+            self,
+            path: str
+    ) -> str:
+        """
+        Function for writing samples in flamegraph.pl / speedscope format
+        :param path: path to .folded file
+        :return: path
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        return path
+
+
+def profile_path(
+        name: str
+) -> str:
+    """
+    Function for generating path of profile file in logs
+    :param name: name of profile
+    :return:
+    """
+    safe_name = "".join(char if char.isalnum() else "_" for char in name).strip("_")
+    return os.path.join(
+        PROFILES_DIR,
+        f"{datetime.now():%Y%m%d_%H%M%S_%f}_{safe_name}.folded"
+    )
+
+
+def check_token(
+        token: Optional[str]
+) -> bool:
+    """
+    Function for checking trusted profiling token
+    :param token: token from request
+    :return:
+    """
+    if not config.profiling_info.enabled or not config.profiling_info.token or not token:
+        return False
+    return hmac.compare_digest(token, config.profiling_info.token)
+
+
+async def profile_worker(
+        seconds: float
+) -> tuple[Optional[str], int]:
+    """
+    Function for profiling all threads of worker for some time.
+    Only one profile can be taken at a time
+    :param seconds: duration of profile
+    :return: path to profile (None if other profile is running) and count of samples
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None, 0
+    try:
+        profiler = SamplingProfiler(interval=config.profiling_info.interval)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            samples = profiler.stop()
+        path = await asyncio.to_thread(profiler.save, profile_path("worker"))
+        return path, sum(samples.values())
+    finally:
+        _profile_lock.release()
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware for profiling requests with trusted header
+    or sampled fraction of requests. Event loop thread is sampled
+    while request is in flight, so concurrent requests are in profile too.
+    Does nothing when profiling is disabled in config
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.profiling_info.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        token = headers.get(PROFILE_HEADER.encode(), b"").decode("latin-1")
+        sampled = random.random() < config.profiling_info.sample_rate
+        if not (check_token(token) or sampled) or not _profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        path = profile_path(f"{scope['method']}_{scope['path']}")
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = [
+                    *message["headers"],
+                    (b"x-profile-file", os.path.basename(path).encode())
+                ]
+            await send(message)
+
+        profiler = SamplingProfiler(
+            interval=config.profiling_info.interval,
+            thread_id=threading.get_ident()
+        )
+        try:
+            profiler.start()
+            try:
+                await self.app(scope, receive, send_with_header)
+            finally:
+                profiler.stop()
+            await asyncio.to_thread(profiler.save, path)
+        except Exception as error:
+            status_logger.error(f"Error while profiling request {scope['path']}: {error=}")
+            raise
+        finally:
+            _profile_lock.release()
@@ -1,2 +1,4 @@
 from routers.file_router import file_router
-from routers.article_router import article_router
\ No newline at end of file
+from routers.article_router import article_router
+from routers.admin_router import admin_router
+from routers.change_router import change_router
@@ -0,0 +1,54 @@
+"""
+Router for service endpoints
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Header
+from fastapi.responses import JSONResponse
+
+from config import config
+from profiler import check_token, profile_worker
+
+admin_router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"]
+)
+
+
+@admin_router.get(
+    "/profile",
+    include_in_schema=False
+)
+async def profile(
+        seconds: float = 10,
+        x_profile_token: Optional[str] = Header(None)
+):
+    """
+    - Endpoint for profiling whole worker for some time
+    - **seconds**: Duration of profile, limited by max_duration from config
+    - **x_profile_token**: Trusted profiling token
+    - **return**: Path to collapsed stacks file or error
+    """
+    if not check_token(x_profile_token):
+        return JSONResponse(
+            status_code=404,
+            content={
+                "detail": "Not Found"
+            }
+        )
+
+    seconds = min(max(seconds, 0.1), config.profiling_info.max_duration)
+    path, samples = await profile_worker(seconds=seconds)
+    if not path:
+        return JSONResponse(
+            status_code=409,
+            content={
+                "message": "Other profile is running",
+                "error": None
+            }
+        )
+    return {
+        "message": "Profile was saved",
+        "path": path,
+        "samples": samples
+    }
@@ -8,9 +8,14 @@ from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from database import get_session
+from database import get_session, get_read_session
 from models.articles import Article
-from models.files import Files, FilesTree
+from models.files import Files, FilesTree, FolderStats
+from schemas.articles import ArticlesProvision
+from services.article_services import provision_articles
+from services.event_services import CREATED, DELETED, add_events, file_event, folder_event
+from services.folder_stats_services import remove_folder_stats, rebuild_folder_stats
+from services.tree_services import copy_folder, move_folder
 
 article_router = APIRouter(
     prefix="/article",
@@ -30,6 +35,11 @@ async def delete_all_files(
     - **session**: Database session
     - **return**: None
     """
+    await remove_folder_stats(
+        session=session,
+        folder_id=folder_id
+    )
+
     result = await session.execute(
         select(Files)
         .where(Files.folder_id == folder_id)
@@ -39,7 +49,6 @@ async def delete_all_files(
 
     for file_in_db in files_in_db:
         await session.delete(file_in_db)
-        await session.commit()
 
     result = await session.execute(
         select(FilesTree)
@@ -48,6 +57,13 @@ async def delete_all_files(
 
     folder = result.scalars().first()
     await session.delete(folder)
+    await add_events(
+        session=session,
+        events=[
+            file_event(DELETED, file_in_db.keys, folder_id, file_in_db.filename, file_in_db.md5)
+            for file_in_db in files_in_db
+        ] + [folder_event(DELETED, folder.keys, folder.id, folder.parent_id, folder.name)]
+    )
     await session.commit()
 
 
@@ -75,6 +91,10 @@ async def create_article(
         await session.commit()
         await session.refresh(new_folder)
         new_folder.parent_id = new_folder.id
+        await add_events(
+            session=session,
+            events=[folder_event(CREATED, new_folder.keys, new_folder.id, new_folder.id, new_folder.name)]
+        )
         await session.commit()
 
         new_article = Article(
@@ -136,6 +156,11 @@ async def create_new_folder(
             inserted_by="star_worker"
         )
         session.add(new_folder)
+        await session.flush()
+        await add_events(
+            session=session,
+            events=[folder_event(CREATED, new_folder.keys, new_folder.id, new_folder.parent_id, name)]
+        )
         await session.commit()
         return JSONResponse(
             status_code=200,
@@ -154,3 +179,146 @@ async def create_new_folder(
             }
         )
 
+
+@article_router.post("/bulk_create_articles")
+async def bulk_create_articles(
+        provision: ArticlesProvision,
+        session: AsyncSession = Depends(get_session)
+):
+    """
+    - Endpoint for bulk article creation with folder skeletons in one transaction
+    - **provision**: Articles with nested folders
+    - **session**: Database session (auto)
+    - **return**: Article ids, root folder ids and folder ids by path or error
+    """
+    provisioned, error = await provision_articles(
+        articles=provision.articles,
+        session=session
+    )
+    if error:
+        return error
+    return JSONResponse(
+        status_code=200,
+        content={
+            "message": f"{len(provisioned)} articles were created",
+            "articles": [article.dict() for article in provisioned]
+        }
+    )
+
+
+@article_router.get("/folder_stats")
+async def get_folder_stats(
+        folder_id: int,
+        session: AsyncSession = Depends(get_read_session)
+):
+    """
+    - Endpoint for getting file count and total size of folder and its subtree
+    - **folder_id**: ID of folder
+    - **session**: Database session (auto)
+    - **return**: Folder statistics or error
+    """
+    result = await session.execute(
+        select(FilesTree.id, FolderStats)
+        .join(FolderStats, FolderStats.folder_id == FilesTree.id, isouter=True)
+        .where(FilesTree.id == folder_id)
+    )
+    row = result.first()
+    if not row:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "message": f"Folder with {folder_id=} is not exists"
+            }
+        )
+
+    stats = row[1] or FolderStats(folder_id=folder_id)
+    return {
+        "folder_id": folder_id,
+        "direct_count": stats.direct_count,
+        "direct_size": stats.direct_size,
+        "recursive_count": stats.recursive_count,
+        "recursive_size": stats.recursive_size
+    }
+
+
+@article_router.post("/rebuild_folder_stats")
+async def rebuild_all_folder_stats(
+        session: AsyncSession = Depends(get_session)
+):
+    """
+    - Endpoint for recalculating statistics of all folders from files table
+    - **session**: Database session (auto)
+    - **return**: Message or error
+    """
+    try:
+        await rebuild_folder_stats(session=session)
+        await session.commit()
+        return {
+            "message": "Folder statistics were rebuilt"
+        }
+    except Exception as error:
+        return JSONResponse(
+            status_code=500,
+            content={
+                "message": "There was a error while rebuilding folder statistics",
+                "error": f"{error=}"
+            }
+        )
+
+
+@article_router.post("/copy_folder")
+async def copy_folder_to_folder(
+        folder_id: int,
+        target_folder_id: int,
+        session: AsyncSession = Depends(get_session)
+):
+    """
+    - Endpoint for copying folder with subfolders and files without copying bytes
+    - **folder_id**: ID of copied folder
+    - **target_folder_id**: ID of target folder
+    - **session**: Database session (auto)
+    - **return**: ID of new folder and count of copied rows or error
+    """
+    copied, error = await copy_folder(
+        folder_id=folder_id,
+        target_folder_id=target_folder_id,
+        session=session
+    )
+    if error:
+        return error
+    return JSONResponse(
+        status_code=200,
+        content={
+            "message": "Folder was copied",
+            **copied
+        }
+    )
+
+
+@article_router.post("/move_folder")
+async def move_folder_to_folder(
+        folder_id: int,
+        target_folder_id: int,
+        session: AsyncSession = Depends(get_session)
+):
+    """
+    - Endpoint for moving folder with subfolders and files
+    - **folder_id**: ID of moved folder
+    - **target_folder_id**: ID of target folder
+    - **session**: Database session (auto)
+    - **return**: Folder id or error
+    """
+    error = await move_folder(
+        folder_id=folder_id,
+        target_folder_id=target_folder_id,
+        session=session
+    )
+    if error:
+        return error
+    return JSONResponse(
+        status_code=200,
+        content={
+            "message": "Folder was moved",
+            "folder_id": folder_id
+        }
+    )
@@ -0,0 +1,91 @@
+"""
+Router for change feed of files and folders
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import config
+from database import get_read_session
+from services.event_services import get_events, get_last_event_id, stream_events
+
+change_router = APIRouter(
+    prefix="/changes",
+    tags=["Changes"]
+)
+
+
+@change_router.get(
+    "",
+    response_class=ORJSONResponse
+)
+async def get_changes(
+        cursor: int = 0,
+        limit: Optional[int] = None,
+        session: AsyncSession = Depends(get_read_session)
+):
+    """
+    - Endpoint for getting file and folder events after cursor
+    - **cursor**: ID of last received event, 0 for whole feed
+    - **limit**: Max count of events, limited by page_size from config
+    - **session**: Database session (auto)
+    - **return**: Events in order and cursor for next request
+    """
+    page_size = config.change_feed_info.page_size
+    limit = min(max(limit, 1), page_size) if limit else page_size
+    events, next_cursor = await get_events(
+        session=session,
+        cursor=cursor,
+        limit=limit
+    )
+    return ORJSONResponse(
+        content={
+            "events": events,
+            "cursor": next_cursor,
+            "has_more": len(events) == limit
+        }
+    )
+
+
+@change_router.get(
+    "/cursor"
+)
+async def get_changes_cursor(
+        session: AsyncSession = Depends(get_read_session)
+):
+    """
+    - Endpoint for getting current cursor of feed,
+      client takes it before full listing and syncs from it after
+    - **session**: Database session (auto)
+    - **return**: ID of last event
+    """
+    return {
+        "cursor": await get_last_event_id(session=session)
+    }
+
+
+@change_router.get(
+    "/stream"
+)
+async def stream_changes(
+        cursor: int = 0,
+        last_event_id: Optional[str] = Header(None)
+):
+    """
+    - Endpoint with Server-Sent Events stream of file and folder events
+    - **cursor**: ID of last received event, 0 for whole feed
+    - **last_event_id**: Set by EventSource on reconnect, takes precedence over cursor
+    - **return**: text/event-stream
+    """
+    if last_event_id and last_event_id.isdigit():
+        cursor = int(last_event_id)
+    return StreamingResponse(
+        stream_events(cursor=cursor),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
@@ -3,28 +3,49 @@ Router for file services
 """
 import asyncio
 import os
-from urllib.parse import unquote
+from typing import Optional
+from urllib.parse import quote, unquote
 
-import aioboto3
 import aiofiles
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Header, Request
+from fastapi.responses import (
+    JSONResponse, FileResponse, ORJSONResponse, Response, StreamingResponse
+)
 from pydantic import UUID4
+from sqlalchemy import any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from access_log import stage
+from buffers import buffer_pool
 from config import config
-from controllers.file_controller import upload_file_controller
-from database import get_session
+from controllers.file_controller import (
+    upload_file_controller,
+    upload_stream_controller,
+    upload_archive_controller,
+    upload_chunked_controller,
+    ingest_controller
+)
+from database import get_session, get_read_session
+from lifecycle import upload_slot, download_slot
 from logger import status_logger
-from models.files import Files
+from models.files import Files, FilesMD5
+from schemas.files import FilesInfoRequest, IngestRequest
+from services.chunk_services import get_dedup_stats, get_manifest, get_manifests, stream_chunks
+from services.download_services import parse_range, read_into, stream_ranges
+from services.event_services import DELETED, add_events, file_event
+from services.folder_stats_services import apply_file_delta
+from services.tree_services import copy_file, move_file
+from storage import get_s3_client
 
 file_router = APIRouter(
     prefix="/file",
     tags=["Files"]
 )
-CHUNK_SIZE = 100 * 1024 * 1024  # 100 MB
-s3_session = aioboto3.Session()
+# Core columns instead of ORM entities: rows are plain mappings,
+# orjson encodes UUID and datetime values natively
+FILES_COLUMNS = Files.__table__.c
 
 
 @file_router.get(
@@ -46,7 +67,8 @@ async def health(
 
 
 @file_router.post(
-    "/upload_file_to_folder"
+    "/upload_file_to_folder",
+    dependencies=[Depends(upload_slot)]
 )
 async def upload_file_to_folder(
         folder_id: int,
@@ -69,12 +91,133 @@ async def upload_file_to_folder(
     )
 
 
+@file_router.post(
+    "/upload_file_stream",
+    dependencies=[Depends(upload_slot)]
+)
+async def upload_file_stream(
+        folder_id: int,
+        request: Request,
+        x_filename: str = Header(...),
+        session: AsyncSession = Depends(get_session)
+):
+    """
+    - Streaming file upload endpoint. Body is raw file content,
+      it is hashed and sent to S3 as it arrives, without temporary files
+    - **folder_id**: ID of folder for file
+    - **x_filename**: Name of file in X-Filename header (url quoted)
+    - **session**: Database session (auto)
+    - **return**: Error or file info
+    """
+    return await upload_stream_controller(
+        session=session,
+        stream=request.stream(),
+        filename=unquote(x_filename, "utf-8"),
+        mime_type=request.headers.get("content-type", "application/octet-stream"),
+        folder_id=folder_id
+    )
+
+
+@file_router.post(
+    "/upload_archive",
+    dependencies=[Depends(upload_slot)]
+)
+async def upload_archive(
+        folder_id: int,
+        file: UploadFile = File(...),
+        session: AsyncSession = Depends(get_session)
+):
+    """
+    - Archive upload endpoint. Zip or tar (also gz, bz2, xz) archive
+      is expanded into folders under target folder, files with known md5
+      are not uploaded again
+    - **folder_id**: ID of target folder
+    - **file**: Archive to expand
+    - **session**: Database session (auto)
+    - **return**: Error or info of created files
+    """
+    return await upload_archive_controller(
+        session=session,
+        file=file,
+        folder_id=folder_id
+    )
+
+
+@file_router.post(
+    "/upload_file_chunked",
+    dependencies=[Depends(upload_slot)]
+)
+async def upload_file_chunked(
+        folder_id: int,
+        file: UploadFile = File(...),
+        session: AsyncSession = Depends(get_session)
+):
+    """
+    - File upload endpoint with chunked storage. File is split into
+      content-defined chunks, only new chunks are uploaded
+    - **folder_id**: ID of folder for file
+    - **file**: File to upload
+    - **session**: Database session (auto)
+    - **return**: Error or file info with chunk statistics
+    """
+    file.filename = unquote(file.filename, "utf-8")
+
+    return await upload_chunked_controller(
+        session=session,
+        file=file,
+        folder_id=folder_id
+    )
+
+
+@file_router.post(
+    "/ingest_from_s3",
+    dependencies=[Depends(upload_slot)]
+)
+async def ingest_objects_from_s3(
+        request: IngestRequest,
+        session: AsyncSession = Depends(get_session)
+):
+    """
+    - Endpoint for ingesting objects which are already in S3 without proxying bytes.
+      Objects are copied inside S3, files with known md5 are not copied again
+    - **request**: Target folder and bucket/key of objects (bucket of API by default)
+    - **session**: Database session (auto)
+    - **return**: Error or info of ingested objects, failed objects have error
+    """
+    if len(request.sources) > config.api_info.max_batch_size:
+        return JSONResponse(
+            status_code=413,
+            content={
+                "message": f"Too many sources, max batch size is {config.api_info.max_batch_size}",
+                "error": None
+            }
+        )
+    return await ingest_controller(
+        session=session,
+        request=request
+    )
+
+
+@file_router.get(
+    "/dedup_stats"
+)
+async def dedup_stats(
+        session: AsyncSession = Depends(get_read_session)
+):
+    """
+    - Endpoint for deduplication statistics of chunked storage
+    - **session**: Database session (auto)
+    - **return**: Logical and stored bytes and dedup ratio
+    """
+    return await get_dedup_stats(session=session)
+
+
 @file_router.get(
     "/get_file_info"
 )
 async def get_file_info(
         keys: UUID4,
-        session: AsyncSession = Depends(get_session)
+        session: AsyncSession = Depends(get_read_session)
 ):
     """
     - Endpoint for getting file info
@@ -100,6 +243,55 @@ async def get_file_info(
     )
 
 
+@file_router.post(
+    "/get_files_info"
+)
+async def get_files_info(
+        request: FilesInfoRequest,
+        session: AsyncSession = Depends(get_read_session)
+):
+    """
+    - Endpoint for getting info of many files in one query
+    - **request**: Keys of files
+    - **session**: Database session (auto)
+    - **return**: Error or files info with size and mime type and keys which were not found
+    """
+    keys = list(dict.fromkeys(request.keys))
+    if len(keys) > config.api_info.max_batch_size:
+        return JSONResponse(
+            status_code=413,
+            content={
+                "message": f"Too many keys, max batch size is {config.api_info.max_batch_size}",
+                "error": None
+            }
+        )
+
+    result = await session.execute(
+        select(Files, FilesMD5.file_size, FilesMD5.mime_type)
+        .join(FilesMD5, FilesMD5.id == Files.md5, isouter=True)
+        .where(
+            Files.keys == any_(
+                bindparam("keys", value=keys, type_=ARRAY(UUID(as_uuid=True)))
+            )
+        )
+    )
+
+    files = []
+    found = set()
+    for file, file_size, mime_type in result.all():
+        found.add(file.keys)
+        files.append({
+            **file.dict(),
+            "file_size": file_size,
+            "mime_type": mime_type
+        })
+
+    return {
+        "files": files,
+        "not_found": [key for key in keys if key not in found]
+    }
+
+
 @file_router.delete(
     "/delete_file"
 )
@@ -129,7 +321,23 @@ async def delete_file(
                 }
             )
 
+        result = await session.execute(
+            select(FilesMD5.file_size)
+            .where(FilesMD5.id == file.md5)
+        )
+        file_size = result.scalars().first() or 0
+
         await session.delete(file)
+        await apply_file_delta(
+            session=session,
+            folder_id=file.folder_id,
+            count=-1,
+            size=-file_size
+        )
+        await add_events(
+            session=session,
+            events=[file_event(DELETED, file.keys, file.folder_id, file.filename, file.md5)]
+        )
         await session.commit()
 
         return JSONResponse(
@@ -149,16 +357,82 @@ async def delete_file(
         )
 
 
+@file_router.post(
+    "/copy_file"
+)
+async def copy_file_to_folder(
+        keys: UUID4,
+        folder_id: int,
+        session: AsyncSession = Depends(get_session)
+):
+    """
+    - Endpoint for copying file into folder without copying bytes
+    - **keys**: Keys of file
+    - **folder_id**: ID of target folder
+    - **session**: Database session (auto)
+    - **return**: Error or keys of new file
+    """
+    new_file, error = await copy_file(
+        keys=keys,
+        target_folder_id=folder_id,
+        session=session
+    )
+    if error:
+        return error
+    return JSONResponse(
+        status_code=200,
+        content={
+            "message": "File was copied",
+            **new_file
+        }
+    )
+
+
+@file_router.post(
+    "/move_file"
+)
+async def move_file_to_folder(
+        keys: UUID4,
+        folder_id: int,
+        session: AsyncSession = Depends(get_session)
+):
+    """
+    - Endpoint for moving file into folder
+    - **keys**: Keys of file
+    - **folder_id**: ID of target folder
+    - **session**: Database session (auto)
+    - **return**: Error or file keys
+    """
+    error = await move_file(
+        keys=keys,
+        target_folder_id=folder_id,
+        session=session
+    )
+    if error:
+        return error
+    return JSONResponse(
+        status_code=200,
+        content={
+            "message": "File was moved",
+            "file_key": f"{keys}"
+        }
+    )
+
+
 @file_router.get(
-    "/download_file"
+    "/download_file",
+    dependencies=[Depends(download_slot)]
 )
 async def download_file(
         keys: UUID4,
-        session: AsyncSession = Depends(get_session)
+        range_header: Optional[str] = Header(None, alias="range"),
+        session: AsyncSession = Depends(get_read_session)
 ):
     """
-    - Endpoint for file downloading
+    - Endpoint for file downloading.
+      Large files and Range requests are streamed by parallel ranged reads from S3
     - **keys**: Keys of file
+    - **range_header**: Range header with one byte range (optional)
     - **session**: Database session (auto)
     - **return**: Error or file
     """
@@ -172,30 +446,69 @@ async def download_file(
     if not file_in_db:
         raise HTTPException(status_code=404, detail=f"Файла с {keys} не существует!")
 
-    async with s3_session.resource(
-            "s3",
-            endpoint_url=config.s3_info.host,
-            aws_access_key_id=config.s3_info.access_key,
-            aws_secret_access_key=config.s3_info.secret_key
-    ) as s3_resource:
-        obj = await s3_resource.Object(config.s3_info.bucket, f"files.md5/{file_in_db.md5}")
-        result = await obj.get()
-        async with aiofiles.open(f"./temp/{file_in_db.filename}", "wb") as file:
-            while content := await result['Body'].read(CHUNK_SIZE):
-                await file.write(content)
+    result = await session.execute(
+        select(FilesMD5)
+        .where(FilesMD5.id == file_in_db.md5)
+    )
+    files_md5: FilesMD5 = result.scalars().first()
+    content_disposition = f"attachment; filename*=utf-8''{quote(file_in_db.filename)}"
 
-        return FileResponse(
-            f"./temp/{file_in_db.filename}",
-            media_type=result['ResponseMetadata']['HTTPHeaders']['content-type'],
-            filename=file_in_db.filename
+    chunks = await get_manifest(
+        md5_hash=file_in_db.md5,
+        session=session
+    )
+
+    if files_md5:
+        file_size = files_md5.file_size
+        try:
+            byte_range = parse_range(range_header, file_size)
+        except ValueError:
+            return Response(
+                status_code=416,
+                headers={"content-range": f"bytes */{file_size}"}
+            )
+        if chunks or byte_range or file_size >= config.s3_info.ranged_download_threshold:
+            first, last = byte_range or (0, file_size - 1)
+            headers = {
+                "accept-ranges": "bytes",
+                "content-length": str(last - first + 1),
+                "content-disposition": content_disposition
+            }
+            if byte_range:
+                headers["content-range"] = f"bytes {first}-{last}/{file_size}"
+            return StreamingResponse(
+                stream_chunks(chunks, first, last) if chunks
+                else stream_ranges(f"files.md5/{file_in_db.md5}", first, last),
+                status_code=206 if byte_range else 200,
+                media_type=files_md5.mime_type,
+                headers=headers
+            )
+
+    with stage("s3_download"):
+        s3_client = await get_s3_client()
+        result = await s3_client.get_object(
+            Bucket=config.s3_info.bucket,
+            Key=f"files.md5/{file_in_db.md5}"
         )
+        async with aiofiles.open(f"./temp/{file_in_db.filename}", "wb") as file:
+            async with buffer_pool.buffer() as buffer:
+                view = memoryview(buffer)
+                while filled := await read_into(result['Body'], view):
+                    await file.write(view[:filled])
+
+    return FileResponse(
+        f"./temp/{file_in_db.filename}",
+        media_type=result['ResponseMetadata']['HTTPHeaders']['content-type'],
+        filename=file_in_db.filename
+    )
 
 
 @file_router.get(
-    "/get_all_files"
+    "/get_all_files",
+    response_class=ORJSONResponse
 )
 async def get_all_files(
-        session: AsyncSession = Depends(get_session)
+        session: AsyncSession = Depends(get_read_session)
 ):
     """
     - Endpoint for getting all file rows
@@ -203,18 +516,21 @@ async def get_all_files(
     - **return**: Error or file
     """
     result = await session.execute(
-        select(Files)
+        select(*FILES_COLUMNS)
     )
 
-    return result.scalars().all()
+    return ORJSONResponse(
+        [dict(row) for row in result.mappings()]
+    )
 
 
 @file_router.get(
-    "/find_file_by_name"
+    "/find_file_by_name",
+    response_class=ORJSONResponse
 )
 async def find_file_by_name(
         filename: str,
-        session: AsyncSession = Depends(get_session)
+        session: AsyncSession = Depends(get_read_session)
 ):
     """
     - Endpoint for finding file by filename
@@ -223,32 +539,43 @@ async def find_file_by_name(
     - **return**: Error or file
     """
     result = await session.execute(
-        select(Files)
-        .where(Files.filename.ilike(f"%{filename}%"))
+        select(*FILES_COLUMNS)
+        .where(FILES_COLUMNS.filename.ilike(f"%{filename}%"))
     )
 
-    files_in_db: list[Files] = result.scalars().all()
-
-    return files_in_db
+    return ORJSONResponse(
+        [dict(row) for row in result.mappings()]
+    )
 
 
 async def download_and_write_file(
         path_to_dir: str,
-        s3_resource,
-        file_in_db: Files
+        s3_client,
+        file_in_db: Files,
+        chunks: list[tuple[str, int]]
 ):
     """
     - Function for downloading and write file in dir
     - **path_to_dir**: Path to download dir
-    - **s3_resource**: S3 resource object
+    - **s3_client**: S3 client
     - **file_in_db**: Model of file in db
+    - **chunks**: Manifest of chunked file, empty for plain object
     - **return**: Message with filename
     """
-    obj = await s3_resource.Object(config.s3_info.bucket, f"{file_in_db.md5}")
-    result = await obj.get()
     async with aiofiles.open(os.path.join(path_to_dir, file_in_db.filename), "wb") as file:
-        while content := await result['Body'].read(CHUNK_SIZE):
-            await file.write(content)
+        if chunks:
+            async for content in stream_chunks(chunks):
+                await file.write(content)
+            return f"Written file {file_in_db.filename}"
+
+        result = await s3_client.get_object(
+            Bucket=config.s3_info.bucket,
+            Key=f"files.md5/{file_in_db.md5}"
+        )
+        async with buffer_pool.buffer() as buffer:
+            view = memoryview(buffer)
+            while filled := await read_into(result['Body'], view):
+                await file.write(view[:filled])
     return f"Written file {file_in_db.filename}"
 
 
@@ -268,20 +595,21 @@ async def download_all_files(
         select(Files)
     )
     files_in_db: list[Files] = result.scalars().all()
+    manifests = await get_manifests(
+        md5_hashes=list({file_in_db.md5 for file_in_db in files_in_db}),
+        session=session
+    )
     tasks = []
-    async with s3_session.resource(
-            "s3",
-            endpoint_url=config.s3_info.host,
-            aws_access_key_id=config.s3_info.access_key,
-            aws_secret_access_key=config.s3_info.secret_key
-    ) as s3_resource:
-        for file_in_db in files_in_db:
-            tasks.append(
-                asyncio.create_task(
-                    download_and_write_file(r"E:\temp", s3_resource, file_in_db)
+    s3_client = await get_s3_client()
+    for file_in_db in files_in_db:
+        tasks.append(
+            asyncio.create_task(
+                download_and_write_file(
+                    r"E:\temp", s3_client, file_in_db, manifests.get(file_in_db.md5, [])
                 )
             )
-        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        )
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
     return True
 
 
@@ -1,20 +1,50 @@
 """
 Файл с запуском API
 """
-from uvicorn import run
+import asyncio
+import signal
+
+from uvicorn import Config, Server
 from logger import status_logger
 from config import config
+from lifecycle import drain_transfers, transfer_tracker
+
+
+class DrainingServer(Server):
+    """
+    Server which drains transfers on first SIGTERM while still listening,
+    so /ready returns 503 and uploads are rejected before listeners are closed.
+    Second signal stops server at once
+    """
+    def handle_exit(self, sig, frame):
+        if sig == signal.SIGTERM and transfer_tracker.accepting:
+            transfer_tracker.stop_accepting()
+            asyncio.ensure_future(self.drain_and_exit(sig, frame))
+            return
+        super().handle_exit(sig, frame)
+
+    async def drain_and_exit(self, sig, frame):
+        """
+        Function for stopping server after drain
+        :param sig: received signal
+        :param frame: frame of signal
+        :return:
+        """
+        await drain_transfers()
+        super().handle_exit(sig, frame)
 
 
 if __name__ == "__main__":
     status_logger.info("Стартую API")
     try:
-        run(
-            app="main:app",
-            host=config.api_info.host,
-            port=config.api_info.port,
-            workers=1
-        )
+        DrainingServer(
+            Config(
+                app="main:app",
+                host=config.api_info.host,
+                port=config.api_info.port,
+                workers=1
+            )
+        ).run()
     except Exception as run_error:
         status_logger.error("Во время запуска API произошла ошибка")
         status_logger.error(f"{run_error=}")
@@ -0,0 +1,40 @@
+from typing import Dict, List
+
+from pydantic import BaseModel
+
+
+class FolderSkeleton(BaseModel):
+    """
+    Schema for folder with nested folders
+    """
+    name: str
+    children: List["FolderSkeleton"] = []
+
+
+FolderSkeleton.update_forward_refs()
+
+
+class ArticleProvision(BaseModel):
+    """
+    Schema for article with folder skeleton
+    """
+    title: str
+    folders: List[FolderSkeleton] = []
+
+
+class ArticlesProvision(BaseModel):
+    """
+    Schema for bulk article provisioning request
+    """
+    articles: List[ArticleProvision]
+
+
+class ArticleProvisioned(BaseModel):
+    """
+    Schema for provisioned article ids.
+    **folders** maps folder path ("a/b/c") to folder id
+    """
+    title: str
+    id: int
+    folder_id: int
+    folders: Dict[str, int] = {}
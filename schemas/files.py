@@ -1,4 +1,4 @@
-from typing import Optional, Union
+from typing import List, Optional, Union
 
 from pydantic import BaseModel, UUID4
 
@@ -11,3 +11,27 @@ class FileUpload(BaseModel):
     md5: Optional[str] = None
     id: Optional[int] = None
     detail: Optional[str] = None
+
+
+class FilesInfoRequest(BaseModel):
+    """
+    Schema for batch file info request
+    """
+    keys: List[UUID4]
+
+
+class IngestSource(BaseModel):
+    """
+    Schema for existing S3 object to ingest
+    """
+    key: str
+    bucket: Optional[str] = None
+    filename: Optional[str] = None
+
+
+class IngestRequest(BaseModel):
+    """
+    Schema for server-side ingest request
+    """
+    folder_id: int
+    sources: List[IngestSource]
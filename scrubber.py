@@ -0,0 +1,416 @@
+"""
+Integrity scrubber of stored blobs.
+Blobs of app.files_md5 are walked in keyset batches, every blob is checked
+by HEAD of its objects and optionally by recalculating md5.
+Findings and checkpoint are committed after every batch, so interrupted run is resumed.
+Run from repository root: python -m scrubber [--verify-md5] [--new] [--report [RUN_ID]]
+"""
+import argparse
+import asyncio
+import hashlib
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Iterable, List, Optional
+
+import orjson
+from botocore.exceptions import ClientError
+from sqlalchemy import String, any_, bindparam, func, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from config import config
+from database import create_session, engine
+from logger import status_logger
+from models.files import FileChunks, FilesMD5
+from models.scrub import ScrubFindings, ScrubRuns
+from services.bulk_services import insert_rows
+from services.chunk_services import chunk_key
+from storage import close_s3_client, get_s3_client
+
+MISSING = "missing"
+SIZE_MISMATCH = "size_mismatch"
+HASH_MISMATCH = "hash_mismatch"
+ERROR = "error"
+
+READ_SIZE = 1024 * 1024
+NOT_FOUND_CODES = {"404", "NoSuchKey", "NotFound"}
+
+
+@dataclass
+class Blob:
+    """
+    Blob of files_md5 with manifest, chunk ids are empty for plain object
+    """
+    md5: str
+    size: int
+    chunk_ids: List[str] = field(default_factory=list)
+
+    @property
+    def keys(self) -> List[str]:
+        """
+        Keys of objects of blob, chunks for chunked blob
+        """
+        return [chunk_key(chunk_id) for chunk_id in self.chunk_ids] or [f"files.md5/{self.md5}"]
+
+
+class RateLimiter:
+    """
+    Limiter of read bandwidth shared by all checks.
+    Reads are scheduled one after another at rate
+    """
+    def __init__(
+            self,
+            rate: int
+    ):
+        self.rate = rate
+        self._next = time.monotonic()
+
+    async def acquire(
+            self,
+            amount: int
+    ):
+        """
+        Function for waiting until amount of bytes can be read at rate
+        :param amount: count of bytes to read
+        :return:
+        """
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        start = max(self._next, now)
+        self._next = start + amount / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+async def gather_bounded(
+        semaphore: asyncio.Semaphore,
+        coroutines: Iterable[Awaitable]
+) -> list:
+    """
+    Function for running coroutines concurrently, at most by size of semaphore
+    :param semaphore: semaphore shared by callers
+    :param coroutines: coroutines to run
+    :return: results in order of coroutines
+    """
+    async def bounded(coroutine: Awaitable):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*map(bounded, coroutines))
+
+
+async def head_size(
+        key: str
+) -> Optional[int]:
+    """
+    Function for getting size of object
+    :param key: key of object
+    :return: size or None for missing object
+    """
+    s3_client = await get_s3_client()
+    try:
+        result = await s3_client.head_object(
+            Bucket=config.s3_info.bucket,
+            Key=key
+        )
+    except ClientError as error:
+        if error.response.get("Error", {}).get("Code") in NOT_FOUND_CODES:
+            return None
+        raise
+    return result["ContentLength"]
+
+
+async def hash_object(
+        key: str,
+        md5_hash,
+        limiter: RateLimiter
+):
+    """
+    Function for streaming object into hash within bandwidth limit
+    :param key: key of object
+    :param md5_hash: hash object
+    :param limiter: shared limiter
+    :return:
+    """
+    s3_client = await get_s3_client()
+    result = await s3_client.get_object(
+        Bucket=config.s3_info.bucket,
+        Key=key
+    )
+    async with result["Body"] as body:
+        while True:
+            await limiter.acquire(READ_SIZE)
+            content = await body.read(READ_SIZE)
+            if not content:
+                break
+            md5_hash.update(content)
+
+
+def finding(
+        blob: Blob,
+        problem: str,
+        actual_size: Optional[int] = None,
+        actual_md5: Optional[str] = None,
+        detail: Optional[str] = None
+) -> dict:
+    """
+    Function for building row of finding
+    :param blob: checked blob
+    :param problem: missing, size_mismatch, hash_mismatch or error
+    :param actual_size: size of stored objects
+    :param actual_md5: md5 of stored content
+    :param detail: missing keys or error
+    :return:
+    """
+    return {
+        "md5": blob.md5,
+        "problem": problem,
+        "expected_size": blob.size,
+        "actual_size": actual_size,
+        "actual_md5": actual_md5,
+        "detail": detail
+    }
+
+
+async def check_blob(
+        blob: Blob,
+        verify_md5: bool,
+        limiter: RateLimiter,
+        head_semaphore: asyncio.Semaphore
+) -> Optional[dict]:
+    """
+    Function for checking existence, size and optionally md5 of blob
+    :param blob: blob from files_md5
+    :param verify_md5: recalculate md5 from content
+    :param limiter: shared limiter
+    :param head_semaphore: shared limit of concurrent HEAD requests
+    :return: finding or None for healthy blob
+    """
+    try:
+        sizes = await gather_bounded(head_semaphore, map(head_size, blob.keys))
+        missing = [key for key, size in zip(blob.keys, sizes) if size is None]
+        if missing:
+            return finding(blob, MISSING, detail=", ".join(missing[:10]))
+
+        actual_size = sum(sizes)
+        if actual_size != blob.size:
+            return finding(blob, SIZE_MISMATCH, actual_size=actual_size)
+
+        if verify_md5:
+            md5_hash = hashlib.md5()
+            for key in blob.keys:
+                await hash_object(key, md5_hash, limiter)
+            if md5_hash.hexdigest() != blob.md5:
+                return finding(
+                    blob, HASH_MISMATCH, actual_size=actual_size, actual_md5=md5_hash.hexdigest()
+                )
+        return None
+    except Exception as error:
+        return finding(blob, ERROR, detail=f"{error=}")
+
+
+async def get_blobs(
+        session: AsyncSession,
+        after: Optional[str],
+        limit: int
+) -> List[Blob]:
+    """
+    Function for getting next batch of blobs after md5 with manifests
+    :param session: session to db
+    :param after: md5 of last checked blob
+    :param limit: size of batch
+    :return:
+    """
+    query = select(FilesMD5.id, FilesMD5.file_size).order_by(FilesMD5.id).limit(limit)
+    if after is not None:
+        query = query.where(FilesMD5.id > after)
+    result = await session.execute(query)
+    blobs = {md5_hash: Blob(md5=md5_hash, size=file_size) for md5_hash, file_size in result.all()}
+    if not blobs:
+        return []
+
+    result = await session.execute(
+        select(FileChunks.md5, FileChunks.chunk_id)
+        .where(FileChunks.md5 == any_(bindparam("md5s", value=list(blobs), type_=ARRAY(String))))
+        .order_by(FileChunks.md5, FileChunks.seq)
+    )
+    for md5_hash, chunk_id in result.all():
+        blobs[md5_hash].chunk_ids.append(chunk_id)
+    return list(blobs.values())
+
+
+async def start_run(
+        verify_md5: bool,
+        new: bool
+) -> ScrubRuns:
+    """
+    Function for resuming last unfinished run or starting new one
+    :param verify_md5: recalculate md5 in new run
+    :param new: do not resume unfinished run
+    :return:
+    """
+    async with create_session(engine) as session:
+        if not new:
+            result = await session.execute(
+                select(ScrubRuns)
+                .where(ScrubRuns.finished.is_(None))
+                .order_by(ScrubRuns.id.desc())
+                .limit(1)
+            )
+            run = result.scalars().first()
+            if run:
+                status_logger.info(f"Продолжаю проверку {run.id} после {run.last_md5}")
+                return run
+        run = ScrubRuns(verify_md5=verify_md5)
+        session.add(run)
+        await session.commit()
+        await session.refresh(run)
+        status_logger.info(f"Начинаю проверку {run.id}, {verify_md5=}")
+        return run
+
+
+async def scrub(
+        run: ScrubRuns
+):
+    """
+    Function for checking blobs of run from its checkpoint
+    :param run: started or resumed run
+    :return:
+    """
+    scrub_info = config.scrub_info
+    limiter = RateLimiter(scrub_info.bandwidth)
+    semaphore = asyncio.Semaphore(max(1, scrub_info.concurrency))
+    # Checks hold semaphore while they wait for HEADs, so HEADs are bounded by their own
+    head_semaphore = asyncio.Semaphore(max(1, scrub_info.concurrency))
+
+    while True:
+        async with create_session(engine) as session:
+            blobs = await get_blobs(
+                session=session,
+                after=run.last_md5,
+                limit=scrub_info.batch_size
+            )
+        if not blobs:
+            break
+
+        results = await gather_bounded(
+            semaphore,
+            (check_blob(blob, run.verify_md5, limiter, head_semaphore) for blob in blobs)
+        )
+        findings = [result for result in results if result]
+        run.last_md5 = blobs[-1].md5
+        run.checked += len(blobs)
+        async with create_session(engine) as session:
+            await insert_rows(
+                session=session,
+                table=ScrubFindings.__table__,
+                rows=[{"run_id": run.id, **result} for result in findings],
+                ignore_conflicts=True
+            )
+            await session.execute(
+                update(ScrubRuns)
+                .where(ScrubRuns.id == run.id)
+                .values(last_md5=run.last_md5, checked=run.checked)
+            )
+            await session.commit()
+        status_logger.info(
+            f"Проверка {run.id}: проверено {run.checked}, проблем в пачке {len(findings)}"
+        )
+
+    async with create_session(engine) as session:
+        await session.execute(
+            update(ScrubRuns)
+            .where(ScrubRuns.id == run.id)
+            .values(finished=func.clock_timestamp())
+        )
+        await session.commit()
+
+
+async def get_report(
+        run_id: Optional[int] = None
+) -> dict:
+    """
+    Function for getting report of run
+    :param run_id: id of run, last run if not set
+    :return:
+    """
+    async with create_session(engine) as session:
+        query = select(ScrubRuns)
+        if run_id:
+            query = query.where(ScrubRuns.id == run_id)
+        result = await session.execute(query.order_by(ScrubRuns.id.desc()).limit(1))
+        run = result.scalars().first()
+        if not run:
+            return {}
+
+        result = await session.execute(
+            select(ScrubFindings)
+            .where(ScrubFindings.run_id == run.id)
+            .order_by(ScrubFindings.problem, ScrubFindings.md5)
+        )
+        findings = result.scalars().all()
+
+    problems = {MISSING: 0, SIZE_MISMATCH: 0, HASH_MISMATCH: 0, ERROR: 0}
+    for row in findings:
+        problems[row.problem] = problems.get(row.problem, 0) + 1
+    return {
+        "run_id": run.id,
+        "verify_md5": run.verify_md5,
+        "started": run.started,
+        "finished": run.finished,
+        "checked": run.checked,
+        "problems": problems,
+        "findings": [row.dict(exclude={"run_id"}) for row in findings]
+    }
+
+
+async def run_scrubber(
+        args: argparse.Namespace
+):
+    """
+    Function for scrubbing and printing report, clients are closed on exit
+    :param args: arguments of command line
+    :return:
+    """
+    try:
+        if args.report is None:
+            await scrub(await start_run(verify_md5=args.verify_md5, new=args.new))
+        report = await get_report(args.report or None)
+        print(orjson.dumps(report, option=orjson.OPT_INDENT_2).decode())
+    finally:
+        await close_s3_client()
+        await engine.dispose()
+
+
+def main():
+    """
+    Function for parsing command line and running scrubber
+    :return:
+    """
+    parser = argparse.ArgumentParser(description="Integrity scrubber of stored blobs")
+    parser.add_argument(
+        "--verify-md5",
+        action="store_true",
+        default=config.scrub_info.verify_md5,
+        help="recalculate md5 of every blob, used only for new run"
+    )
+    parser.add_argument(
+        "--new",
+        action="store_true",
+        help="start new run instead of resuming unfinished one"
+    )
+    parser.add_argument(
+        "--report",
+        nargs="?",
+        const=0,
+        type=int,
+        metavar="RUN_ID",
+        help="print report of run (last run by default) without checking"
+    )
+    asyncio.run(run_scrubber(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
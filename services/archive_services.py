@@ -0,0 +1,469 @@
+"""
+Module for expanding zip and tar archives into folder trees.
+Archive is read once in order of its entries: every entry is hashed while it is read,
+small entries are uploaded in batches after one md5 lookup, big entries are streamed
+to temporary key and copied inside s3
+"""
+import asyncio
+import hashlib
+import mimetypes
+import tarfile
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import String, Table, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from starlette.concurrency import run_in_threadpool
+
+from buffers import buffer_pool
+from config import config
+from logger import file_logger
+from models.files import Files, FilesMD5, FilesTree
+from services.bulk_services import allocate_ids, insert_rows
+from services.event_services import CREATED, add_events, file_event, folder_event
+from services.file_services import PART_SIZE, delete_temp_file, read_part, upload_stream_to_s3
+from services.folder_stats_services import apply_file_deltas
+from storage import copy_object, get_s3_client
+
+READ_SIZE = 1024 * 1024  # 1 MB
+BATCH_SIZE = 500  # small entries per md5 lookup
+
+
+class ArchiveTooLarge(Exception):
+    """
+    Archive has more entries or uncompressed bytes than allowed by archive_info
+    """
+
+
+@dataclass
+class ArchiveEntry:
+    """
+    File entry of archive
+    """
+    folder: Tuple[str, ...]
+    filename: str
+    md5: str = ""
+    size: int = 0
+
+
+def split_path(
+        name: str
+) -> Tuple[str, ...]:
+    """
+    Function for splitting archive path without empty and relative parts
+    :param name: path in archive
+    :return:
+    """
+    return tuple(
+        part for part in name.replace("\\", "/").split("/")
+        if part not in ("", ".", "..")
+    )
+
+
+def iter_members(
+        fileobj
+) -> Iterator[Tuple[Tuple[str, ...], object, int]]:
+    """
+    Generator with path, file object and size of every regular file of archive.
+    Zip members are read in order of their offsets, tar is read in stream mode,
+    so compressed tar is decompressed only once
+    :param fileobj: seekable binary file with zip or tar archive
+    :return:
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            infos = sorted(
+                (info for info in archive.infolist() if not info.is_dir()),
+                key=lambda info: info.header_offset
+            )
+            for info in infos:
+                with archive.open(info) as entry_file:
+                    yield split_path(info.filename), entry_file, info.file_size
+        return
+
+    fileobj.seek(0)
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile():
+                yield split_path(member.name), archive.extractfile(member), member.size
+
+
+def read_small_entry(
+        entry_file,
+        view: memoryview
+) -> Tuple[int, Optional[str]]:
+    """
+    Function for reading entry into buffer and hashing it in worker thread
+    :param entry_file: file object of entry
+    :param view: memoryview of pooled buffer
+    :return: count of read bytes and md5, md5 is None if entry does not fit in buffer
+    """
+    size = read_part(entry_file, view)
+    if size < len(view):
+        return size, hashlib.md5(view[:size]).hexdigest()
+    return size, None
+
+
+def read_hashed(
+        entry_file,
+        md5_hash
+) -> bytes:
+    """
+    Function for reading next part of entry and updating hash in worker thread
+    :param entry_file: file object of entry
+    :param md5_hash: hash object
+    :return:
+    """
+    content = entry_file.read(READ_SIZE)
+    md5_hash.update(content)
+    return content
+
+
+class ArchiveUploader:
+    """
+    Uploader of entries which are read one by one.
+    Only md5 which are not in db and not uploaded from this archive are sent to s3
+    """
+    def __init__(
+            self,
+            session: AsyncSession
+    ):
+        self.session = session
+        self.concurrency = max(1, config.s3_info.upload_concurrency)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.batch: List[Tuple[ArchiveEntry, bytes]] = []
+        self.batch_bytes = 0
+        self.known_md5: set = set()
+        self.new_md5: set = set()
+
+    async def add(
+            self,
+            entry: ArchiveEntry,
+            entry_file
+    ):
+        """
+        Function for reading entry and uploading it if its md5 is new
+        :param entry: entry of archive
+        :param entry_file: file object of entry
+        :return:
+        """
+        buffer = await buffer_pool.acquire()
+        try:
+            size, md5_hash = await run_in_threadpool(read_small_entry, entry_file, memoryview(buffer))
+            if md5_hash is not None:
+                entry.size = size
+                entry.md5 = md5_hash
+                self.batch.append((entry, bytes(buffer[:size])))
+                self.batch_bytes += size
+            else:
+                await self.flush()
+                big_buffer, buffer = buffer, None
+                await self.upload_big(entry, entry_file, big_buffer)
+        finally:
+            if buffer is not None:
+                buffer_pool.release(buffer)
+        if len(self.batch) >= BATCH_SIZE or self.batch_bytes >= PART_SIZE * self.concurrency:
+            await self.flush()
+
+    async def new_of(
+            self,
+            md5_hashes: set
+    ) -> set:
+        """
+        Function for getting md5 which are not in db and were not seen in archive
+        :param md5_hashes: md5 of entries
+        :return:
+        """
+        unknown = md5_hashes - self.known_md5
+        if not unknown:
+            return set()
+        result = await self.session.execute(
+            select(FilesMD5.id)
+            .where(FilesMD5.id == any_(bindparam("md5", value=list(unknown), type_=ARRAY(String))))
+        )
+        return unknown - set(result.scalars().all())
+
+    async def flush(self):
+        """
+        Function for uploading new md5 of small entries in batch
+        :return:
+        """
+        batch = self.batch
+        self.batch = []
+        self.batch_bytes = 0
+        if not batch:
+            return
+        new_md5 = await self.new_of({entry.md5 for entry, _ in batch})
+        to_upload = {}
+        for entry, content in batch:
+            if entry.md5 in new_md5:
+                to_upload.setdefault(entry.md5, content)
+        s3_client = await get_s3_client()
+
+        async def upload(md5_hash: str, content: bytes):
+            async with self.semaphore:
+                await s3_client.put_object(
+                    Bucket=config.s3_info.bucket,
+                    Key=f"files.md5/{md5_hash}",
+                    Body=content
+                )
+
+        await asyncio.gather(*(upload(md5_hash, content) for md5_hash, content in to_upload.items()))
+        self.new_md5 |= new_md5
+        self.known_md5 |= {entry.md5 for entry, _ in batch}
+
+    async def upload_big(
+            self,
+            entry: ArchiveEntry,
+            entry_file,
+            buffer: bytearray
+    ):
+        """
+        Function for streaming entry bigger than buffer to temporary key with md5 on the fly.
+        Upload continues in the same buffer, so entry holds one pooled buffer.
+        New md5 is copied to files.md5/{md5} inside s3, temporary object is always deleted
+        :param entry: entry of archive
+        :param entry_file: file object of entry
+        :param buffer: pooled buffer filled with first part of entry, it is released here
+        :return:
+        """
+        md5_hash = hashlib.md5()
+        temp_key = f"files.tmp/{uuid4()}"
+
+        async def hashed_stream():
+            while content := await run_in_threadpool(read_hashed, entry_file, md5_hash):
+                entry.size += len(content)
+                yield content
+
+        try:
+            await run_in_threadpool(md5_hash.update, buffer)
+            entry.size = len(buffer)
+            await upload_stream_to_s3(
+                stream=hashed_stream(),
+                key=temp_key,
+                buffer=buffer,
+                filled=len(buffer)
+            )
+            entry.md5 = md5_hash.hexdigest()
+            if await self.new_of({entry.md5}):
+                await copy_object(
+                    copy_from={"Bucket": config.s3_info.bucket, "Key": temp_key},
+                    key=f"files.md5/{entry.md5}",
+                    size=entry.size,
+                    part_size=PART_SIZE
+                )
+                self.new_md5.add(entry.md5)
+            self.known_md5.add(entry.md5)
+        finally:
+            buffer_pool.release(buffer)
+            await delete_temp_file(temp_key)
+
+
+async def create_archive_rows(
+        entries: List[ArchiveEntry],
+        folder_id: int,
+        new_md5: set,
+        session: AsyncSession
+) -> Tuple[List[dict], int]:
+    """
+    Function for bulk creating folders, md5, file and event rows of archive without commit
+    :param entries: hashed entries of archive
+    :param folder_id: id of target folder
+    :param new_md5: md5 which are not in db yet
+    :param session: session to db
+    :return: file rows and count of created folders
+    """
+    inserted = datetime.today()
+    folder_table: Table = FilesTree.__table__
+
+    folders = sorted(
+        {entry.folder[:depth] for entry in entries for depth in range(1, len(entry.folder) + 1)},
+        key=len
+    )
+    folder_ids = {(): folder_id}
+    folder_ids.update(zip(folders, await allocate_ids(
+        session=session,
+        table=folder_table,
+        count=len(folders)
+    )))
+    folder_rows = [
+        {
+            "id": folder_ids[folder],
+            "parent_id": folder_ids[folder[:-1]],
+            "name": folder[-1],
+            "keys": uuid4(),
+            "inserted": inserted,
+            "inserted_by": "StarWorker",
+            "order_n": None
+        }
+        for folder in folders
+    ]
+    await insert_rows(
+        session=session,
+        table=folder_table,
+        rows=folder_rows
+    )
+
+    md5_rows = {}
+    for entry in entries:
+        if entry.md5 in new_md5 and entry.md5 not in md5_rows:
+            md5_rows[entry.md5] = {
+                "id": entry.md5,
+                "mime_type": mimetypes.guess_type(entry.filename)[0] or "application/octet-stream",
+                "file_size": entry.size,
+                "inserted": inserted,
+                "inserted_by": "StarWorker"
+            }
+    await insert_rows(
+        session=session,
+        table=FilesMD5.__table__,
+        rows=list(md5_rows.values()),
+        ignore_conflicts=True
+    )
+
+    file_rows = [
+        {
+            "filename": entry.filename,
+            "folder_id": folder_ids[entry.folder],
+            "keys": uuid4(),
+            "inserted": inserted,
+            "inserted_by": "StarWorker",
+            "md5": entry.md5
+        }
+        for entry in entries
+    ]
+    await insert_rows(
+        session=session,
+        table=Files.__table__,
+        rows=file_rows
+    )
+    await add_events(
+        session=session,
+        events=[
+            folder_event(CREATED, row["keys"], row["id"], row["parent_id"], row["name"])
+            for row in folder_rows
+        ] + [
+            file_event(CREATED, row["keys"], row["folder_id"], row["filename"], row["md5"])
+            for row in file_rows
+        ]
+    )
+
+    folder_totals = {}
+    for entry, row in zip(entries, file_rows):
+        count, size = folder_totals.get(row["folder_id"], (0, 0))
+        folder_totals[row["folder_id"]] = (count + 1, size + entry.size)
+    await apply_file_deltas(
+        session=session,
+        deltas=folder_totals
+    )
+    return file_rows, len(folders)
+
+
+@file_logger.catch()
+async def expand_archive(
+        fileobj,
+        folder_id: int,
+        session: AsyncSession
+) -> Tuple[Optional[dict], Optional[JSONResponse]]:
+    """
+    Function for expanding archive into folder tree.
+    Archive is read in one pass within limits of archive_info,
+    only unknown md5 are uploaded, all rows are inserted in one transaction
+    :param fileobj: seekable binary file with zip or tar archive
+    :param folder_id: id of target folder
+    :param session: session to db
+    :return:
+    """
+    try:
+        result = await session.execute(
+            select(FilesTree.id)
+            .where(FilesTree.id == folder_id)
+        )
+        if not result.first():
+            return None, JSONResponse(
+                status_code=404,
+                content={
+                    "message": f"Folder with {folder_id=} is not exists",
+                    "error": None
+                }
+            )
+
+        entries = []
+        total_size = 0
+        uploader = ArchiveUploader(session)
+        members = iter_members(fileobj)
+        try:
+            while member := await run_in_threadpool(next, members, None):
+                parts, entry_file, declared_size = member
+                if not parts:
+                    continue
+                total_size += declared_size
+                if len(entries) >= config.archive_info.max_entries:
+                    raise ArchiveTooLarge(f"Archive has more than {config.archive_info.max_entries} files")
+                if total_size > config.archive_info.max_total_size:
+                    raise ArchiveTooLarge(
+                        f"Archive has more than {config.archive_info.max_total_size} uncompressed bytes"
+                    )
+                entry = ArchiveEntry(folder=parts[:-1], filename=parts[-1])
+                await uploader.add(entry, entry_file)
+                entries.append(entry)
+            await uploader.flush()
+        finally:
+            await run_in_threadpool(members.close)
+
+        file_rows, folders_count = await create_archive_rows(
+            entries=entries,
+            folder_id=folder_id,
+            new_md5=uploader.new_md5,
+            session=session
+        )
+        await session.commit()
+        return {
+            "files": len(file_rows),
+            "folders": folders_count,
+            "uploaded": len(uploader.new_md5),
+            "deduplicated": len(entries) - len(uploader.new_md5),
+            "items": [
+                {
+                    "path": "/".join((*entry.folder, entry.filename)),
+                    "keys": str(row["keys"]),
+                    "md5": entry.md5,
+                    "folder_id": row["folder_id"]
+                }
+                for entry, row in zip(entries, file_rows)
+            ]
+        }, None
+    except (tarfile.ReadError, zipfile.BadZipFile) as error:
+        await session.rollback()
+        return None, JSONResponse(
+            status_code=400,
+            content={
+                "message": "File is not a valid zip or tar archive",
+                "error": f"{error=}"
+            }
+        )
+    except ArchiveTooLarge as error:
+        await session.rollback()
+        return None, JSONResponse(
+            status_code=413,
+            content={
+                "message": "Archive is too large to expand",
+                "error": f"{error=}"
+            }
+        )
+    except Exception as error:
+        await session.rollback()
+        return None, JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while expanding archive",
+                "error": f"{error=}"
+            }
+        )
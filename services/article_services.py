@@ -0,0 +1,209 @@
+"""
+Module for article services
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import Table
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from logger import file_logger
+from models.articles import Article
+from models.files import FilesTree
+from schemas.articles import ArticleProvision, ArticleProvisioned, FolderSkeleton
+from services.bulk_services import allocate_ids, insert_rows
+from services.event_services import CREATED, add_events, folder_event
+
+
+def count_folders(
+        folders: List[FolderSkeleton]
+) -> int:
+    """
+    Function for counting folders in skeleton
+    :param folders: folder skeletons
+    :return:
+    """
+    return sum(1 + count_folders(folder.children) for folder in folders)
+
+
+def folder_row(
+        folder_id: int,
+        parent_id: int,
+        name: str,
+        inserted: datetime
+) -> dict:
+    """
+    Function for building app.files_tree row
+    :param folder_id: id of folder
+    :param parent_id: id of parent folder
+    :param name: name of folder
+    :param inserted: insert time
+    :return:
+    """
+    return {
+        "id": folder_id,
+        "parent_id": parent_id,
+        "name": name,
+        "keys": uuid4(),
+        "inserted": inserted,
+        "inserted_by": "star_worker",
+        "order_n": None
+    }
+
+
+def find_duplicate_path(
+        folders: List[FolderSkeleton],
+        parent_path: str,
+        seen: set
+) -> Optional[str]:
+    """
+    Function for finding folder path which is used twice in skeleton,
+    for example by sibling folders with same name
+    :param folders: folder skeletons
+    :param parent_path: path of parent folder
+    :param seen: set for already used paths
+    :return: duplicate path or None
+    """
+    for folder in folders:
+        path = f"{parent_path}/{folder.name}" if parent_path else folder.name
+        if path in seen:
+            return path
+        seen.add(path)
+        duplicate = find_duplicate_path(folder.children, path, seen)
+        if duplicate is not None:
+            return duplicate
+    return None
+
+
+def build_folder_rows(
+        folders: List[FolderSkeleton],
+        parent_id: int,
+        parent_path: str,
+        folder_ids,
+        inserted: datetime,
+        rows: List[dict],
+        paths: Dict[str, int]
+):
+    """
+    Function for flattening folder skeleton into rows with reserved ids
+    :param folders: folder skeletons
+    :param parent_id: id of parent folder
+    :param parent_path: path of parent folder
+    :param folder_ids: iterator with reserved ids
+    :param inserted: insert time
+    :param rows: list for rows
+    :param paths: dict for path to id mapping
+    :return:
+    """
+    for folder in folders:
+        folder_id = next(folder_ids)
+        path = f"{parent_path}/{folder.name}" if parent_path else folder.name
+        rows.append(folder_row(folder_id, parent_id, folder.name, inserted))
+        paths[path] = folder_id
+        build_folder_rows(
+            folders=folder.children,
+            parent_id=folder_id,
+            parent_path=path,
+            folder_ids=folder_ids,
+            inserted=inserted,
+            rows=rows,
+            paths=paths
+        )
+
+
+@file_logger.catch()
+async def provision_articles(
+        articles: List[ArticleProvision],
+        session: AsyncSession
+) -> Tuple[List[ArticleProvisioned], Optional[JSONResponse]]:
+    """
+    Function for creating articles with folders in one transaction
+    :param articles: articles with folder skeletons
+    :param session: session to db
+    :return:
+    """
+    try:
+        for article in articles:
+            duplicate = find_duplicate_path(article.folders, "", set())
+            if duplicate is not None:
+                return [], JSONResponse(
+                    status_code=400,
+                    content={
+                        "message": f"Folder '{duplicate}' is used twice in article '{article.title}'",
+                        "error": None
+                    }
+                )
+
+        folder_table: Table = FilesTree.__table__
+        article_table: Table = Article.__table__
+        inserted = datetime.today()
+
+        folder_ids = iter(await allocate_ids(
+            session=session,
+            table=folder_table,
+            count=sum(1 + count_folders(article.folders) for article in articles)
+        ))
+        folder_rows = []
+        article_rows = []
+        provisioned = []
+        for article in articles:
+            root_id = next(folder_ids)
+            folder_rows.append(folder_row(root_id, root_id, "root", inserted))
+            paths = {}
+            build_folder_rows(
+                folders=article.folders,
+                parent_id=root_id,
+                parent_path="",
+                folder_ids=folder_ids,
+                inserted=inserted,
+                rows=folder_rows,
+                paths=paths
+            )
+            article_rows.append({
+                "title": article.title,
+                "folder_id": root_id,
+                "inserted": inserted,
+                "inserted_by": "star_worker"
+            })
+            provisioned.append(ArticleProvisioned(
+                title=article.title,
+                id=0,
+                folder_id=root_id,
+                folders=paths
+            ))
+
+        await insert_rows(
+            session=session,
+            table=folder_table,
+            rows=folder_rows
+        )
+        await add_events(
+            session=session,
+            events=[
+                folder_event(CREATED, row["keys"], row["id"], row["parent_id"], row["name"])
+                for row in folder_rows
+            ]
+        )
+        returned = await insert_rows(
+            session=session,
+            table=article_table,
+            rows=article_rows,
+            returning=[article_table.c.id, article_table.c.folder_id]
+        )
+        await session.commit()
+
+        article_ids = {folder_id: article_id for article_id, folder_id in returned}
+        for article in provisioned:
+            article.id = article_ids[article.folder_id]
+        return provisioned, None
+    except Exception as error:
+        await session.rollback()
+        return [], JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while provisioning articles",
+                "error": f"{error=}"
+            }
+        )
@@ -0,0 +1,101 @@
+"""
+Module for bulk db operations.
+Functions here do not commit, they are executed in transaction of caller
+"""
+from typing import List, Optional
+
+from sqlalchemy import Table, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+MAX_QUERY_PARAMS = 32767  # asyncpg limit of bind parameters in one query
+COPY_THRESHOLD = 10000  # rows, bigger batches are sent with COPY
+
+
+async def allocate_ids(
+        session: AsyncSession,
+        table: Table,
+        count: int
+) -> List[int]:
+    """
+    Function for reserving ids from sequence of table in one round trip
+    :param session: session to db
+    :param table: table with serial id column
+    :param count: count of ids
+    :return:
+    """
+    if not count:
+        return []
+    result = await session.execute(
+        text(
+            "select nextval(pg_get_serial_sequence(:table_name, 'id')) "
+            "from generate_series(1, :count)"
+        ),
+        {"table_name": f"{table.schema}.{table.name}", "count": count}
+    )
+    return list(result.scalars().all())
+
+
+async def copy_rows(
+        session: AsyncSession,
+        table: Table,
+        rows: List[dict]
+):
+    """
+    Function for inserting rows with COPY in current transaction
+    :param session: session to db
+    :param table: target table
+    :param rows: rows with same keys
+    :return:
+    """
+    columns = list(rows[0].keys())
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        table.name,
+        schema_name=table.schema,
+        columns=columns,
+        records=[tuple(row[column] for column in columns) for row in rows]
+    )
+
+
+async def insert_rows(
+        session: AsyncSession,
+        table: Table,
+        rows: List[dict],
+        returning: Optional[list] = None,
+        ignore_conflicts: bool = False
+) -> list:
+    """
+    Function for multi-row insert without commit.
+    Rows are split in batches by asyncpg parameters limit,
+    big batches without returning are sent with COPY
+    :param session: session to db
+    :param table: target table
+    :param rows: rows with same keys
+    :param returning: columns for RETURNING
+    :param ignore_conflicts: add ON CONFLICT DO NOTHING
+    :return: returned rows
+    """
+    if not rows:
+        return []
+    if returning is None and not ignore_conflicts and len(rows) >= COPY_THRESHOLD:
+        await copy_rows(
+            session=session,
+            table=table,
+            rows=rows
+        )
+        return []
+
+    returned = []
+    batch_size = max(1, MAX_QUERY_PARAMS // len(rows[0]))
+    for start in range(0, len(rows), batch_size):
+        statement = insert(table).values(rows[start:start + batch_size])
+        if ignore_conflicts:
+            statement = statement.on_conflict_do_nothing()
+        if returning is not None:
+            statement = statement.returning(*returning)
+        result = await session.execute(statement)
+        if returning is not None:
+            returned.extend(result.all())
+    return returned
@@ -0,0 +1,434 @@
+"""
+Module for chunked storage with content-defined chunking.
+File is split by rolling gear hash, so inserted or removed bytes
+change only neighbour chunks, every chunk is stored once in s3
+"""
+import asyncio
+import hashlib
+import threading
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi.responses import JSONResponse
+from sqlalchemy import String, any_, bindparam, func
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from starlette.concurrency import run_in_threadpool
+
+from buffers import buffer_pool
+from config import config
+from logger import file_logger
+from models.files import Chunks, FileChunks, FilesMD5
+from services.bulk_services import insert_rows
+from services.download_services import fetch_range
+from storage import get_s3_client
+
+GEAR_MASK = (1 << 64) - 1
+# Fixed table, chunk boundaries must be same in all workers and releases
+GEAR = [
+    int.from_bytes(hashlib.md5(bytes([byte])).digest()[:8], "big")
+    for byte in range(256)
+]
+GEAR_TABLE = np.array(GEAR, dtype=np.uint64)
+# Hash of position depends only on last 64 bytes, because older bytes are shifted out
+GEAR_WINDOW = 64
+SCAN_BLOCK = 64 * 1024
+
+
+def chunk_key(
+        chunk_id: str
+) -> str:
+    return f"chunks.md5/{chunk_id}"
+
+
+def gear_boundaries(
+        data,
+        mask: int,
+        start: int = 0
+) -> np.ndarray:
+    """
+    Function for finding positions where gear hash of 64 bytes window has zero mask bits.
+    Hashes of block are calculated by numpy at once: window is doubled
+    with hash[i] += hash[i - width] << width, so hash is not rolled per byte in python
+    :param data: bytes-like object
+    :param mask: mask of top bits of hash
+    :param start: first position to check, previous bytes are only window of it
+    :return: positions in data, positions before 63 have incomplete window
+    """
+    view = np.frombuffer(data, dtype=np.uint8)
+    # Top bits of hash are zero only when hash is not greater than inverted mask
+    limit = np.uint64(mask ^ GEAR_MASK)
+    hashes = np.empty(SCAN_BLOCK + GEAR_WINDOW - 1, dtype=np.uint64)
+    shifted = np.empty_like(hashes)
+    found = [np.empty(0, dtype=np.int64)]
+    for block_start in range(start, len(view), SCAN_BLOCK):
+        lookback = min(block_start, GEAR_WINDOW - 1)
+        block = view[block_start - lookback:block_start + SCAN_BLOCK]
+        size = len(block)
+        block_hashes = hashes[:size]
+        np.take(GEAR_TABLE, block, out=block_hashes)
+        width = 1
+        while width < min(GEAR_WINDOW, size):
+            np.left_shift(block_hashes[:size - width], np.uint64(width), out=shifted[:size - width])
+            np.add(block_hashes[width:], shifted[:size - width], out=block_hashes[width:])
+            width *= 2
+        found.append(np.flatnonzero(block_hashes[lookback:] <= limit) + block_start)
+    return np.concatenate(found)
+
+
+class Chunker:
+    """
+    Content-defined chunker with gear rolling hash.
+    Boundary is found when top bits of hash are zero,
+    chunk size is kept between min_size and max_size
+    """
+    def __init__(
+            self,
+            min_size: int,
+            avg_size: int,
+            max_size: int
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        bits = max(avg_size.bit_length() - 1, 1)
+        self.mask = ((1 << bits) - 1) << (64 - bits)
+        self._buffer = bytearray()
+        self._boundaries = np.empty(0, dtype=np.int64)
+
+    def _cut_point(
+            self,
+            start: int
+    ) -> Optional[int]:
+        """
+        Function for finding end of chunk which starts at start.
+        Hash is rolled from min_size of chunk, so first 63 positions
+        are hashed one by one and others are taken from boundaries
+        :param start: start of chunk in buffer
+        :return: end of chunk or None when more data is needed
+        """
+        buffer = self._buffer
+        boundaries = self._boundaries
+        first = start + self.min_size
+        end = min(len(buffer), start + self.max_size)
+        rolling_hash = 0
+        for position in range(first, min(first + GEAR_WINDOW - 1, end)):
+            rolling_hash = ((rolling_hash << 1) + GEAR[buffer[position]]) & GEAR_MASK
+            if not rolling_hash & self.mask:
+                return position + 1
+        index = np.searchsorted(boundaries, first + GEAR_WINDOW - 1)
+        if index < len(boundaries) and boundaries[index] < end:
+            return int(boundaries[index]) + 1
+        if len(buffer) - start >= self.max_size:
+            return start + self.max_size
+        return None
+
+    def feed(
+            self,
+            data
+    ) -> List[bytes]:
+        """
+        Function for adding data to chunker
+        :param data: bytes-like object
+        :return: completed chunks
+        """
+        scanned = len(self._buffer)
+        self._buffer += data
+        self._boundaries = np.concatenate((
+            self._boundaries,
+            gear_boundaries(self._buffer, self.mask, scanned)
+        ))
+        chunks = []
+        start = 0
+        while len(self._buffer) - start > self.min_size and (cut := self._cut_point(start)):
+            chunks.append(bytes(self._buffer[start:cut]))
+            start = cut
+        del self._buffer[:start]
+        self._boundaries = self._boundaries[self._boundaries >= start] - start
+        return chunks
+
+    def finish(self) -> List[bytes]:
+        """
+        Function for getting last chunk
+        :return:
+        """
+        chunks = [bytes(self._buffer)] if self._buffer else []
+        self._buffer = bytearray()
+        self._boundaries = np.empty(0, dtype=np.int64)
+        return chunks
+
+
+def scan_file(
+        file,
+        view: memoryview
+) -> Tuple[str, int, List[Tuple[str, int, int]]]:
+    """
+    Function for splitting file into chunks in one pass
+    :param file: seekable binary file
+    :param view: memoryview of pooled buffer
+    :return: md5 of file, size of file and chunks (md5, offset, size)
+    """
+    chunker = Chunker(
+        min_size=config.chunking_info.min_size,
+        avg_size=config.chunking_info.avg_size,
+        max_size=config.chunking_info.max_size
+    )
+    md5_hash = hashlib.md5()
+    chunks = []
+    offset = 0
+
+    def add_chunks(contents: List[bytes]):
+        nonlocal offset
+        for content in contents:
+            chunks.append((hashlib.md5(content).hexdigest(), offset, len(content)))
+            offset += len(content)
+
+    file.seek(0)
+    while size := file.readinto(view):
+        md5_hash.update(view[:size])
+        add_chunks(chunker.feed(view[:size]))
+    add_chunks(chunker.finish())
+    file.seek(0)
+    return md5_hash.hexdigest(), offset, chunks
+
+
+async def upload_chunks(
+        file,
+        chunks: List[Tuple[str, int, int]],
+        session: AsyncSession
+) -> Tuple[int, int]:
+    """
+    Function for uploading chunks which are not in db yet
+    with bounded parallelism
+    :param file: seekable binary file
+    :param chunks: chunks of file (md5, offset, size)
+    :param session: session to db
+    :return: count and size of uploaded chunks
+    """
+    chunk_ids = list({chunk_id for chunk_id, _, _ in chunks})
+    result = await session.execute(
+        select(Chunks.id)
+        .where(Chunks.id == any_(bindparam("chunk_ids", value=chunk_ids, type_=ARRAY(String))))
+    )
+    existing = set(result.scalars().all())
+    to_upload = {}
+    for chunk_id, offset, size in chunks:
+        if chunk_id not in existing:
+            to_upload.setdefault(chunk_id, (offset, size))
+
+    lock = threading.Lock()
+    semaphore = asyncio.Semaphore(max(1, config.s3_info.upload_concurrency))
+    s3_client = await get_s3_client()
+
+    def read_chunk(offset: int, size: int) -> bytes:
+        with lock:
+            file.seek(offset)
+            return file.read(size)
+
+    async def upload_chunk(chunk_id: str, offset: int, size: int):
+        async with semaphore:
+            await s3_client.put_object(
+                Bucket=config.s3_info.bucket,
+                Key=chunk_key(chunk_id),
+                Body=await run_in_threadpool(read_chunk, offset, size)
+            )
+
+    await asyncio.gather(*(
+        upload_chunk(chunk_id, offset, size)
+        for chunk_id, (offset, size) in to_upload.items()
+    ))
+    return len(to_upload), sum(size for _, size in to_upload.values())
+
+
+@file_logger.catch()
+async def store_file_chunked(
+        file,
+        session: AsyncSession
+) -> Tuple[str, int, dict, Optional[JSONResponse]]:
+    """
+    Function for storing file as manifest of chunks.
+    Chunks and manifest rows are added without commit,
+    they are committed with md5 row
+    :param file: seekable binary file
+    :param session: session to db
+    :return: md5 of file, size of file and chunk statistics
+    """
+    try:
+        async with buffer_pool.buffer() as buffer:
+            md5_hash, file_size, chunks = await run_in_threadpool(
+                scan_file, file, memoryview(buffer)
+            )
+
+        result = await session.execute(
+            select(FilesMD5.id)
+            .where(FilesMD5.id == md5_hash)
+        )
+        if result.first():
+            return md5_hash, file_size, {
+                "chunks": 0,
+                "uploaded_chunks": 0,
+                "uploaded_bytes": 0
+            }, None
+
+        if not chunks:
+            # Empty file has no chunks, it is stored as plain object
+            s3_client = await get_s3_client()
+            await s3_client.put_object(
+                Bucket=config.s3_info.bucket,
+                Key=f"files.md5/{md5_hash}",
+                Body=b""
+            )
+
+        uploaded_chunks, uploaded_bytes = await upload_chunks(
+            file=file,
+            chunks=chunks,
+            session=session
+        )
+
+        inserted = datetime.today()
+        chunk_rows = {}
+        for chunk_id, _, size in chunks:
+            chunk_rows[chunk_id] = {
+                "id": chunk_id,
+                "chunk_size": size,
+                "inserted": inserted,
+                "inserted_by": "StarWorker"
+            }
+        await insert_rows(
+            session=session,
+            table=Chunks.__table__,
+            rows=list(chunk_rows.values()),
+            ignore_conflicts=True
+        )
+        await insert_rows(
+            session=session,
+            table=FileChunks.__table__,
+            rows=[
+                {"md5": md5_hash, "seq": seq, "chunk_id": chunk_id}
+                for seq, (chunk_id, _, _) in enumerate(chunks)
+            ],
+            ignore_conflicts=True
+        )
+        return md5_hash, file_size, {
+            "chunks": len(chunks),
+            "uploaded_chunks": uploaded_chunks,
+            "uploaded_bytes": uploaded_bytes
+        }, None
+    except Exception as error:
+        await session.rollback()
+        return "", 0, {}, JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while storing file by chunks",
+                "error": f"{error=}"
+            }
+        )
+
+
+async def get_manifests(
+        md5_hashes: List[str],
+        session: AsyncSession
+) -> Dict[str, List[Tuple[str, int]]]:
+    """
+    Function for getting manifests of files in one query
+    :param md5_hashes: md5 of files
+    :param session: session to db
+    :return: chunks (id, size) in order by md5, not chunked files are absent
+    """
+    result = await session.execute(
+        select(FileChunks.md5, FileChunks.chunk_id, Chunks.chunk_size)
+        .join(Chunks, Chunks.id == FileChunks.chunk_id)
+        .where(
+            FileChunks.md5 == any_(bindparam("md5", value=list(md5_hashes), type_=ARRAY(String)))
+        )
+        .order_by(FileChunks.md5, FileChunks.seq)
+    )
+    manifests = {}
+    for md5_hash, chunk_id, chunk_size in result:
+        manifests.setdefault(md5_hash, []).append((chunk_id, chunk_size))
+    return manifests
+
+
+async def get_manifest(
+        md5_hash: str,
+        session: AsyncSession
+) -> List[Tuple[str, int]]:
+    """
+    Function for getting manifest of file
+    :param md5_hash: md5 of file
+    :param session: session to db
+    :return: chunks (id, size) in order, empty for not chunked file
+    """
+    manifests = await get_manifests([md5_hash], session)
+    return manifests.get(md5_hash, [])
+
+
+async def stream_chunks(
+        chunks: List[Tuple[str, int]],
+        first: int = 0,
+        last: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """
+    Generator with bytes from first to last byte of file reassembled from chunks.
+    Only chunks of range are fetched, next chunks are fetched in parallel within window
+    :param chunks: chunks (id, size) in order
+    :param first: first byte
+    :param last: last byte, end of file by default
+    :return:
+    """
+    if last is None:
+        last = sum(size for _, size in chunks) - 1
+
+    def chunk_ranges():
+        offset = 0
+        for chunk_id, size in chunks:
+            if offset > last:
+                return
+            if offset + size > first:
+                yield chunk_key(chunk_id), max(first - offset, 0), min(last - offset, size - 1)
+            offset += size
+
+    ranges = chunk_ranges()
+    pending = deque()
+    try:
+        for key, start, end in ranges:
+            pending.append(asyncio.create_task(fetch_range(key, start, end)))
+            if len(pending) >= config.chunking_info.download_window:
+                break
+        while pending:
+            content = await pending.popleft()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(asyncio.create_task(fetch_range(*next_range)))
+            yield content
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def get_dedup_stats(
+        session: AsyncSession
+) -> dict:
+    """
+    Function for getting deduplication statistics of chunked storage
+    :param session: session to db
+    :return:
+    """
+    result = await session.execute(
+        select(func.count(), func.coalesce(func.sum(FilesMD5.file_size), 0))
+        .where(FilesMD5.id.in_(select(FileChunks.md5).distinct()))
+    )
+    files_count, logical_bytes = result.one()
+    result = await session.execute(
+        select(func.count(), func.coalesce(func.sum(Chunks.chunk_size), 0))
+    )
+    chunks_count, stored_bytes = result.one()
+    return {
+        "chunked_files": files_count,
+        "chunks": chunks_count,
+        "logical_bytes": int(logical_bytes),
+        "stored_bytes": int(stored_bytes),
+        "dedup_ratio": round(logical_bytes / stored_bytes, 4) if stored_bytes else None
+    }
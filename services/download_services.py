@@ -0,0 +1,139 @@
+"""
+Module for downloading large objects by byte ranges.
+Ranges are fetched from s3 in parallel within window
+and are yielded in order, so one download uses several connections
+"""
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Optional, Tuple
+
+from config import config
+from logger import file_logger
+from storage import get_s3_client
+
+
+def parse_range(
+        range_header: Optional[str],
+        size: int
+) -> Optional[Tuple[int, int]]:
+    """
+    Function for parsing Range header with one byte range.
+    Malformed and multiple ranges are ignored, whole file is sent for them
+    :param range_header: value of Range header
+    :param size: size of file
+    :return: first and last byte or None for whole file
+    :raises ValueError: range is not satisfiable
+    """
+    if not range_header:
+        return None
+    unit, _, byte_range = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in byte_range:
+        return None
+    first, _, last = byte_range.strip().partition("-")
+    if not (first or last) or not (first or "0").isdigit() or not (last or "0").isdigit():
+        return None
+
+    if not first:
+        suffix = int(last)
+        if not suffix or not size:
+            raise ValueError(f"Range {range_header} is not satisfiable")
+        return max(size - suffix, 0), size - 1
+
+    first = int(first)
+    last = int(last) if last else size - 1
+    if last < first:
+        return None
+    if first >= size:
+        raise ValueError(f"Range {range_header} is not satisfiable")
+    return first, min(last, size - 1)
+
+
+async def read_into(
+        body,
+        view: memoryview
+) -> int:
+    """
+    Function for reading body of s3 object into buffer.
+    Body has no readinto, so its chunks are copied into view
+    :param body: streaming body of s3 object
+    :param view: memoryview of buffer
+    :return: count of read bytes, 0 at end of body
+    """
+    filled = 0
+    while filled < len(view):
+        content = await body.read(len(view) - filled)
+        if not content:
+            break
+        view[filled:filled + len(content)] = content
+        filled += len(content)
+    return filled
+
+
+async def fetch_range(
+        key: str,
+        first: int,
+        last: int
+) -> bytes:
+    """
+    Function for getting byte range of object with retries
+    :param key: key of object
+    :param first: first byte
+    :param last: last byte
+    :return:
+    """
+    s3_client = await get_s3_client()
+    retries = max(1, config.s3_info.range_retries)
+    for attempt in range(1, retries + 1):
+        try:
+            result = await s3_client.get_object(
+                Bucket=config.s3_info.bucket,
+                Key=key,
+                Range=f"bytes={first}-{last}"
+            )
+            async with result["Body"] as body:
+                content = await body.read()
+            if len(content) != last - first + 1:
+                raise IOError(f"Got {len(content)} bytes of range {first}-{last}")
+            return content
+        except Exception as error:
+            if attempt == retries:
+                raise
+            file_logger.warning(
+                f"Retrying range {first}-{last} of {key} after {attempt=}: {error=}"
+            )
+            await asyncio.sleep(0.1 * 2 ** attempt)
+
+
+async def stream_ranges(
+        key: str,
+        first: int,
+        last: int
+) -> AsyncIterator[bytes]:
+    """
+    Generator with bytes from first to last byte of object.
+    Next ranges are fetched in parallel within window
+    :param key: key of object
+    :param first: first byte
+    :param last: last byte
+    :return:
+    """
+    range_size = config.s3_info.range_size
+    ranges = iter(
+        (start, min(start + range_size, last + 1) - 1)
+        for start in range(first, last + 1, range_size)
+    )
+    pending = deque()
+    try:
+        for start, end in ranges:
+            pending.append(asyncio.create_task(fetch_range(key, start, end)))
+            if len(pending) >= config.s3_info.range_window:
+                break
+        while pending:
+            content = await pending.popleft()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(asyncio.create_task(fetch_range(key, *next_range)))
+            yield content
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,347 @@
+"""
+Module for change feed of files and folders.
+Events are written in transaction of change, so clients can sync
+incrementally from cursor instead of rescanning all files
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from pydantic import UUID4
+from sqlalchemy import func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from config import config
+from database import create_session, engine
+from logger import status_logger
+from models.files import ChangeEvents
+from services.bulk_services import insert_rows
+
+CREATED = "created"
+DELETED = "deleted"
+MOVED = "moved"
+
+# Snapshot is taken by the same statement, so it matches visible events
+GET_EVENTS = text("""
+select id, entity, action, keys, folder_id, parent_id, name, md5, inserted,
+       pg_snapshot_xmin(snapshot)::text::bigint as snapshot_xmin,
+       pg_snapshot_xmax(snapshot)::text::bigint as snapshot_xmax
+from app.change_events, pg_current_snapshot() as current_snapshot(snapshot)
+where id > :cursor
+order by id
+limit :limit
+""")
+SETTLED_GAPS = 10000
+
+
+def file_event(
+        action: str,
+        keys: UUID4,
+        folder_id: int,
+        filename: str,
+        md5: str
+) -> dict:
+    """
+    Function for building row of file event
+    :param action: created, deleted or moved
+    :param keys: keys of file
+    :param folder_id: id of folder of file
+    :param filename: name of file
+    :param md5: md5 of file
+    :return:
+    """
+    return {
+        "entity": "file",
+        "action": action,
+        "keys": keys,
+        "folder_id": folder_id,
+        "parent_id": None,
+        "name": filename,
+        "md5": md5
+    }
+
+
+def folder_event(
+        action: str,
+        keys: UUID4,
+        folder_id: int,
+        parent_id: int,
+        name: str
+) -> dict:
+    """
+    Function for building row of folder event
+    :param action: created, deleted or moved
+    :param keys: keys of folder
+    :param folder_id: id of folder
+    :param parent_id: id of parent folder
+    :param name: name of folder
+    :return:
+    """
+    return {
+        "entity": "folder",
+        "action": action,
+        "keys": keys,
+        "folder_id": folder_id,
+        "parent_id": parent_id,
+        "name": name,
+        "md5": None
+    }
+
+
+async def add_events(
+        session: AsyncSession,
+        events: List[dict]
+):
+    """
+    Function for writing events without commit,
+    they are committed with change itself
+    :param session: session to db
+    :param events: rows from file_event and folder_event
+    :return:
+    """
+    await insert_rows(
+        session=session,
+        table=ChangeEvents.__table__,
+        rows=events
+    )
+
+
+class GapTracker:
+    """
+    Tracker of gaps in ids of events.
+    Ids are taken from sequence before commit, so event with smaller id
+    can become visible later. Missing id was taken before event after it
+    was committed, so its transaction was in progress when gap was first seen.
+    Gap is open until id appears or all transactions which were in progress
+    then have ended, so xmin of snapshot passed xmax of first snapshot.
+    Gaps are tracked by worker, gap first seen by other worker only waits longer
+    """
+    def __init__(
+            self,
+            max_settled: int
+    ):
+        self.max_settled = max_settled
+        self._seen: Dict[int, int] = {}
+        self._settled: OrderedDict = OrderedDict()
+
+    def is_settled(
+            self,
+            gap_id: int,
+            snapshot_xmin: int,
+            snapshot_xmax: int
+    ) -> bool:
+        """
+        Function for checking that missing id will not appear
+        :param gap_id: first missing id
+        :param snapshot_xmin: oldest transaction in progress of current snapshot
+        :param snapshot_xmax: first not started transaction of current snapshot
+        :return:
+        """
+        if gap_id in self._settled:
+            return True
+        seen_xmax = self._seen.setdefault(gap_id, snapshot_xmax)
+        if snapshot_xmin < seen_xmax:
+            return False
+        del self._seen[gap_id]
+        self._settled[gap_id] = None
+        if len(self._settled) > self.max_settled:
+            self._settled.popitem(last=False)
+        return True
+
+    def filled(
+            self,
+            event_id: int
+    ):
+        """
+        Function for forgetting gap whose id appeared
+        :param event_id: id of received event
+        :return:
+        """
+        self._seen.pop(event_id, None)
+
+
+gap_tracker = GapTracker(
+    max_settled=SETTLED_GAPS
+)
+
+
+async def get_events(
+        session: AsyncSession,
+        cursor: int,
+        limit: int
+) -> Tuple[List[dict], int]:
+    """
+    Function for getting events after cursor
+    :param session: session to db
+    :param cursor: id of last received event
+    :param limit: max count of events
+    :return: events and cursor for next call
+    """
+    result = await session.execute(
+        GET_EVENTS,
+        {
+            "cursor": cursor,
+            "limit": limit
+        }
+    )
+    events = []
+    for row in result.mappings():
+        event = dict(row)
+        snapshot_xmin = event.pop("snapshot_xmin")
+        snapshot_xmax = event.pop("snapshot_xmax")
+        if event["id"] != cursor + 1 and not gap_tracker.is_settled(cursor + 1, snapshot_xmin, snapshot_xmax):
+            break
+        gap_tracker.filled(event["id"])
+        cursor = event["id"]
+        events.append(event)
+    return events, cursor
+
+
+async def get_last_event_id(
+        session: AsyncSession
+) -> int:
+    """
+    Function for getting id of last event in feed
+    :param session: session to db
+    :return:
+    """
+    result = await session.execute(
+        select(func.max(ChangeEvents.id))
+    )
+    return result.scalar() or 0
+
+
+class ChangeFeed:
+    """
+    Notifier of streams of one worker.
+    One task polls last id of feed while there are subscribers,
+    so idle streams do not query db
+    """
+    def __init__(
+            self,
+            poll_interval: float
+    ):
+        self.poll_interval = poll_interval
+        self.last_id = 0
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def changed(self) -> asyncio.Event:
+        """
+        Event which is set on next change of feed
+        """
+        return self._changed
+
+    def notify(self):
+        """
+        Function for waking streams which wait for change
+        :return:
+        """
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    @asynccontextmanager
+    async def subscribe(self):
+        """
+        Context manager for stream which waits for changes.
+        Poll task is started by first subscriber and stops without subscribers
+        :return:
+        """
+        self.subscribers += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll())
+        try:
+            yield self
+        finally:
+            self.subscribers -= 1
+
+    async def _poll(self):
+        """
+        Function for polling last id of feed while there are subscribers
+        :return:
+        """
+        while self.subscribers:
+            try:
+                async with create_session(engine) as session:
+                    last_id = await get_last_event_id(session=session)
+                if last_id != self.last_id:
+                    self.last_id = last_id
+                    self.notify()
+            except Exception as error:
+                status_logger.error(f"Error while polling change feed: {error=}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def close(self):
+        """
+        Function for stopping poll task on shutdown
+        :return:
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+change_feed = ChangeFeed(
+    poll_interval=config.change_feed_info.poll_interval
+)
+
+
+def format_event(
+        event: dict
+) -> bytes:
+    """
+    Function for formatting event as server-sent event
+    :param event: event from get_events
+    :return:
+    """
+    return (
+        f"id: {event['id']}\nevent: {event['entity']}_{event['action']}\ndata: ".encode()
+        + orjson.dumps(event)
+        + b"\n\n"
+    )
+
+
+async def stream_events(
+        cursor: int
+) -> AsyncIterator[bytes]:
+    """
+    Generator with server-sent events after cursor.
+    Stream is closed after stream_duration,
+    client reconnects with Last-Event-ID
+    :param cursor: id of last received event
+    :return:
+    """
+    feed_info = config.change_feed_info
+    deadline = time.monotonic() + feed_info.stream_duration
+    yield f"retry: {int(feed_info.poll_interval * 1000)}\n\n".encode()
+    async with change_feed.subscribe():
+        while (remaining := deadline - time.monotonic()) > 0:
+            changed = change_feed.changed
+            async with create_session(engine) as session:
+                events, cursor = await get_events(
+                    session=session,
+                    cursor=cursor,
+                    limit=feed_info.page_size
+                )
+            for event in events:
+                yield format_event(event)
+            if len(events) == feed_info.page_size:
+                continue
+
+            # Behind last id means stream waits for gap to settle
+            timeout = feed_info.poll_interval if change_feed.last_id > cursor \
+                else feed_info.keepalive_interval
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=min(timeout, remaining))
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
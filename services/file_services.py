@@ -2,25 +2,47 @@
 Module for file services
 """
 # coding: utf8
+import asyncio
 import hashlib
 from datetime import datetime
-from typing import Union, Tuple, Optional
+from typing import AsyncIterator, Union, Tuple, Optional
 from uuid import uuid4
 
-import aioboto3
 from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from buffers import ReadIntoFile, buffer_pool
+from coalescer import write_coalescer
 from config import config
 from logger import file_logger
 from models.files import Files, FilesMD5
 from schemas.files import FileUpload
+from services.event_services import CREATED, add_events, file_event
+from services.folder_stats_services import apply_file_delta
+from storage import copy_object, get_s3_client
 
-s3_session = aioboto3.Session()
+PART_SIZE = buffer_pool.buffer_size
 
-CHUNK_SIZE = 100 * 1024 * 1024  # 100 MB
+
+def hash_file_into(
+        file,
+        view: memoryview,
+        md5_hash
+) -> int:
+    """
+    Function for reading file into buffer and updating hash in worker thread
+    :param file: binary file object
+    :param view: memoryview of pooled buffer
+    :param md5_hash: hash object
+    :return: count of read bytes
+    """
+    size = file.readinto(view)
+    if size:
+        md5_hash.update(view[:size])
+    return size
 
 
 @file_logger.catch()
@@ -35,9 +57,11 @@ async def get_md5_and_file_size(
     try:
         md5_hash = hashlib.md5()
         file_size = 0
-        while content := await file.read(CHUNK_SIZE):
-            file_size += len(content)
-            md5_hash.update(content)
+        raw_file = ReadIntoFile(file.file)
+        async with buffer_pool.buffer() as buffer:
+            view = memoryview(buffer)
+            while size := await run_in_threadpool(hash_file_into, raw_file, view, md5_hash):
+                file_size += size
         md5_hash = str(md5_hash.hexdigest())
         file.file.seek(0)
         return md5_hash, file_size, None
@@ -82,6 +106,109 @@ async def check_md5_in_db(
         )
 
 
+def read_part(
+        file,
+        view: memoryview
+) -> int:
+    """
+    Function for filling buffer from file in worker thread,
+    buffer is not full only at end of file
+    :param file: binary file object with readinto
+    :param view: memoryview of pooled buffer
+    :return: count of read bytes
+    """
+    filled = 0
+    while filled < len(view):
+        size = file.readinto(view[filled:])
+        if not size:
+            break
+        filled += size
+    return filled
+
+
+async def upload_fileobj_to_s3(
+        file,
+        key: str
+):
+    """
+    Function for uploading local file to s3 from pooled buffers.
+    File smaller than PART_SIZE is sent by one put, bigger file by multipart upload
+    with upload_concurrency parts in flight, every part in its own buffer. Errors are raised
+    :param file: seekable binary file object with readinto
+    :param key: key of object in s3
+    :return:
+    """
+    s3_client = await get_s3_client()
+    upload_id = None
+    parts = []
+    in_flight = set()
+
+    async def upload_part(part_number: int, part_buffer: bytearray, part_size: int):
+        try:
+            part = await s3_client.upload_part(
+                Bucket=config.s3_info.bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=part_buffer if part_size == PART_SIZE else part_buffer[:part_size]
+            )
+            parts.append({"ETag": part["ETag"], "PartNumber": part_number})
+        finally:
+            buffer_pool.release(part_buffer)
+
+    file.seek(0)
+    buffer = await buffer_pool.acquire()
+    try:
+        size = await run_in_threadpool(read_part, file, memoryview(buffer))
+        if size < PART_SIZE:
+            await s3_client.put_object(
+                Bucket=config.s3_info.bucket,
+                Key=key,
+                Body=buffer[:size]
+            )
+            return
+
+        multipart_upload = await s3_client.create_multipart_upload(
+            Bucket=config.s3_info.bucket,
+            Key=key
+        )
+        upload_id = multipart_upload["UploadId"]
+        part_number = 0
+        while size:
+            part_number += 1
+            # Buffer is released by task of part
+            in_flight.add(asyncio.create_task(upload_part(part_number, buffer, size)))
+            buffer = None
+            if len(in_flight) >= max(1, config.s3_info.upload_concurrency):
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            if size < PART_SIZE:
+                break
+            buffer = await buffer_pool.acquire()
+            size = await run_in_threadpool(read_part, file, memoryview(buffer))
+        await asyncio.gather(*in_flight)
+        await s3_client.complete_multipart_upload(
+            Bucket=config.s3_info.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": sorted(parts, key=lambda part: part["PartNumber"])}
+        )
+    except BaseException:
+        # Started parts are awaited, not cancelled, so their buffers are returned
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        if upload_id is not None:
+            await s3_client.abort_multipart_upload(
+                Bucket=config.s3_info.bucket,
+                Key=key,
+                UploadId=upload_id
+            )
+        raise
+    finally:
+        if buffer is not None:
+            buffer_pool.release(buffer)
+
+
 @file_logger.catch()
 async def upload_file_to_s3(
         file: UploadFile,
@@ -94,17 +221,10 @@ async def upload_file_to_s3(
     :return:
     """
     try:
-        async with s3_session.client(
-                "s3",
-                endpoint_url=config.s3_info.host,
-                aws_access_key_id=config.s3_info.access_key,
-                aws_secret_access_key=config.s3_info.secret_key
-        ) as s3_client:
-            await s3_client.upload_fileobj(
-                file.file,
-                config.s3_info.bucket,
-                f"files.md5/{md5_hash}"
-            )
+        await upload_fileobj_to_s3(
+            file=ReadIntoFile(file.file),
+            key=f"files.md5/{md5_hash}"
+        )
         return None
     except Exception as error:
         return JSONResponse(
@@ -116,6 +236,173 @@ async def upload_file_to_s3(
         )
 
 
+async def upload_stream_to_s3(
+        stream: AsyncIterator[bytes],
+        key: str,
+        buffer: Optional[bytearray] = None,
+        filled: int = 0
+):
+    """
+    Function for multipart upload of stream to s3 from pooled buffer,
+    memory usage is bounded by PART_SIZE. Errors are raised
+    :param stream: Async iterator with file content
+    :param key: key of object in s3
+    :param buffer: pooled buffer of caller, it is used instead of new one and is not released
+    :param filled: count of bytes at start of buffer which are first bytes of content
+    :return:
+    """
+    s3_client = await get_s3_client()
+    multipart_upload = await s3_client.create_multipart_upload(
+        Bucket=config.s3_info.bucket,
+        Key=key
+    )
+    upload_id = multipart_upload["UploadId"]
+    parts = []
+
+    async def upload_part(body):
+        part_number = len(parts) + 1
+        part = await s3_client.upload_part(
+            Bucket=config.s3_info.bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body
+        )
+        parts.append({"ETag": part["ETag"], "PartNumber": part_number})
+
+    async def upload_parts(part_buffer: bytearray, part_filled: int):
+        view = memoryview(part_buffer)
+        async for content in stream:
+            offset = 0
+            while offset < len(content):
+                if part_filled == PART_SIZE:
+                    await upload_part(part_buffer)
+                    part_filled = 0
+                size = min(len(content) - offset, PART_SIZE - part_filled)
+                view[part_filled:part_filled + size] = content[offset:offset + size]
+                part_filled += size
+                offset += size
+        if part_filled or not parts:
+            await upload_part(part_buffer if part_filled == PART_SIZE else part_buffer[:part_filled])
+
+    try:
+        if buffer is None:
+            async with buffer_pool.buffer() as pooled_buffer:
+                await upload_parts(pooled_buffer, 0)
+        else:
+            await upload_parts(buffer, filled)
+        await s3_client.complete_multipart_upload(
+            Bucket=config.s3_info.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        await s3_client.abort_multipart_upload(
+            Bucket=config.s3_info.bucket,
+            Key=key,
+            UploadId=upload_id
+        )
+        raise
+
+
+@file_logger.catch()
+async def stream_file_to_s3(
+        stream: AsyncIterator[bytes]
+) -> Tuple[str, str, int, Optional[JSONResponse]]:
+    """
+    Function for uploading request stream to s3 with md5 calculation on the fly.
+    Bytes are sent to a temporary key by multipart upload from pooled buffer,
+    so memory usage is bounded by PART_SIZE and nothing is written to local disk
+    :param stream: Async iterator with file content
+    :return:
+    """
+    temp_key = f"files.tmp/{uuid4()}"
+    try:
+        md5_hash = hashlib.md5()
+        file_size = 0
+
+        async def hashed_stream():
+            nonlocal file_size
+            async for content in stream:
+                file_size += len(content)
+                md5_hash.update(content)
+                yield content
+
+        await upload_stream_to_s3(
+            stream=hashed_stream(),
+            key=temp_key
+        )
+        return temp_key, str(md5_hash.hexdigest()), file_size, None
+    except Exception as error:
+        return temp_key, "", 0, JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while streaming upload to s3",
+                "error": f"{error=}"
+            }
+        )
+
+
+@file_logger.catch()
+async def move_streamed_file(
+        temp_key: str,
+        md5_hash: str,
+        file_size: int,
+        exists: bool
+) -> Optional[JSONResponse]:
+    """
+    Function for moving streamed file from temporary key to files.md5/{md5}.
+    Object is copied inside s3, if md5 already exists in db temporary object is just deleted
+    :param temp_key: temporary key of file in s3
+    :param md5_hash: md5 hash of file
+    :param file_size: file size
+    :param exists: is md5 already in db
+    :return:
+    """
+    try:
+        if not exists:
+            await copy_object(
+                copy_from={"Bucket": config.s3_info.bucket, "Key": temp_key},
+                key=f"files.md5/{md5_hash}",
+                size=file_size,
+                part_size=PART_SIZE
+            )
+        s3_client = await get_s3_client()
+        await s3_client.delete_object(
+            Bucket=config.s3_info.bucket,
+            Key=temp_key
+        )
+        return None
+    except Exception as error:
+        return JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while moving streamed file in s3",
+                "error": f"{error=}"
+            }
+        )
+
+
+async def delete_temp_file(
+        temp_key: str
+):
+    """
+    Function for deleting temporary object of failed streaming upload,
+    errors are only logged
+    :param temp_key: temporary key of file in s3
+    :return:
+    """
+    try:
+        s3_client = await get_s3_client()
+        await s3_client.delete_object(
+            Bucket=config.s3_info.bucket,
+            Key=temp_key
+        )
+    except Exception as error:
+        file_logger.error(f"Error while deleting temporary object {temp_key}: {error=}")
+
+
 @file_logger.catch()
 async def create_new_files_md5(
         md5_hash: str,
@@ -165,6 +452,7 @@ async def create_new_file(
         filename: str,
         folder_id: int,
         md5_hash: str,
+        file_size: int,
         session: AsyncSession
 ) -> Tuple[Optional[Files], Optional[JSONResponse]]:
     """
@@ -172,6 +460,7 @@ async def create_new_file(
     :param filename: name of file
     :param folder_id: id of folder for file
     :param md5_hash: md5 hash of file
+    :param file_size: file size
     :param session: session to db
     :return:
     """
@@ -185,6 +474,16 @@ async def create_new_file(
             md5=md5_hash
         )
         session.add(new_file)
+        await apply_file_delta(
+            session=session,
+            folder_id=folder_id,
+            count=1,
+            size=file_size
+        )
+        await add_events(
+            session=session,
+            events=[file_event(CREATED, new_file.keys, folder_id, filename, md5_hash)]
+        )
         await session.commit()
         await session.refresh(new_file)
         return new_file, None
@@ -197,3 +496,60 @@ async def create_new_file(
             }
         )
 
+
+@file_logger.catch()
+async def create_file_rows(
+        filename: str,
+        folder_id: int,
+        md5_hash: str,
+        file_size: int,
+        mime_type: str,
+        session: AsyncSession
+) -> Tuple[Optional[Files], Optional[JSONResponse]]:
+    """
+    Function for creating md5 and file rows of upload.
+    With coalescer enabled rows are committed in batch with concurrent uploads,
+    transaction of session is committed before, so it does not keep second connection
+    :param filename: name of file
+    :param folder_id: id of folder for file
+    :param md5_hash: md5 hash of file
+    :param file_size: file size
+    :param mime_type: type of file
+    :param session: session to db
+    :return:
+    """
+    if not config.coalescer_info.enabled:
+        error = await create_new_files_md5(
+            md5_hash=md5_hash,
+            file_size=file_size,
+            mime_type=mime_type,
+            session=session
+        )
+        if error:
+            return None, error
+        return await create_new_file(
+            filename=filename,
+            folder_id=folder_id,
+            md5_hash=md5_hash,
+            file_size=file_size,
+            session=session
+        )
+
+    try:
+        await session.commit()
+        new_file = await write_coalescer.submit(
+            filename=filename,
+            folder_id=folder_id,
+            md5_hash=md5_hash,
+            file_size=file_size,
+            mime_type=mime_type
+        )
+        return new_file, None
+    except Exception as error:
+        return None, JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while creating new file row in db",
+                "error": f"{error=}"
+            }
+        )
@@ -0,0 +1,235 @@
+"""
+Module for folder statistics services.
+Functions here do not commit, they are executed in transaction of caller
+"""
+from typing import Dict, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+ANCESTORS_CTE = """
+with recursive ancestors(id, parent_id) as (
+    select id, parent_id
+    from app.files_tree
+    where id = :folder_id
+    union
+    select files_tree.id, files_tree.parent_id
+    from app.files_tree
+    join ancestors on files_tree.id = ancestors.parent_id
+)
+"""
+
+# Deltas of many folders in one statement, every ancestor gets sum of deltas
+# of its descendants. Rows are upserted in order of folder id
+APPLY_FILE_DELTAS = text("""
+with recursive changed(folder_id, count, size) as (
+    select *
+    from unnest(cast(:folder_ids as bigint[]), cast(:counts as bigint[]), cast(:sizes as bigint[]))
+), ancestors(id, parent_id, folder_id) as (
+    select files_tree.id, files_tree.parent_id, changed.folder_id
+    from app.files_tree
+    join changed on files_tree.id = changed.folder_id
+    union
+    select files_tree.id, files_tree.parent_id, ancestors.folder_id
+    from app.files_tree
+    join ancestors on files_tree.id = ancestors.parent_id
+)
+insert into app.folder_stats (
+    folder_id, direct_count, direct_size, recursive_count, recursive_size
+)
+select
+    ancestors.id,
+    sum(case when ancestors.id = changed.folder_id then changed.count else 0 end),
+    sum(case when ancestors.id = changed.folder_id then changed.size else 0 end),
+    sum(changed.count),
+    sum(changed.size)
+from ancestors
+join changed on changed.folder_id = ancestors.folder_id
+group by ancestors.id
+order by ancestors.id
+on conflict (folder_id) do update set
+    direct_count = folder_stats.direct_count + excluded.direct_count,
+    direct_size = folder_stats.direct_size + excluded.direct_size,
+    recursive_count = folder_stats.recursive_count + excluded.recursive_count,
+    recursive_size = folder_stats.recursive_size + excluded.recursive_size
+""")
+
+SUBTRACT_FOLDER = text(ANCESTORS_CTE + """
+update app.folder_stats
+set recursive_count = folder_stats.recursive_count - deleted.recursive_count,
+    recursive_size = folder_stats.recursive_size - deleted.recursive_size
+from app.folder_stats as deleted
+where deleted.folder_id = :folder_id
+  and folder_stats.folder_id in (select id from ancestors where id <> :folder_id)
+""")
+
+ATTACH_FOLDER = text(ANCESTORS_CTE + """
+insert into app.folder_stats (
+    folder_id, direct_count, direct_size, recursive_count, recursive_size
+)
+select ancestors.id, 0, 0, attached.recursive_count, attached.recursive_size
+from ancestors
+join app.folder_stats as attached on attached.folder_id = :attached_id
+on conflict (folder_id) do update set
+    recursive_count = folder_stats.recursive_count + excluded.recursive_count,
+    recursive_size = folder_stats.recursive_size + excluded.recursive_size
+""")
+
+DELETE_FOLDER = text("""
+delete from app.folder_stats
+where folder_id = :folder_id
+""")
+
+REBUILD = text("""
+with recursive direct as (
+    select files.folder_id,
+           count(*) as direct_count,
+           coalesce(sum(files_md5.file_size), 0) as direct_size
+    from app.files
+    left join app.files_md5 on files_md5.id = files.md5
+    group by files.folder_id
+), closure(ancestor_id, folder_id) as (
+    select id, id
+    from app.files_tree
+    union
+    select files_tree.parent_id, closure.folder_id
+    from closure
+    join app.files_tree on files_tree.id = closure.ancestor_id
+    where files_tree.parent_id <> files_tree.id
+), recursive_totals as (
+    select closure.ancestor_id as folder_id,
+           sum(direct.direct_count) as recursive_count,
+           sum(direct.direct_size) as recursive_size
+    from closure
+    join direct on direct.folder_id = closure.folder_id
+    group by closure.ancestor_id
+)
+insert into app.folder_stats (
+    folder_id, direct_count, direct_size, recursive_count, recursive_size
+)
+select files_tree.id,
+       coalesce(direct.direct_count, 0),
+       coalesce(direct.direct_size, 0),
+       coalesce(recursive_totals.recursive_count, 0),
+       coalesce(recursive_totals.recursive_size, 0)
+from app.files_tree
+left join direct on direct.folder_id = files_tree.id
+left join recursive_totals on recursive_totals.folder_id = files_tree.id
+on conflict (folder_id) do update set
+    direct_count = excluded.direct_count,
+    direct_size = excluded.direct_size,
+    recursive_count = excluded.recursive_count,
+    recursive_size = excluded.recursive_size
+""")
+
+
+async def apply_file_deltas(
+        session: AsyncSession,
+        deltas: Dict[int, Tuple[int, int]]
+):
+    """
+    Function for changing counters of many folders and all their ancestors
+    in one statement
+    :param session: session to db
+    :param deltas: change of file count and total size in bytes by folder id
+    :return:
+    """
+    if not deltas:
+        return
+    await session.execute(
+        APPLY_FILE_DELTAS,
+        {
+            "folder_ids": list(deltas),
+            "counts": [count for count, _ in deltas.values()],
+            "sizes": [size for _, size in deltas.values()]
+        }
+    )
+
+
+async def apply_file_delta(
+        session: AsyncSession,
+        folder_id: int,
+        count: int,
+        size: int
+):
+    """
+    Function for changing counters of folder and all its ancestors
+    :param session: session to db
+    :param folder_id: id of folder with changed files
+    :param count: change of file count
+    :param size: change of total size in bytes
+    :return:
+    """
+    await apply_file_deltas(
+        session=session,
+        deltas={folder_id: (count, size)}
+    )
+
+
+async def detach_folder_stats(
+        session: AsyncSession,
+        folder_id: int
+):
+    """
+    Function for subtracting recursive totals of folder from its ancestors.
+    Must be called before folder is deleted or moved
+    :param session: session to db
+    :param folder_id: id of folder
+    :return:
+    """
+    await session.execute(
+        SUBTRACT_FOLDER,
+        {"folder_id": folder_id}
+    )
+
+
+async def attach_folder_stats(
+        session: AsyncSession,
+        folder_id: int,
+        parent_id: int
+):
+    """
+    Function for adding recursive totals of folder to new parent
+    and its ancestors. Must be called after folder is copied or moved
+    :param session: session to db
+    :param folder_id: id of folder
+    :param parent_id: id of new parent folder
+    :return:
+    """
+    await session.execute(
+        ATTACH_FOLDER,
+        {"folder_id": parent_id, "attached_id": folder_id}
+    )
+
+
+async def remove_folder_stats(
+        session: AsyncSession,
+        folder_id: int
+):
+    """
+    Function for removing folder counters and subtracting
+    its recursive totals from ancestors. Must be called before
+    folder row is deleted
+    :param session: session to db
+    :param folder_id: id of deleted folder
+    :return:
+    """
+    await detach_folder_stats(
+        session=session,
+        folder_id=folder_id
+    )
+    await session.execute(
+        DELETE_FOLDER,
+        {"folder_id": folder_id}
+    )
+
+
+async def rebuild_folder_stats(
+        session: AsyncSession
+):
+    """
+    Function for recalculating all counters from app.files
+    :param session: session to db
+    :return:
+    """
+    await session.execute(REBUILD)
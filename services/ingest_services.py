@@ -0,0 +1,304 @@
+"""
+Module for server-side ingest of existing S3 objects.
+Objects are copied inside S3 to files.md5/{md5}, bytes go through API
+only when md5 can not be taken from ETag of source
+"""
+import asyncio
+import hashlib
+import mimetypes
+import posixpath
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+from uuid import uuid4
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import String, any_, bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from config import config
+from logger import file_logger
+from models.files import Files, FilesMD5, FilesTree
+from schemas.files import IngestSource
+from services.bulk_services import insert_rows
+from services.event_services import CREATED, add_events, file_event
+from services.folder_stats_services import apply_file_delta
+from storage import copy_object, get_s3_client
+
+READ_SIZE = 1024 * 1024
+MD5_ETAG = re.compile(r"[0-9a-f]{32}")
+
+
+@dataclass
+class IngestItem:
+    """
+    Object of source bucket which is ingested, error is set for failed object
+    """
+    bucket: str
+    key: str
+    filename: str
+    size: int = 0
+    mime_type: str = "application/octet-stream"
+    etag: str = ""
+    md5: str = ""
+    error: Optional[str] = None
+
+
+def etag_md5(
+        head: dict
+) -> Optional[str]:
+    """
+    Function for getting md5 from ETag of source.
+    ETag is md5 of content only for single part objects without SSE-KMS and SSE-C
+    :param head: result of head_object
+    :return: md5 or None
+    """
+    if head.get("ServerSideEncryption") == "aws:kms" or head.get("SSECustomerAlgorithm"):
+        return None
+    etag = head.get("ETag", "").strip('"').lower()
+    return etag if MD5_ETAG.fullmatch(etag) else None
+
+
+async def hash_source(
+        item: IngestItem
+) -> str:
+    """
+    Function for calculating md5 of source by streaming it
+    :param item: source object
+    :return:
+    """
+    s3_client = await get_s3_client()
+    result = await s3_client.get_object(
+        Bucket=item.bucket,
+        Key=item.key,
+        IfMatch=item.etag
+    )
+    md5_hash = hashlib.md5()
+    async with result["Body"] as body:
+        while content := await body.read(READ_SIZE):
+            md5_hash.update(content)
+    return md5_hash.hexdigest()
+
+
+async def inspect_source(
+        item: IngestItem,
+        semaphore: asyncio.Semaphore
+):
+    """
+    Function for getting size, type and md5 of source, error is saved in item
+    :param item: source object
+    :param semaphore: limit of concurrent sources
+    :return:
+    """
+    async with semaphore:
+        try:
+            s3_client = await get_s3_client()
+            head = await s3_client.head_object(
+                Bucket=item.bucket,
+                Key=item.key
+            )
+            item.size = head["ContentLength"]
+            item.etag = head.get("ETag", "")
+            item.mime_type = mimetypes.guess_type(item.filename)[0] \
+                or head.get("ContentType") \
+                or item.mime_type
+            item.md5 = (config.ingest_info.trust_etag and etag_md5(head)) \
+                or await hash_source(item)
+        except Exception as error:
+            item.error = f"{error=}"
+
+
+async def copy_source(
+        item: IngestItem,
+        semaphore: asyncio.Semaphore,
+        part_semaphore: asyncio.Semaphore
+):
+    """
+    Function for copying source to files.md5/{md5} inside S3.
+    Big objects are copied by parts with UploadPartCopy,
+    source must not change after inspection
+    :param item: inspected source object
+    :param semaphore: limit of concurrent sources
+    :param part_semaphore: limit of concurrent part copies
+    :return:
+    """
+    bucket = config.s3_info.bucket
+    key = f"files.md5/{item.md5}"
+    copy_from = {"Bucket": item.bucket, "Key": item.key}
+    if copy_from == {"Bucket": bucket, "Key": key}:
+        return
+
+    async with semaphore:
+        try:
+            await copy_object(
+                copy_from=copy_from,
+                key=key,
+                size=item.size,
+                part_size=config.ingest_info.copy_part_size,
+                threshold=config.ingest_info.multipart_copy_threshold,
+                if_match=item.etag,
+                part_semaphore=part_semaphore
+            )
+        except Exception as error:
+            item.error = f"{error=}"
+
+
+async def create_ingest_rows(
+        items: List[IngestItem],
+        folder_id: int,
+        session: AsyncSession
+) -> List[dict]:
+    """
+    Function for bulk creating md5, file and event rows of ingested objects without commit
+    :param items: copied objects
+    :param folder_id: id of target folder
+    :param session: session to db
+    :return: file rows
+    """
+    inserted = datetime.today()
+    md5_rows = {}
+    for item in items:
+        md5_rows.setdefault(item.md5, {
+            "id": item.md5,
+            "mime_type": item.mime_type,
+            "file_size": item.size,
+            "inserted": inserted,
+            "inserted_by": "StarWorker"
+        })
+    await insert_rows(
+        session=session,
+        table=FilesMD5.__table__,
+        rows=list(md5_rows.values()),
+        ignore_conflicts=True
+    )
+
+    file_rows = [
+        {
+            "filename": item.filename,
+            "folder_id": folder_id,
+            "keys": uuid4(),
+            "inserted": inserted,
+            "inserted_by": "StarWorker",
+            "md5": item.md5
+        }
+        for item in items
+    ]
+    await insert_rows(
+        session=session,
+        table=Files.__table__,
+        rows=file_rows
+    )
+    await apply_file_delta(
+        session=session,
+        folder_id=folder_id,
+        count=len(items),
+        size=sum(item.size for item in items)
+    )
+    await add_events(
+        session=session,
+        events=[
+            file_event(CREATED, row["keys"], folder_id, row["filename"], row["md5"])
+            for row in file_rows
+        ]
+    )
+    return file_rows
+
+
+@file_logger.catch()
+async def ingest_from_s3(
+        sources: List[IngestSource],
+        folder_id: int,
+        session: AsyncSession
+) -> Tuple[Optional[dict], Optional[JSONResponse]]:
+    """
+    Function for ingesting existing S3 objects into folder without downloading them.
+    Only objects with unknown md5 are copied, failed sources are reported
+    and do not fail others, all rows are inserted in one transaction
+    :param sources: bucket and key of objects
+    :param folder_id: id of target folder
+    :param session: session to db
+    :return:
+    """
+    try:
+        result = await session.execute(
+            select(FilesTree.id)
+            .where(FilesTree.id == folder_id)
+        )
+        if not result.first():
+            return None, JSONResponse(
+                status_code=404,
+                content={
+                    "message": f"Folder with {folder_id=} is not exists",
+                    "error": None
+                }
+            )
+
+        items = [
+            IngestItem(
+                bucket=source.bucket or config.s3_info.bucket,
+                key=source.key,
+                filename=source.filename or posixpath.basename(source.key) or source.key
+            )
+            for source in sources
+        ]
+        semaphore = asyncio.Semaphore(max(1, config.ingest_info.concurrency))
+        await asyncio.gather(*(inspect_source(item, semaphore) for item in items))
+
+        all_md5 = list({item.md5 for item in items if not item.error})
+        result = await session.execute(
+            select(FilesMD5.id)
+            .where(FilesMD5.id == any_(bindparam("md5", value=all_md5, type_=ARRAY(String))))
+        )
+        new_md5 = set(all_md5) - set(result.scalars().all())
+
+        to_copy = {}
+        for item in items:
+            if not item.error and item.md5 in new_md5:
+                to_copy.setdefault(item.md5, item)
+        part_semaphore = asyncio.Semaphore(max(1, config.s3_info.upload_concurrency))
+        await asyncio.gather(*(
+            copy_source(item, semaphore, part_semaphore) for item in to_copy.values()
+        ))
+        failed_md5 = {md5_hash for md5_hash, item in to_copy.items() if item.error}
+        for item in items:
+            if not item.error and item.md5 in failed_md5:
+                item.error = "Copy of object with same md5 failed"
+
+        ingested = [item for item in items if not item.error]
+        file_rows = await create_ingest_rows(
+            items=ingested,
+            folder_id=folder_id,
+            session=session
+        ) if ingested else []
+        await session.commit()
+
+        file_keys = {id(item): row["keys"] for item, row in zip(ingested, file_rows)}
+        return {
+            "files": len(file_rows),
+            "copied": len(to_copy) - len(failed_md5),
+            "deduplicated": len(ingested) - len(to_copy) + len(failed_md5),
+            "failed": len(items) - len(ingested),
+            "items": [
+                {
+                    "bucket": item.bucket,
+                    "key": item.key,
+                    "keys": str(file_keys[id(item)]) if id(item) in file_keys else None,
+                    "md5": item.md5 or None,
+                    "size": item.size,
+                    "error": item.error
+                }
+                for item in items
+            ]
+        }, None
+    except Exception as error:
+        await session.rollback()
+        return None, JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while ingesting objects from s3",
+                "error": f"{error=}"
+            }
+        )
@@ -0,0 +1,365 @@
+"""
+Module for metadata-only copy and move of files and folders.
+Blobs are addressed by md5, so only rows are copied
+"""
+from typing import Optional, Tuple
+
+from fastapi.responses import JSONResponse
+from pydantic import UUID4
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from logger import file_logger
+from models.files import Files, FilesMD5, FilesTree
+from services.event_services import CREATED, MOVED, add_events, file_event, folder_event
+from services.folder_stats_services import (
+    apply_file_delta,
+    attach_folder_stats,
+    detach_folder_stats
+)
+
+SUBTREE_CTE = """
+with recursive subtree(id) as (
+    select id
+    from app.files_tree
+    where id = :folder_id
+    union
+    select files_tree.id
+    from app.files_tree
+    join subtree on files_tree.parent_id = subtree.id
+    where files_tree.id <> files_tree.parent_id
+)
+"""
+
+COPY_FILE = text("""
+insert into app.files (filename, folder_id, keys, inserted, inserted_by, md5)
+select filename, cast(:target_folder_id as bigint), gen_random_uuid(), localtimestamp, 'StarWorker', md5
+from app.files
+where keys = :keys
+returning id, keys, filename, md5
+""")
+
+# Ids for new folders are taken from sequence in materialized mapping,
+# so parents are remapped in the same statement
+COPY_SUBTREE = text(SUBTREE_CTE + """
+, mapping as materialized (
+    select id as old_id,
+           nextval(pg_get_serial_sequence('app.files_tree', 'id')) as new_id
+    from subtree
+), new_folders as (
+    insert into app.files_tree (id, parent_id, name, keys, inserted, inserted_by, order_n)
+    select mapping.new_id,
+           coalesce(parent_mapping.new_id, cast(:target_folder_id as bigint)),
+           files_tree.name,
+           gen_random_uuid(),
+           localtimestamp,
+           'StarWorker',
+           files_tree.order_n
+    from app.files_tree
+    join mapping on mapping.old_id = files_tree.id
+    left join mapping as parent_mapping
+        on parent_mapping.old_id = files_tree.parent_id
+       and files_tree.id <> :folder_id
+    returning id, parent_id, name, keys
+), new_files as (
+    insert into app.files (filename, folder_id, keys, inserted, inserted_by, md5)
+    select files.filename,
+           mapping.new_id,
+           gen_random_uuid(),
+           localtimestamp,
+           'StarWorker',
+           files.md5
+    from app.files
+    join mapping on mapping.old_id = files.folder_id
+    returning keys, folder_id, filename, md5
+), new_events as (
+    insert into app.change_events (entity, action, keys, folder_id, parent_id, name, md5)
+    select 'folder', 'created', keys, id, parent_id, name, null
+    from new_folders
+    union all
+    select 'file', 'created', keys, folder_id, null, filename, md5
+    from new_files
+    returning id
+), new_stats as (
+    insert into app.folder_stats (
+        folder_id, direct_count, direct_size, recursive_count, recursive_size
+    )
+    select mapping.new_id,
+           folder_stats.direct_count,
+           folder_stats.direct_size,
+           folder_stats.recursive_count,
+           folder_stats.recursive_size
+    from app.folder_stats
+    join mapping on mapping.old_id = folder_stats.folder_id
+    returning folder_id
+)
+select (select new_id from mapping where old_id = :folder_id) as new_folder_id,
+       (select count(*) from new_folders) as folders,
+       (select count(*) from new_files) as files
+""")
+
+IN_SUBTREE = text(SUBTREE_CTE + """
+select exists(select 1 from subtree where id = :target_folder_id)
+""")
+
+
+def error_response(
+        status_code: int,
+        message: str
+) -> JSONResponse:
+    """
+    Function for building error response without exception
+    :param status_code: status code of response
+    :param message: message of error
+    :return:
+    """
+    return JSONResponse(
+        status_code=status_code,
+        content={
+            "message": message,
+            "error": None
+        }
+    )
+
+
+async def get_folder(
+        folder_id: int,
+        session: AsyncSession
+) -> Optional[FilesTree]:
+    """
+    Function for getting folder row by id
+    :param folder_id: id of folder
+    :param session: session to db
+    :return: folder or None
+    """
+    result = await session.execute(
+        select(FilesTree)
+        .where(FilesTree.id == folder_id)
+    )
+    return result.scalars().first()
+
+
+async def get_file_with_size(
+        keys: UUID4,
+        session: AsyncSession
+) -> Tuple[Optional[Files], int]:
+    """
+    Function for getting file row with size of its content
+    :param keys: keys of file
+    :param session: session to db
+    :return: file or None and file size, 0 if md5 row is missing
+    """
+    result = await session.execute(
+        select(Files, FilesMD5.file_size)
+        .join(FilesMD5, FilesMD5.id == Files.md5, isouter=True)
+        .where(Files.keys == keys)
+    )
+    row = result.first()
+    if not row:
+        return None, 0
+    return row[0], row[1] or 0
+
+
+@file_logger.catch()
+async def copy_file(
+        keys: UUID4,
+        target_folder_id: int,
+        session: AsyncSession
+) -> Tuple[Optional[dict], Optional[JSONResponse]]:
+    """
+    Function for copying file row into folder
+    :param keys: keys of file
+    :param target_folder_id: id of target folder
+    :param session: session to db
+    :return: id and keys of new file
+    """
+    try:
+        file, file_size = await get_file_with_size(keys=keys, session=session)
+        if not file:
+            return None, error_response(404, f"File with {keys=} is not found")
+        if not await get_folder(folder_id=target_folder_id, session=session):
+            return None, error_response(404, f"Folder with {target_folder_id=} is not exists")
+
+        result = await session.execute(
+            COPY_FILE,
+            {"keys": keys, "target_folder_id": target_folder_id}
+        )
+        new_id, new_keys, filename, md5_hash = result.one()
+        await apply_file_delta(
+            session=session,
+            folder_id=target_folder_id,
+            count=1,
+            size=file_size
+        )
+        await add_events(
+            session=session,
+            events=[file_event(CREATED, new_keys, target_folder_id, filename, md5_hash)]
+        )
+        await session.commit()
+        return {"id": new_id, "keys": str(new_keys)}, None
+    except Exception as error:
+        await session.rollback()
+        return None, JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while copying file",
+                "error": f"{error=}"
+            }
+        )
+
+
+@file_logger.catch()
+async def move_file(
+        keys: UUID4,
+        target_folder_id: int,
+        session: AsyncSession
+) -> Optional[JSONResponse]:
+    """
+    Function for moving file row into folder
+    :param keys: keys of file
+    :param target_folder_id: id of target folder
+    :param session: session to db
+    :return:
+    """
+    try:
+        file, file_size = await get_file_with_size(keys=keys, session=session)
+        if not file:
+            return error_response(404, f"File with {keys=} is not found")
+        if not await get_folder(folder_id=target_folder_id, session=session):
+            return error_response(404, f"Folder with {target_folder_id=} is not exists")
+        if file.folder_id == target_folder_id:
+            return None
+
+        await apply_file_delta(
+            session=session,
+            folder_id=file.folder_id,
+            count=-1,
+            size=-file_size
+        )
+        file.folder_id = target_folder_id
+        await apply_file_delta(
+            session=session,
+            folder_id=target_folder_id,
+            count=1,
+            size=file_size
+        )
+        await add_events(
+            session=session,
+            events=[file_event(MOVED, file.keys, target_folder_id, file.filename, file.md5)]
+        )
+        await session.commit()
+        return None
+    except Exception as error:
+        await session.rollback()
+        return JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while moving file",
+                "error": f"{error=}"
+            }
+        )
+
+
+@file_logger.catch()
+async def copy_folder(
+        folder_id: int,
+        target_folder_id: int,
+        session: AsyncSession
+) -> Tuple[Optional[dict], Optional[JSONResponse]]:
+    """
+    Function for copying folder subtree with files into folder.
+    Whole subtree is copied by one statement
+    :param folder_id: id of copied folder
+    :param target_folder_id: id of target folder
+    :param session: session to db
+    :return: id of new folder and count of copied folders and files
+    """
+    try:
+        if not await get_folder(folder_id=folder_id, session=session):
+            return None, error_response(404, f"Folder with {folder_id=} is not exists")
+        if not await get_folder(folder_id=target_folder_id, session=session):
+            return None, error_response(404, f"Folder with {target_folder_id=} is not exists")
+
+        result = await session.execute(
+            COPY_SUBTREE,
+            {"folder_id": folder_id, "target_folder_id": target_folder_id}
+        )
+        new_folder_id, folders, files = result.one()
+        await attach_folder_stats(
+            session=session,
+            folder_id=new_folder_id,
+            parent_id=target_folder_id
+        )
+        await session.commit()
+        return {
+            "folder_id": new_folder_id,
+            "folders": folders,
+            "files": files
+        }, None
+    except Exception as error:
+        await session.rollback()
+        return None, JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while copying folder",
+                "error": f"{error=}"
+            }
+        )
+
+
+@file_logger.catch()
+async def move_folder(
+        folder_id: int,
+        target_folder_id: int,
+        session: AsyncSession
+) -> Optional[JSONResponse]:
+    """
+    Function for moving folder subtree into folder
+    :param folder_id: id of moved folder
+    :param target_folder_id: id of target folder
+    :param session: session to db
+    :return:
+    """
+    try:
+        folder = await get_folder(folder_id=folder_id, session=session)
+        if not folder:
+            return error_response(404, f"Folder with {folder_id=} is not exists")
+        if folder.parent_id == folder.id:
+            return error_response(400, "Root folder of article can not be moved")
+        if not await get_folder(folder_id=target_folder_id, session=session):
+            return error_response(404, f"Folder with {target_folder_id=} is not exists")
+
+        result = await session.execute(
+            IN_SUBTREE,
+            {"folder_id": folder_id, "target_folder_id": target_folder_id}
+        )
+        if result.scalar():
+            return error_response(400, "Folder can not be moved into itself")
+
+        await detach_folder_stats(
+            session=session,
+            folder_id=folder_id
+        )
+        folder.parent_id = target_folder_id
+        await session.flush()
+        await attach_folder_stats(
+            session=session,
+            folder_id=folder_id,
+            parent_id=target_folder_id
+        )
+        await add_events(
+            session=session,
+            events=[folder_event(MOVED, folder.keys, folder_id, target_folder_id, folder.name)]
+        )
+        await session.commit()
+        return None
+    except Exception as error:
+        await session.rollback()
+        return JSONResponse(
+            status_code=500,
+            content={
+                "message": "Error while moving folder",
+                "error": f"{error=}"
+            }
+        )
@@ -0,0 +1,139 @@
+"""
+Shared S3 client.
+Client is opened once per worker, so its connection pool
+is reused by all requests
+"""
+import asyncio
+import math
+from contextlib import AsyncExitStack
+from typing import Optional
+
+import aioboto3
+from aiobotocore.config import AioConfig
+
+from config import config
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024  # also limit of single CopyObject
+MAX_PARTS = 10000
+
+s3_session = aioboto3.Session()
+
+_exit_stack: Optional[AsyncExitStack] = None
+_s3_client = None
+_client_lock = asyncio.Lock()
+
+
+async def get_s3_client():
+    """
+    Function for getting shared S3 client. Client is opened on first call
+    if it was not opened on startup
+    :return: S3 client
+    """
+    global _exit_stack, _s3_client  # pylint: disable=global-statement
+    if _s3_client is not None:
+        return _s3_client
+    async with _client_lock:
+        if _s3_client is None:
+            exit_stack = AsyncExitStack()
+            _s3_client = await exit_stack.enter_async_context(
+                s3_session.client(
+                    "s3",
+                    endpoint_url=config.s3_info.host,
+                    aws_access_key_id=config.s3_info.access_key,
+                    aws_secret_access_key=config.s3_info.secret_key,
+                    config=AioConfig(
+                        max_pool_connections=config.s3_info.max_pool_connections
+                    )
+                )
+            )
+            _exit_stack = exit_stack
+    return _s3_client
+
+
+async def close_s3_client():
+    """
+    Function for closing shared S3 client and its connections
+    :return:
+    """
+    global _exit_stack, _s3_client  # pylint: disable=global-statement
+    async with _client_lock:
+        if _exit_stack is not None:
+            await _exit_stack.aclose()
+        _exit_stack = None
+        _s3_client = None
+
+
+async def copy_object(
+        copy_from: dict,
+        key: str,
+        size: int,
+        part_size: int,
+        threshold: int = MAX_PART_SIZE,
+        if_match: Optional[str] = None,
+        part_semaphore: Optional[asyncio.Semaphore] = None
+):
+    """
+    Function for copying object inside S3 without passing bytes through API.
+    Objects from threshold are copied by parts with UploadPartCopy. Errors are raised
+    :param copy_from: bucket and key of source
+    :param key: key of copy in bucket from config
+    :param size: size of source
+    :param part_size: size of part for multipart copy
+    :param threshold: size from which multipart copy is used, at most 5 GB
+    :param if_match: ETag which source must have
+    :param part_semaphore: limit of concurrent part copies
+    :return:
+    """
+    s3_client = await get_s3_client()
+    bucket = config.s3_info.bucket
+    condition = {"CopySourceIfMatch": if_match} if if_match else {}
+    if size < min(threshold, MAX_PART_SIZE):
+        await s3_client.copy_object(
+            Bucket=bucket,
+            Key=key,
+            CopySource=copy_from,
+            **condition
+        )
+        return
+
+    part_size = min(max(part_size, MIN_PART_SIZE, math.ceil(size / MAX_PARTS)), MAX_PART_SIZE)
+    part_semaphore = part_semaphore or asyncio.Semaphore(max(1, config.s3_info.upload_concurrency))
+    upload = await s3_client.create_multipart_upload(
+        Bucket=bucket,
+        Key=key
+    )
+    upload_id = upload["UploadId"]
+
+    async def copy_part(number: int, start: int) -> dict:
+        end = min(start + part_size, size) - 1
+        async with part_semaphore:
+            result = await s3_client.upload_part_copy(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                CopySource=copy_from,
+                CopySourceRange=f"bytes={start}-{end}",
+                **condition
+            )
+        return {"PartNumber": number, "ETag": result["CopyPartResult"]["ETag"]}
+
+    try:
+        parts = await asyncio.gather(*(
+            copy_part(number, start)
+            for number, start in enumerate(range(0, size, part_size), start=1)
+        ))
+        await s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        await s3_client.abort_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id
+        )
+        raise